@@ -0,0 +1,9 @@
+"""Benchmarks and load tests for the backend.
+
+    python -m bench run                 # micro-benchmarks + ASGI load test -> bench/results/
+    python -m bench compare a.json b.json
+    python -m bench serve --port 9000   # fake NOAA datagetter for a real uvicorn run
+    python -m bench record 8467150 --begin 20250101 --end 20250131
+
+Nothing here talks to the real NOAA API except ``record``.
+"""
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from bench import load, micro
+from bench.fake_upstream import PAYLOADS_DIR, FakeUpstream, record
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+VERSION_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "VERSION")
+# Metrics where a larger number is better; everything else ending in _us/_ms is a latency
+HIGHER_IS_BETTER = ("rps", "ops_per_s", "points_per_s")
+
+
+def environment():
+    try:
+        with open(VERSION_PATH) as f:
+            version = f.read().strip()
+    except OSError:
+        version = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "version": version,
+        "commit": commit,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def flatten(data, prefix=""):
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(old, new, threshold):
+    """Print metric changes; returns the names that regressed by more than ``threshold``."""
+    before = dict(flatten({k: old[k] for k in ("micro", "load") if k in old}))
+    after = dict(flatten({k: new[k] for k in ("micro", "load") if k in new}))
+    regressions = []
+    for name in sorted(before.keys() & after.keys()):
+        leaf = name.rsplit(".", 1)[-1]
+        higher = leaf in HIGHER_IS_BETTER
+        if not (higher or leaf.endswith("_us") or leaf.endswith("_ms")) or not before[name]:
+            continue
+        change = (after[name] - before[name]) / before[name]
+        worse = -change if higher else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:80} {before[name]:>12.3f} -> {after[name]:>12.3f} {change:+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Backend benchmarks and load tests")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks and save JSON results")
+    run.add_argument("--quick", action="store_true", help="small tables and request counts (smoke run)")
+    run.add_argument("--skip-micro", action="store_true")
+    run.add_argument("--skip-load", action="store_true")
+    run.add_argument("--sizes", default="1000,10000,100000", help="locations table sizes for micro-benchmarks")
+    run.add_argument("--repeat", type=int, default=200)
+    run.add_argument("--endpoints", default=",".join(load.ENDPOINTS))
+    run.add_argument("--concurrency", type=int, default=32)
+    run.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    run.add_argument("--latency-ms", type=float, default=50.0, help="fake upstream latency")
+    run.add_argument("--jitter-ms", type=float, default=10.0)
+    run.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered 503")
+    run.add_argument("--stations", type=int, default=50, help="distinct stations in the request mix")
+    run.add_argument("--table-size", type=int, default=10000, help="locations rows for the load test")
+    run.add_argument("--out", help="results file (default bench/results/<version>-<time>.json)")
+
+    cmp_ = sub.add_parser("compare", help="compare two results files")
+    cmp_.add_argument("old")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--threshold", type=float, default=0.2, help="relative change counted as a regression")
+
+    serve = sub.add_parser("serve", help="serve the fake NOAA datagetter (set NOAA_API_URL to point the app at it)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=9000)
+    serve.add_argument("--latency-ms", type=float, default=50.0)
+    serve.add_argument("--jitter-ms", type=float, default=10.0)
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--payloads", default=PAYLOADS_DIR)
+
+    rec = sub.add_parser("record", help="save a real NOAA hilo payload for the fake upstream")
+    rec.add_argument("station")
+    rec.add_argument("--begin", required=True, help="YYYYMMDD")
+    rec.add_argument("--end", required=True, help="YYYYMMDD")
+    rec.add_argument("--payloads", default=PAYLOADS_DIR)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        if args.quick:
+            args.sizes, args.repeat, args.requests, args.table_size = "1000,10000", 50, 300, 2000
+        sizes = [int(s) for s in args.sizes.split(",") if s]
+        config = {k: v for k, v in vars(args).items() if k not in ("command", "out")}
+        result = {**environment(), "config": config}
+        if not args.skip_micro:
+            print("micro-benchmarks...", file=sys.stderr)
+            result["micro"] = micro.run(sizes, args.repeat)
+        if not args.skip_load:
+            print("load test...", file=sys.stderr)
+            result["load"] = asyncio.run(load.run(
+                endpoints=[e for e in args.endpoints.split(",") if e], concurrency=args.concurrency,
+                requests=args.requests, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                error_rate=args.error_rate, stations=args.stations, table_size=args.table_size,
+            ))
+            for endpoint, r in result["load"].items():
+                print(f"{endpoint:20} {r['rps']:>8} req/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  "
+                      f"p99 {r['p99_ms']} ms  errors {r['errors']}", file=sys.stderr)
+        out = args.out
+        if not out:
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            out = os.path.join(RESULTS_DIR, f"{result['version'] or 'dev'}-{stamp}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(out)
+        return 0
+
+    if args.command == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    if args.command == "serve":
+        try:
+            import uvicorn
+        except ImportError:
+            print("serve needs uvicorn: pip install uvicorn", file=sys.stderr)
+            return 1
+        fake = FakeUpstream(args.latency_ms, args.jitter_ms, args.error_rate, payloads_dir=args.payloads)
+        print(f"NOAA_API_URL=http://{args.host}:{args.port}/api/prod/datagetter", file=sys.stderr)
+        uvicorn.run(fake, host=args.host, port=args.port, log_level="warning")
+        return 0
+
+    if args.command == "record":
+        print(asyncio.run(record(args.station, args.begin, args.end, args.payloads)))
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Local stand-in for the NOAA datagetter API.
+
+An ASGI app that answers ``/api/prod/datagetter`` requests with recorded
+payloads (``payloads/<station>.json``, see ``python -m bench record``) when
+they cover the requested range in the requested time zone and units, and
+with synthetic semidiurnal predictions otherwise. ``payloads/9447130.json``
+is NOAA's Seattle hilo prediction for 2015-01-01 in lst_ldt / english,
+converted from the GMT / metric recording in ``tests/fixtures``. Latency and error rate are configurable. Use it in process through
+``httpx.ASGITransport`` or serve it with ``python -m bench serve``.
+
+Moon data is computed locally (``moon.py``) and has no upstream to fake.
+"""
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import zlib
+from urllib.parse import parse_qs
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+DATAGETTER_PATH = "/api/prod/datagetter"
+TIDE_PERIOD = 12.4206 * 3600  # M2, seconds
+TIDE_RANGE = 6.0  # feet
+
+
+class FakeUpstream:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None, payloads_dir=PAYLOADS_DIR):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.payloads_dir = payloads_dir
+        self._random = random.Random(seed)
+        self._recorded = {}
+        self.requests = 0
+        self.errors = 0
+        self.recorded_hits = 0
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors, "recorded_hits": self.recorded_hits}
+
+    # --- payloads ---
+    def recorded(self, station):
+        """(predictions, time_zone, units) of the recorded payload for ``station``, or None."""
+        if station not in self._recorded:
+            path = os.path.join(self.payloads_dir or "", f"{station}.json")
+            data = None
+            if self.payloads_dir and os.path.exists(path):
+                with open(path) as f:
+                    payload = json.load(f)
+                # "request" holds the query a payload answers; bench record saves the app's own format
+                request = payload.get("request", {})
+                if payload.get("predictions"):
+                    data = (payload["predictions"], request.get("time_zone", "lst_ldt"), request.get("units", "english"))
+            self._recorded[station] = data
+        return self._recorded[station]
+
+    def recorded_days(self):
+        """Station id -> (first, last) day ("YYYY-MM-DD") of each recorded payload."""
+        days = {}
+        if self.payloads_dir and os.path.isdir(self.payloads_dir):
+            for name in sorted(os.listdir(self.payloads_dir)):
+                station, ext = os.path.splitext(name)
+                recorded = self.recorded(station) if ext == ".json" else None
+                if recorded:
+                    days[station] = (recorded[0][0]["t"][:10], recorded[0][-1]["t"][:10])
+        return days
+
+    @staticmethod
+    def synthetic(station, begin, end, interval):
+        """Predictions for [begin, end] from one M2 constituent with a per-station phase."""
+        phase = zlib.crc32(station.encode()) % 1000 / 1000 * TIDE_PERIOD
+        start = datetime.datetime.combine(begin, datetime.time())
+        stop = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time())
+        epoch = datetime.datetime(1970, 1, 1)
+
+        def fmt(ts):
+            return (epoch + datetime.timedelta(seconds=ts)).strftime("%Y-%m-%d %H:%M")
+
+        t0 = (start - epoch).total_seconds()
+        t1 = (stop - epoch).total_seconds()
+        if interval == "hilo":
+            half = TIDE_PERIOD / 2
+            k = math.ceil((t0 - phase) / half)
+            out = []
+            while phase + k * half < t1:
+                ts = round((phase + k * half) / 60) * 60
+                high = k % 2 == 0
+                out.append({"t": fmt(ts), "v": f"{TIDE_RANGE if high else 0.0:.3f}", "type": "H" if high else "L"})
+                k += 1
+            return out
+        step = 3600 if interval == "h" else 360
+        return [
+            {"t": fmt(ts), "v": f"{TIDE_RANGE / 2 * (1 + math.cos(2 * math.pi * (ts - phase) / TIDE_PERIOD)):.3f}"}
+            for ts in range(int(t0), int(t1), step)
+        ]
+
+    def predictions(self, params):
+        station = params.get("station", "")
+        begin = datetime.datetime.strptime(params["begin_date"], "%Y%m%d").date()
+        end = datetime.datetime.strptime(params["end_date"], "%Y%m%d").date()
+        interval = params.get("interval", "6")
+        recorded = self.recorded(station) if interval == "hilo" else None
+        if recorded and recorded[1:] == (params.get("time_zone", "lst_ldt"), params.get("units", "english")):
+            recorded = recorded[0]
+            first, last = recorded[0]["t"][:10], recorded[-1]["t"][:10]
+            if first <= begin.isoformat() and end.isoformat() <= last:
+                self.recorded_hits += 1
+                return [p for p in recorded if begin.isoformat() <= p["t"][:10] <= end.isoformat()]
+        return self.synthetic(station, begin, end, interval)
+
+    # --- ASGI ---
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        self.requests += 1
+        delay = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return await self._send(send, 503, {"error": {"message": "Service Unavailable"}})
+        if scope["path"] != DATAGETTER_PATH:
+            return await self._send(send, 404, {"error": {"message": "Not Found"}})
+        params = {k: v[0] for k, v in parse_qs(scope["query_string"].decode()).items()}
+        try:
+            body = {"predictions": self.predictions(params)}
+        except (KeyError, ValueError) as exc:
+            body = {"error": {"message": f"Bad request: {exc}"}}
+        await self._send(send, 200, body)
+
+    @staticmethod
+    async def _send(send, status, body):
+        payload = json.dumps(body).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+async def record(station, begin, end, payloads_dir=PAYLOADS_DIR):
+    """Save a real NOAA hilo response for ``station`` to ``payloads_dir``."""
+    import upstream
+    from tides import NOAA_API, NOAA_DATUM, NOAA_PRODUCT, NOAA_TIMEZONE, NOAA_UNITS
+
+    params = {
+        "station": station, "product": NOAA_PRODUCT, "begin_date": begin, "end_date": end,
+        "datum": NOAA_DATUM, "units": NOAA_UNITS, "time_zone": NOAA_TIMEZONE, "format": "json", "interval": "hilo",
+    }
+    try:
+        data = await upstream.get_json(NOAA_API, params=params)
+    finally:
+        await upstream.close()
+    if "predictions" not in data:
+        raise ValueError(f"NOAA returned no predictions: {data.get('error')}")
+    os.makedirs(payloads_dir, exist_ok=True)
+    path = os.path.join(payloads_dir, f"{station}.json")
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
@@ -0,0 +1,160 @@
+"""End-to-end load test: the ASGI app driven at fixed concurrency.
+
+Requests go through ``httpx.ASGITransport`` (no sockets), and the app's
+upstream client is pointed at ``FakeUpstream``, so results measure our code
+plus the simulated upstream latency, not the network or NOAA.
+"""
+import asyncio
+import datetime
+import math
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from bench.fake_upstream import FakeUpstream
+from bench.micro import locations_db
+
+ENDPOINTS = ("/tide/today", "/tide/week", "/locations/search")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), math.ceil(p / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    ms = sorted(x * 1000 for x in latencies)
+    done = len(ms) + errors
+    return {
+        "requests": done,
+        "errors": errors,
+        "rps": round(done / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3) if ms else None,
+        "p95_ms": round(percentile(ms, 95), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 99), 3) if ms else None,
+        "max_ms": round(ms[-1], 3) if ms else None,
+    }
+
+
+async def drive(client, next_request, concurrency, requests):
+    """Run ``requests`` requests with ``concurrency`` workers.
+
+    ``next_request()`` returns (path, params). Returns (latencies of warm and
+    of cold 2xx responses in seconds, error count, elapsed seconds). A request
+    is cold when no request with the same path and params had been answered
+    when it started, i.e. it paid for (or waited on) the upstream fetch that
+    warms the caches.
+    """
+    warm, cold = [], []
+    answered = set()
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            path, params = next_request()
+            key = (path, tuple(sorted(params.items())))
+            seen = key in answered
+            start = time.perf_counter()
+            try:
+                resp = await client.get(path, params=params)
+                ok = resp.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                (warm if seen else cold).append(time.perf_counter() - start)
+                answered.add(key)
+            else:
+                errors += 1
+            # A warm request through ASGITransport never suspends, so without this a
+            # worker could serve hundreds in a row while the others' responses wait
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return warm, cold, errors, time.perf_counter() - start
+
+
+def request_mix(endpoint, stations, towns, rng, recorded=None):
+    """Request generator for ``endpoint``: random stations, dates and prefixes.
+
+    ``recorded`` maps station ids to the (first, last) days of a recorded
+    payload; ``/tide/today`` asks those stations for a day in that range.
+    """
+    today = datetime.date.today()
+    recorded = recorded or {}
+    if endpoint == "/tide/today":
+        stations = list(stations) + [s for s in recorded if s not in stations]
+
+        def make():
+            station = rng.choice(stations)
+            if station in recorded:
+                first, last = (datetime.date.fromisoformat(d) for d in recorded[station])
+                day = first + datetime.timedelta(days=rng.randrange((last - first).days + 1))
+            else:
+                day = today + datetime.timedelta(days=rng.randrange(30))
+            return endpoint, {"station": station, "date": day.isoformat()}
+    elif endpoint == "/tide/week":
+        def make():
+            return endpoint, {"station": rng.choice(stations)}
+    else:
+        def make():
+            name = rng.choice(towns)
+            return endpoint, {"query": name[:rng.randint(1, min(8, len(name)))]}
+    return make
+
+
+async def run(endpoints=ENDPOINTS, concurrency=32, requests=2000, latency_ms=50.0, jitter_ms=10.0,
+              error_rate=0.0, stations=50, table_size=10000, seed=1):
+    """Load-test each endpoint against fresh caches; returns results by endpoint."""
+    import main
+    import solunar
+    import upstream
+    from db import database
+    from tide_cache import PredictionCache
+
+    rng = random.Random(seed)
+    station_ids = [s["id"] for s in main.station_index.stations[:stations]]
+    saved = (main.db, main.hilo_cache, main.forecast_cache)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = locations_db(os.path.join(tmp, "locations.db"), table_size, seed)
+        towns = [r[0] for r in database(path).conn().execute("SELECT town FROM locations LIMIT 1000")]
+        try:
+            main.db = database(path)
+            for endpoint in endpoints:
+                # Each endpoint starts cold so hit ratios are comparable between runs
+                main.hilo_cache = PredictionCache(os.path.join(tmp, f"cache_{len(results)}.db"))
+                main.forecast_cache = solunar.ForecastCache(os.path.join(tmp, f"cache_{len(results)}.db"))
+                fake = FakeUpstream(latency_ms, jitter_ms, error_rate, seed=seed)
+                await upstream.start(transport=httpx.ASGITransport(app=fake))
+                try:
+                    transport = httpx.ASGITransport(app=main.app)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                        make = request_mix(endpoint, station_ids, towns, rng, fake.recorded_days())
+                        warm, cold, errors, elapsed = await drive(client, make, concurrency, requests)
+                finally:
+                    await upstream.close()
+                    database(main.hilo_cache.db_path).close_all()
+                result = summarize(warm + cold, errors, elapsed)
+                result["concurrency"] = concurrency
+                if endpoint.startswith("/tide"):
+                    # Cold requests wait on upstream behind a saturated loop; keep their tail apart
+                    result["warm_p99_ms"] = summarize(warm, 0, elapsed)["p99_ms"]
+                    cold_summary = summarize(cold, 0, elapsed)
+                    result["cold"] = {k: cold_summary[k] for k in ("requests", "p50_ms", "p99_ms", "max_ms")}
+                    result["hilo_cache_hit_ratio"] = round(main.hilo_cache.stats()["hit_ratio"], 3)
+                    result["upstream"] = fake.stats()
+                results[endpoint] = result
+        finally:
+            main.db.close_all()
+            main.db, main.hilo_cache, main.forecast_cache = saved
+    return results
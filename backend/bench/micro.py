@@ -0,0 +1,143 @@
+"""Micro-benchmarks for station lookup and the locations table."""
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+TOWN_SYLLABLES = ["bos", "ton", "ham", "ford", "wich", "port", "land", "ville", "field", "bridge",
+                  "mar", "ston", "new", "ber", "lin", "dale", "wood", "brook", "ches", "ter"]
+STATES = ["MA", "CT", "RI", "ME", "NH", "NY", "NJ", "FL", "CA", "WA", "TX", "VA", "NC", "SC", "GA", "OR"]
+SEARCH_QUERIES = ["b", "bos", "boston", "bostonham, ma", "021", "02025", ""]
+
+
+def measure(fn, repeat=200, number=1):
+    """Timings of ``fn`` over ``repeat`` rounds of ``number`` calls, per call."""
+    fn()  # warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    samples.sort()
+    return {
+        "calls": repeat * number,
+        "mean_us": round(statistics.fmean(samples), 3),
+        "p50_us": round(samples[len(samples) // 2], 3),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "ops_per_s": round(1e6 / statistics.fmean(samples), 1),
+    }
+
+
+def synthetic_towns(n, seed=1):
+    rng = random.Random(seed)
+    for i in range(n):
+        name = "".join(rng.choice(TOWN_SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+        yield (f"{name} {i}", rng.choice(STATES), f"{rng.randint(0, 99999):05d}",
+               rng.uniform(25, 48), rng.uniform(-124, -67), "8467150")
+
+
+def locations_db(path, size, seed=1):
+    """A locations database with ``size`` synthetic towns, schema as in main."""
+    import search
+    from import_data import LOCATIONS_SCHEMA
+
+    conn = sqlite3.connect(path)
+    conn.execute(LOCATIONS_SCHEMA)
+    search.init_search(conn)
+    search.bulk_load(conn, synthetic_towns(size, seed))
+    # Spread last_used so recency ranking has something to do
+    conn.execute("UPDATE locations SET last_used = datetime('now', '-' || (id % 400) || ' days')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def bench_stations(repeat=200, seed=1):
+    import main
+    from stations import haversine
+
+    index = main.station_index
+    rng = random.Random(seed)
+    points = [(rng.uniform(25, 48), rng.uniform(-124, -67)) for _ in range(repeat)]
+    it = iter(points * 4)
+    lat_arr = np.array([p[0] for p in points] * 50)
+    lon_arr = np.array([p[1] for p in points] * 50)
+
+    def linear():
+        # The pre-1.3.7 lookup: haversine against every station
+        lat, lon = next(it)
+        return min(index.stations, key=lambda s: haversine(lat, lon, s["lat"], s["lon"]))
+
+    results = {
+        "haversine": measure(lambda: haversine(41.17, -73.18, 42.36, -71.06), repeat=repeat, number=100),
+        "nearest_linear_scan": measure(linear, repeat=min(repeat, 50)),
+        "nearest_kdtree_k1": measure(lambda: index.nearest(*next(it), k=1), repeat=repeat),
+        "nearest_kdtree_k5": measure(lambda: index.nearest(*next(it), k=5), repeat=repeat),
+    }
+    batch = measure(lambda: index.nearest_ids(lat_arr, lon_arr), repeat=max(3, repeat // 50))
+    results["nearest_ids_per_point"] = {
+        k: (round(v / len(lat_arr), 3) if k.endswith("_us") else v) for k, v in batch.items() if k != "ops_per_s"
+    }
+    results["nearest_ids_per_point"]["points_per_s"] = round(batch["ops_per_s"] * len(lat_arr), 1)
+    results["stations"] = len(index)
+    return results
+
+
+def bench_locations(sizes=(1000, 10000, 100000), repeat=200, seed=1):
+    """``get_locations`` and ``add_or_update_location`` against tables of each size."""
+    import main
+    from db import UsageBuffer, database
+
+    saved = main.db
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for size in sizes:
+                path = locations_db(os.path.join(tmp, f"locations_{size}.db"), size, seed)
+                main.db = database(path)
+                rng = random.Random(seed)
+                by_query = {
+                    q or "<recent>": measure(lambda q=q: main.get_locations(q, 5), repeat=repeat)
+                    for q in SEARCH_QUERIES
+                }
+                existing = list(synthetic_towns(min(size, 1000), seed))
+                counter = iter(range(10 ** 9))
+
+                def update():
+                    town = rng.choice(existing)
+                    main.add_or_update_location(town[0], town[1], town[2], town[3], town[4], town[5])
+
+                def insert():
+                    i = next(counter)
+                    main.add_or_update_location(f"Benchville {i}", "ZZ", "99999", 40.0, -70.0, "8467150")
+
+                buffer = UsageBuffer(main.db)
+
+                def buffered_flush():
+                    # 100 touches then one batched write, as the request path does
+                    for _ in range(100):
+                        town = rng.choice(existing)
+                        buffer.touch(*town)
+                    buffer.flush()
+
+                flush = measure(buffered_flush, repeat=max(5, repeat // 20))
+                results[str(size)] = {
+                    "get_locations": by_query,
+                    "add_or_update_location_update": measure(update, repeat=repeat),
+                    "add_or_update_location_insert": measure(insert, repeat=repeat),
+                    "usage_buffer_per_touch": {k: (round(v / 100, 3) if k.endswith("_us") else v)
+                                               for k, v in flush.items() if k != "ops_per_s"},
+                }
+                main.db.close_all()
+        finally:
+            main.db = saved
+    return results
+
+
+def run(sizes=(1000, 10000, 100000), repeat=200):
+    return {"stations": bench_stations(repeat), "locations": bench_locations(sizes, repeat)}
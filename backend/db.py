@@ -0,0 +1,140 @@
+"""SQLite access layer shared by the backend.
+
+Each thread keeps one long-lived connection per database file, so the
+sqlite3 statement cache (our prepared statements) survives between requests.
+Databases run in WAL mode with ``synchronous=NORMAL``: readers never block
+the writer and commits don't fsync. ``last_used`` bookkeeping goes through
+``UsageBuffer`` and is written in batches by a background task.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+from metrics import stage
+
+logger = logging.getLogger("tide.db")
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+STATEMENT_CACHE = 256
+LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "2"))
+
+UPSERT_LOCATION = '''INSERT INTO locations (town, state, zip, lat, lon, stationId, last_used)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(town, state) DO UPDATE SET last_used = MAX(COALESCE(last_used, ''), excluded.last_used)'''
+
+
+class Database:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+
+    def conn(self):
+        """This thread's connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=BUSY_TIMEOUT_MS / 1000,
+                cached_statements=STATEMENT_CACHE,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def database(path):
+    """The shared ``Database`` for ``path``."""
+    with _databases_lock:
+        db = _databases.get(path)
+        if db is None:
+            db = _databases[path] = Database(path)
+        return db
+
+
+def now():
+    # Same format as SQLite CURRENT_TIMESTAMP
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class UsageBuffer:
+    """Write-behind buffer for location upserts / ``last_used`` touches.
+
+    ``touch`` only updates a dict; ``flush`` writes everything pending in one
+    transaction and runs every ``interval`` seconds while ``start``ed.
+    """
+
+    def __init__(self, db, interval=LOCATION_FLUSH_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+        self.flushed = 0
+
+    def touch(self, town, state, zip_code, lat, lon, stationId):
+        with self._lock:
+            self._pending[(town, state)] = (town, state, zip_code, lat, lon, stationId, now())
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = list(self._pending.values()), {}
+        if not rows:
+            return 0
+        conn = self.db.conn()
+        try:
+            with stage("db_write"), conn:
+                conn.executemany(UPSERT_LOCATION, rows)
+        except sqlite3.Error:
+            # Put the rows back (newer touches win) and retry next round
+            with self._lock:
+                for row in rows:
+                    self._pending.setdefault(row[:2], row)
+            raise
+        self.flushed += len(rows)
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except sqlite3.Error as exc:
+                logger.warning("location flush failed: %s", exc)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
@@ -0,0 +1,407 @@
+"""Offline tide prediction from NOAA harmonic constituents.
+
+Heights are h(t) = MSL + sum_i f_i A_i cos(V_i(t) + u_i(t) - kappa_i), with
+kappa the NOAA ``phase_GMT`` epoch, V the equilibrium argument built from
+Doodson numbers and Schureman's phase offsets, and f/u the nodal factors
+(Schureman/Doodson series in the longitude of the moon's node). The sum is
+evaluated with NumPy over the whole time grid at once, and highs/lows are
+found by vectorized extremum detection with parabolic refinement.
+
+Constituents are bundled in ``harmonics.json`` and loaded into SQLite; use
+``python harmonics.py fetch <station> ...`` to refresh them from NOAA.
+"""
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from moon import julian_day, local_midnights
+
+HARMONICS_PATH = os.path.join(os.path.dirname(__file__), "harmonics.json")
+DB_PATH = os.path.join(os.path.dirname(__file__), "locations.db")
+MDAPI = "https://api.tidesandcurrents.noaa.gov/mdapi/prod/webapi/stations"
+STEP_MINUTES = 6
+
+# Doodson rates (degrees/hour) for tau, s, h, p, N', p1
+RATES = np.array([14.4920521, 0.5490165, 0.0410686, 0.0046418, 0.0022064, 0.0000020])
+
+# name: (Doodson numbers, Schureman phase offset in degrees, nodal factor key)
+BASIC = {
+    "M2": ((2, 0, 0, 0, 0, 0), 0, "M2"),
+    "S2": ((2, 2, -2, 0, 0, 0), 0, None),
+    "N2": ((2, -1, 0, 1, 0, 0), 0, "M2"),
+    "K1": ((1, 1, 0, 0, 0, 0), -90, "K1"),
+    "O1": ((1, -1, 0, 0, 0, 0), 90, "O1"),
+    "NU2": ((2, -1, 2, -1, 0, 0), 0, "M2"),
+    "MU2": ((2, -2, 2, 0, 0, 0), 0, "M2"),
+    "2N2": ((2, -2, 0, 2, 0, 0), 0, "M2"),
+    "OO1": ((1, 3, 0, 0, 0, 0), -90, "OO1"),
+    "LAM2": ((2, 1, -2, 1, 0, 0), 180, "M2"),
+    "S1": ((1, 1, -1, 0, 0, 0), 0, None),
+    "M1": ((1, 0, 0, 1, 0, 0), -90, "O1"),
+    "J1": ((1, 2, 0, -1, 0, 0), -90, "J1"),
+    "MM": ((0, 1, 0, -1, 0, 0), 0, "MM"),
+    "SSA": ((0, 0, 2, 0, 0, 0), 0, None),
+    "SA": ((0, 0, 1, 0, 0, 0), 0, None),
+    "MSF": ((0, 2, -2, 0, 0, 0), 0, "MSF"),
+    "MF": ((0, 2, 0, 0, 0, 0), 0, "MF"),
+    "RHO": ((1, -2, 2, -1, 0, 0), 90, "O1"),
+    "Q1": ((1, -2, 0, 1, 0, 0), 90, "O1"),
+    "T2": ((2, 2, -3, 0, 0, 1), 0, None),
+    "R2": ((2, 2, -1, 0, 0, -1), 180, None),
+    "2Q1": ((1, -3, 0, 2, 0, 0), 90, "O1"),
+    "P1": ((1, 1, -2, 0, 0, 0), 90, None),
+    "M3": ((3, 0, 0, 0, 0, 0), 0, "M3"),
+    "L2": ((2, 1, 0, -1, 0, 0), 180, "M2"),
+    "K2": ((2, 2, 0, 0, 0, 0), 0, "K2"),
+}
+
+# Shallow-water and compound constituents as combinations of basic ones
+COMPOUND = {
+    "M4": {"M2": 2},
+    "M6": {"M2": 3},
+    "M8": {"M2": 4},
+    "S4": {"S2": 2},
+    "S6": {"S2": 3},
+    "MN4": {"M2": 1, "N2": 1},
+    "MS4": {"M2": 1, "S2": 1},
+    "MK3": {"M2": 1, "K1": 1},
+    "2MK3": {"M2": 2, "K1": -1},
+    "2SM2": {"S2": 2, "M2": -1},
+}
+
+
+def _build_table():
+    names, doodson, offsets, nodal = [], [], [], []
+    for name, (d, off, key) in BASIC.items():
+        names.append(name)
+        doodson.append(d)
+        offsets.append(off)
+        nodal.append({key: 1} if key else {})
+    for name, parts in COMPOUND.items():
+        d = sum(np.array(BASIC[b][0]) * n for b, n in parts.items())
+        off = sum(BASIC[b][1] * n for b, n in parts.items())
+        nod = {}
+        for b, n in parts.items():
+            if BASIC[b][2]:
+                nod[BASIC[b][2]] = nod.get(BASIC[b][2], 0) + n
+        names.append(name)
+        doodson.append(d)
+        offsets.append(off)
+        nodal.append(nod)
+    return names, np.array(doodson, dtype=float), np.array(offsets, dtype=float), nodal
+
+
+NAMES, DOODSON, OFFSETS, NODAL = _build_table()
+INDEX = {name: i for i, name in enumerate(NAMES)}
+SPEEDS = DOODSON @ RATES  # degrees/hour
+
+
+def astronomical_arguments(jd):
+    """tau, s, h, p, N', p1 (degrees) and N (radians) for Julian days ``jd``."""
+    T = (jd - 2451545.0) / 36525.0
+    ut_hours = ((jd - 0.5) % 1.0) * 24.0
+    s = 218.3164477 + 481267.88123421 * T
+    h = 280.46646 + 36000.76983 * T
+    p = 83.3532465 + 4069.0137287 * T
+    N = 125.0445479 - 1934.1362891 * T
+    p1 = 282.93735 + 1.71946 * T
+    tau = 15.0 * ut_hours + 180.0 + h - s
+    return np.stack([tau, s, h, p, -N, p1]), np.radians(N)
+
+
+def nodal_factors(N):
+    """f and u (degrees) for each nodal key, as arrays over time."""
+    c1, c2, c3 = np.cos(N), np.cos(2 * N), np.cos(3 * N)
+    s1, s2, s3 = np.sin(N), np.sin(2 * N), np.sin(3 * N)
+    fm2 = 1.0004 - 0.0373 * c1 + 0.0002 * c2
+    um2 = -2.14 * s1
+    factors = {
+        "M2": (fm2, um2),
+        "M3": (fm2 ** 1.5, 1.5 * um2),
+        "MSF": (fm2, -um2),
+        "K1": (1.0060 + 0.1150 * c1 - 0.0088 * c2 + 0.0006 * c3, -8.86 * s1 + 0.68 * s2 - 0.07 * s3),
+        "O1": (1.0089 + 0.1871 * c1 - 0.0147 * c2 + 0.0014 * c3, 10.80 * s1 - 1.34 * s2 + 0.19 * s3),
+        "K2": (1.0241 + 0.2863 * c1 + 0.0083 * c2 - 0.0015 * c3, -17.74 * s1 + 0.68 * s2 - 0.04 * s3),
+        "J1": (1.1029 + 0.1676 * c1 - 0.0170 * c2 + 0.0016 * c3, -12.94 * s1 + 1.34 * s2 - 0.19 * s3),
+        "OO1": (1.1027 + 0.6504 * c1 + 0.0317 * c2 - 0.0014 * c3, -36.68 * s1 + 4.02 * s2 - 0.57 * s3),
+        "MF": (1.043 + 0.414 * c1, -23.74 * s1 + 2.68 * s2 - 0.38 * s3),
+        "MM": (1.000 - 0.130 * c1, np.zeros_like(N)),
+    }
+    f = np.ones((len(NAMES), N.size))
+    u = np.zeros((len(NAMES), N.size))
+    for i, nod in enumerate(NODAL):
+        for key, n in nod.items():
+            fk, uk = factors[key]
+            f[i] *= fk ** abs(n)
+            u[i] += n * uk
+    return f, u
+
+
+def predict_heights(station, unix_seconds):
+    """Water level above the station datum at each time (same units as amplitudes)."""
+    jd = julian_day(unix_seconds)
+    args, N = astronomical_arguments(jd)
+    f, u = nodal_factors(N)
+    idx = station["index"]
+    V = DOODSON[idx] @ args + OFFSETS[idx, None]
+    phase = np.radians(V + u[idx] - station["phase"][:, None])
+    return station["datum_offset"] + (station["amplitude"][:, None] * f[idx] * np.cos(phase)).sum(axis=0)
+
+
+def find_extrema(t, h):
+    """Turning points of a sampled curve, refined by fitting a parabola
+    through each extremum and its neighbours. Returns (times, heights, is_high).
+    """
+    d = np.diff(h)
+    turn = np.nonzero(np.sign(d[:-1]) != np.sign(d[1:]))[0] + 1
+    y0, y1, y2 = h[turn - 1], h[turn], h[turn + 1]
+    denom = y0 - 2 * y1 + y2
+    offset = np.where(denom != 0, 0.5 * (y0 - y2) / np.where(denom != 0, denom, 1), 0.0)
+    step = t[1] - t[0]
+    times = t[turn] + offset * step
+    heights = y1 - 0.25 * (y0 - y2) * offset
+    return times, heights, denom < 0
+
+
+class HarmonicEngine:
+    def __init__(self, db_path, bundle_path=HARMONICS_PATH):
+        self.db_path = db_path
+        self._stations = {}
+        self._lock = threading.Lock()
+        self.init_db()
+        if bundle_path and os.path.exists(bundle_path):
+            self.load_bundle(bundle_path)
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS harmonic_stations (
+            station TEXT PRIMARY KEY,
+            name TEXT,
+            timezone TEXT,
+            units TEXT,
+            datum_offset REAL
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS harmonic_constituents (
+            station TEXT,
+            name TEXT,
+            amplitude REAL,
+            phase REAL,
+            PRIMARY KEY (station, name)
+        )''')
+        conn.commit()
+        conn.close()
+
+    def load_bundle(self, path):
+        with open(path) as f:
+            bundle = json.load(f)
+        self.store(bundle.get("stations", {}))
+
+    def store(self, stations):
+        """Insert or replace stations given in the bundle format."""
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        for sid, s in stations.items():
+            c.execute(
+                "INSERT OR REPLACE INTO harmonic_stations (station, name, timezone, units, datum_offset) VALUES (?, ?, ?, ?, ?)",
+                (sid, s.get("name"), s.get("timezone", "UTC"), s.get("units", "feet"), s.get("datum_offset", 0.0)),
+            )
+            c.execute("DELETE FROM harmonic_constituents WHERE station=?", (sid,))
+            c.executemany(
+                "INSERT INTO harmonic_constituents (station, name, amplitude, phase) VALUES (?, ?, ?, ?)",
+                [(sid, k["name"], k["amplitude"], k["phase_GMT"]) for k in s["constituents"]],
+            )
+        conn.commit()
+        conn.close()
+        with self._lock:
+            for sid in stations:
+                self._stations.pop(sid, None)
+
+    def station(self, sid):
+        with self._lock:
+            if sid in self._stations:
+                return self._stations[sid]
+        conn = sqlite3.connect(self.db_path)
+        c = conn.cursor()
+        c.execute("SELECT timezone, datum_offset FROM harmonic_stations WHERE station=?", (sid,))
+        row = c.fetchone()
+        c.execute("SELECT name, amplitude, phase FROM harmonic_constituents WHERE station=?", (sid,))
+        consts = [k for k in c.fetchall() if k[0] in INDEX and k[1] > 0]
+        conn.close()
+        station = None
+        if row and consts:
+            station = {
+                "id": sid,
+                "timezone": row[0],
+                "datum_offset": row[1],
+                "index": np.array([INDEX[k[0]] for k in consts]),
+                "amplitude": np.array([k[1] for k in consts]),
+                "phase": np.array([k[2] for k in consts]),
+            }
+        with self._lock:
+            self._stations[sid] = station
+        return station
+
+    def has_station(self, sid):
+        return self.station(sid) is not None
+
+    def predict_series(self, sid, begin, end, step_minutes=STEP_MINUTES):
+        """Heights from local midnight of ``begin`` to the end of ``end`` (Unix seconds, heights)."""
+        station = self.station(sid)
+        start, stop = local_midnights([begin, end + datetime.timedelta(days=1)], station["timezone"])
+        t = np.arange(start, stop, step_minutes * 60.0)
+        return t, predict_heights(station, t)
+
+    def predict_hilo(self, sid, begin, end):
+        """Same contract as ``tides.fetch_hilo``: "YYYY-MM-DD" -> {"highs", "lows"}."""
+        station = self.station(sid)
+        zone = ZoneInfo(station["timezone"])
+        start, stop = local_midnights([begin, end + datetime.timedelta(days=1)], station["timezone"])
+        # Pad so extrema right at midnight are still bracketed
+        t = np.arange(start - 3600.0, stop + 3600.0, STEP_MINUTES * 60.0)
+        times, heights, is_high = find_extrema(t, predict_heights(station, t))
+        days = {}
+        day = begin
+        while day <= end:
+            days[day.strftime("%Y-%m-%d")] = {"highs": [], "lows": []}
+            day += datetime.timedelta(days=1)
+        for ts, v, high in zip(times, heights, is_high):
+            if not start <= ts < stop:
+                continue
+            local = datetime.datetime.fromtimestamp(float(ts), zone)
+            item = {"t": local.strftime("%Y-%m-%d %H:%M"), "v": f"{v:.3f}", "type": "H" if high else "L"}
+            days[item["t"][:10]]["highs" if high else "lows"].append(item)
+        return days
+
+
+def accuracy(predicted, recorded):
+    """Compare engine hilo output with recorded NOAA hilo predictions.
+
+    ``predicted`` uses the ``predict_hilo`` format, ``recorded`` is the raw
+    ``predictions`` list from a NOAA datagetter response. Each recorded event
+    is matched to the nearest predicted event of the same type.
+    """
+    def parse(t):
+        return (datetime.datetime.strptime(t, "%Y-%m-%d %H:%M") - datetime.datetime(1970, 1, 1)).total_seconds() / 60.0
+
+    ours = {"H": [], "L": []}
+    for day in predicted.values():
+        for item in day["highs"] + day["lows"]:
+            ours[item["type"]].append((parse(item["t"]), float(item["v"])))
+    time_err, height_err, missing = [], [], 0
+    for rec in recorded:
+        candidates = ours.get(rec["type"]) or []
+        if not candidates:
+            missing += 1
+            continue
+        t = parse(rec["t"])
+        best = min(candidates, key=lambda c: abs(c[0] - t))
+        if abs(best[0] - t) > 180:
+            missing += 1
+            continue
+        time_err.append(abs(best[0] - t))
+        height_err.append(abs(best[1] - float(rec["v"])))
+    time_err, height_err = np.array(time_err), np.array(height_err)
+    return {
+        "events": len(recorded),
+        "matched": len(time_err),
+        "missing": missing,
+        "time_error_minutes_mean": float(time_err.mean()) if len(time_err) else None,
+        "time_error_minutes_max": float(time_err.max()) if len(time_err) else None,
+        "height_error_mean": float(height_err.mean()) if len(height_err) else None,
+        "height_error_max": float(height_err.max()) if len(height_err) else None,
+    }
+
+
+def recorded_hilo(payload, timezone):
+    """Predictions of a saved datagetter hilo response in ``timezone`` local time and feet.
+
+    ``payload["request"]``, when present, holds the query the response was
+    recorded with; without it the app's own ``lst_ldt`` / ``english`` is assumed.
+    """
+    request = payload.get("request", {})
+    time_zone = request.get("time_zone", "lst_ldt").lower()
+    units = request.get("units", "english").lower()
+    if time_zone not in ("gmt", "lst_ldt") or units not in ("english", "metric"):
+        raise ValueError(f"unsupported recording: time_zone={time_zone}, units={units}")
+    if request.get("datum", "MLLW").upper() != "MLLW":
+        raise ValueError(f"unsupported recording: datum={request['datum']}")
+    zone = ZoneInfo(timezone)
+    out = []
+    for item in payload["predictions"]:
+        t, v = item["t"], float(item["v"])
+        if time_zone == "gmt":
+            utc = datetime.datetime.strptime(t, "%Y-%m-%d %H:%M").replace(tzinfo=datetime.timezone.utc)
+            t = utc.astimezone(zone).strftime("%Y-%m-%d %H:%M")
+        if units == "metric":
+            v /= 0.3048
+        out.append(dict(item, t=t, v=f"{v:.3f}"))
+    return out
+
+
+def check(engine, sid, payload):
+    """Accuracy report of ``engine`` for station ``sid`` against a saved hilo response."""
+    station = engine.station(sid)
+    if station is None:
+        raise ValueError(f"no constituents for station {sid}")
+    recorded = recorded_hilo(payload, station["timezone"])
+    days = sorted({r["t"][:10] for r in recorded})
+    predicted = engine.predict_hilo(sid, datetime.date.fromisoformat(days[0]), datetime.date.fromisoformat(days[-1]))
+    return accuracy(predicted, recorded)
+
+
+# --- command line ---
+def fetch_station(sid, timezone=None):
+    """Download constituents and datums for one station from the NOAA metadata API.
+
+    Hilo times are local to ``timezone``, by default the station's zone in the catalog.
+    """
+    import httpx
+    from stations import catalog_timezone
+
+    timezone = timezone or catalog_timezone(sid)
+    if timezone is None:
+        raise ValueError(f"station {sid} is not in the catalog; its time zone is unknown")
+
+    harcon = httpx.get(f"{MDAPI}/{sid}/harcon.json", params={"units": "english"}, timeout=30).json()
+    datums = httpx.get(f"{MDAPI}/{sid}/datums.json", params={"units": "english"}, timeout=30).json()
+    levels = {d["name"]: d["value"] for d in datums.get("datums", [])}
+    return {
+        "timezone": timezone,
+        "units": "feet",
+        "datum_offset": levels["MSL"] - levels["MLLW"],
+        "constituents": [
+            {"name": k["name"], "amplitude": k["amplitude"], "phase_GMT": k["phase_GMT"]}
+            for k in harcon.get("HarmonicConstituents", [])
+        ],
+    }
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == "fetch":
+        with open(HARMONICS_PATH) as f:
+            bundle = json.load(f)
+        for sid in argv[1:]:
+            bundle["stations"][sid] = fetch_station(sid)
+            print(f"Fetched {len(bundle['stations'][sid]['constituents'])} constituents for {sid}")
+        with open(HARMONICS_PATH, "w") as f:
+            json.dump(bundle, f, indent=1, sort_keys=True)
+    elif len(argv) == 3 and argv[0] == "check":
+        sid, fixture = argv[1], argv[2]
+        with open(fixture) as f:
+            payload = json.load(f)
+        print(json.dumps(check(HarmonicEngine(DB_PATH), sid, payload), indent=2))
+    else:
+        print("usage: python harmonics.py fetch <station> [...] | check <station> <noaa_hilo.json>")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,356 @@
+"""Streaming bulk importer for locations and stations.
+
+Reads JSON arrays, NDJSON, CSV/TSV and Census Gazetteer files incrementally
+and writes with ``executemany`` in large transactions. Imports are idempotent
+(``ON CONFLICT`` upserts), and indexes are rebuilt once after the load.
+
+    python import_data.py locations towns.json
+    python import_data.py locations places.ndjson
+    python import_data.py locations places.csv
+    python import_data.py gazetteer 2023_Gaz_place_national.txt
+    python import_data.py stations stations_raw.json --key stations
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import search
+import stations
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "locations.db")
+CHUNK_SIZE = 1 << 16
+BATCH_SIZE = 50000
+
+LOCATIONS_SCHEMA = '''CREATE TABLE IF NOT EXISTS locations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    town TEXT,
+    state TEXT,
+    zip TEXT,
+    lat REAL,
+    lon REAL,
+    stationId TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_used TEXT DEFAULT CURRENT_TIMESTAMP
+)'''
+
+CENSUS_SUFFIX = re.compile(r"\s+(city|town|village|borough|CDP|municipality|city and borough|comunidad|zona urbana)$")
+
+
+# --- readers: each yields dicts, holding at most one chunk in memory ---
+def read_json_array(f, key=None):
+    """Elements of a JSON array, decoded one at a time.
+
+    The array is the top-level value, or the value of ``key`` when the file is
+    an object such as ``{"count": ..., "stations": [...]}``.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    eof = False
+
+    def fill():
+        nonlocal buf, eof
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buf += chunk
+
+    # Seek to the opening bracket of the array. With ``key``, walk the
+    # top-level object and stop only at a member named ``key`` whose value is
+    # an array; the same text inside strings or nested values is ignored.
+    pos = depth = 0
+    start = None  # start of the string being scanned
+    name = None  # top-level member name, set between the key and its value
+    expect_key = found = False
+    while True:
+        if pos >= len(buf):
+            if eof:
+                raise ValueError(f"no JSON array found{f' for key {key!r}' if key else ''}")
+            if start is None:
+                buf, pos = "", 0
+            else:
+                buf, pos, start = buf[start:], pos - start, 0
+            fill()
+            continue
+        c = buf[pos]
+        pos += 1
+        if start is not None:
+            if c == "\\":
+                pos += 1
+            elif c == '"':
+                if expect_key:
+                    name, expect_key = json.loads(buf[start:pos]), False
+                start = None
+        elif c in " \t\r\n":
+            continue
+        elif c == '"':
+            start = pos - 1
+        elif key is None:
+            if c != "[":
+                raise ValueError("no JSON array found")
+            break
+        elif depth == 1 and c == ":":
+            found, name = name == key, None
+        elif found and c == "[":
+            break
+        else:
+            found = False
+            if c in "{[":
+                depth += 1
+                expect_key = depth == 1 and c == "{"
+            elif c in "}]":
+                depth -= 1
+            elif depth == 1 and c == ",":
+                expect_key = True
+    buf = buf[pos:]
+
+    pos = 0
+    while True:
+        # Skip whitespace and separators
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = "", 0
+            fill()
+        if pos >= len(buf):
+            raise ValueError("unterminated JSON array")
+        if buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos = buf[pos:], 0
+            fill()
+            continue
+        yield value
+        pos = end
+        if pos > CHUNK_SIZE:
+            buf, pos = buf[pos:], 0
+
+
+def read_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(f, delimiter=","):
+    for rec in csv.DictReader(f, delimiter=delimiter):
+        yield {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in rec.items() if k}
+
+
+def read_census_gazetteer(f):
+    """Census Gazetteer places file (tab separated, e.g. 2023_Gaz_place_national.txt).
+
+    The legal suffix is dropped from place names ("Bridgeport city" -> "Bridgeport").
+    """
+    for rec in read_csv(f, delimiter="\t"):
+        yield {
+            "town": CENSUS_SUFFIX.sub("", rec["NAME"]),
+            "state": rec["USPS"],
+            "lat": rec["INTPTLAT"],
+            "lon": rec["INTPTLONG"],
+        }
+
+
+def records(path, fmt=None, key=None):
+    fmt = fmt or {
+        ".json": "json", ".ndjson": "ndjson", ".jsonl": "ndjson",
+        ".csv": "csv", ".tsv": "tsv", ".txt": "tsv",
+    }.get(os.path.splitext(path)[1].lower(), "json")
+    with open(path, newline="" if fmt in ("csv", "tsv", "census") else None, encoding="utf-8-sig") as f:
+        if fmt == "json":
+            yield from read_json_array(f, key)
+        elif fmt == "ndjson":
+            yield from read_ndjson(f)
+        elif fmt == "csv":
+            yield from read_csv(f)
+        elif fmt == "tsv":
+            yield from read_csv(f, delimiter="\t")
+        elif fmt == "census":
+            yield from read_census_gazetteer(f)
+        else:
+            raise ValueError(f"unknown format {fmt!r}")
+
+
+# --- record -> row mapping ---
+LOCATION_FIELDS = (
+    ("town", "name", "city", "NAME"),
+    ("state", "USPS", "state_code"),
+    ("zip", "zip_code", "postal_code"),
+    ("lat", "latitude", "INTPTLAT"),
+    ("lon", "lng", "longitude", "INTPTLONG"),
+    ("stationId", "station_id"),
+)
+_layouts = {}
+
+
+def _first(rec, *names):
+    for name in names:
+        value = rec.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _float(value):
+    return float(value) if value not in (None, "") else None
+
+
+def _zip(value):
+    # Numeric ZIPs (JSON numbers, spreadsheet exports) have lost their leading zeros
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value if value is not None else "").strip()
+    return value.zfill(5) if value.isdigit() and len(value) < 5 else value
+
+
+def location_row(rec):
+    # Records of one file share a layout; resolve the aliases once per layout
+    keys = tuple(rec)
+    fields = _layouts.get(keys)
+    if fields is None:
+        if len(_layouts) > 1024:
+            _layouts.clear()
+        fields = _layouts[keys] = tuple(next((n for n in aliases if n in rec), None) for aliases in LOCATION_FIELDS)
+    town, state, zip_code, lat, lon, station = map(rec.get, fields)
+    return (town, state, _zip(zip_code), _float(lat), _float(lon), station or None)
+
+
+def station_row(rec):
+    if "lng" not in rec:
+        rec = dict(rec, lng=_first(rec, "lon", "longitude"))
+    rec = dict(rec, lat=_float(rec.get("lat")), lng=_float(rec.get("lng")))
+    return stations.catalog_row(rec)
+
+
+def read_ahead(rows, batch_size=10000, depth=4):
+    """Iterate ``rows`` from a background thread, ``depth`` batches ahead.
+
+    Parsing overlaps with the SQLite and NumPy work in the caller, which
+    release the GIL; memory stays bounded to ``depth`` batches.
+    """
+    q = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    q.put(batch)
+                    batch = []
+                    if stop.is_set():
+                        return
+            q.put(batch)
+            q.put(done)
+        except BaseException as exc:
+            q.put(exc)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield from item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue
+        while thread.is_alive():
+            try:
+                q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class Progress:
+    def __init__(self, out=sys.stderr):
+        self.out = out
+        self.start = time.perf_counter()
+
+    def rate(self, total):
+        elapsed = time.perf_counter() - self.start
+        return total / elapsed if elapsed > 0 else 0.0
+
+    def __call__(self, total):
+        print(f"\r{total:,} rows  {self.rate(total):,.0f} rows/s", end="", file=self.out, flush=True)
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Bulk load: durability of a partial import doesn't matter, re-run it
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-200000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def import_locations(db_path, rows, batch_size=BATCH_SIZE, progress=None):
+    stations.load_catalog(db_path)
+    conn = connect(db_path)
+    try:
+        conn.execute(LOCATIONS_SCHEMA)
+        search.init_search(conn)
+        index = stations.StationIndex.from_db(db_path)
+        return search.bulk_load(
+            conn,
+            (r for r in rows if r[0] and r[1]),
+            station_index=index,
+            batch_size=batch_size,
+            progress=progress,
+        )
+    finally:
+        conn.close()
+
+
+def import_stations(db_path, rows, batch_size=BATCH_SIZE, progress=None):
+    conn = connect(db_path)
+    try:
+        return stations.bulk_load(conn, rows, batch_size=batch_size, progress=progress)
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream locations or stations into locations.db")
+    parser.add_argument("target", choices=["locations", "gazetteer", "stations"])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["json", "ndjson", "csv", "tsv", "census"])
+    parser.add_argument("--key", help="JSON key holding the array, e.g. 'stations'")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    progress = Progress()
+    if args.target == "stations":
+        rows = (station_row(r) for r in records(args.path, args.format, args.key))
+        total = import_stations(args.db, read_ahead(rows), args.batch_size, progress)
+    else:
+        fmt = "census" if args.target == "gazetteer" else args.format
+        rows = (location_row(r) for r in records(args.path, fmt, args.key))
+        total = import_locations(args.db, read_ahead(rows), args.batch_size, progress)
+    elapsed = time.perf_counter() - progress.start
+    print(f"\rImported {total:,} {args.target} rows in {elapsed:.1f}s ({progress.rate(total):,.0f} rows/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,49 @@
 import os
-import sqlite3
-from fastapi import FastAPI, Query
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+import asyncio
 import datetime
-import requests
-import math
 import json
+from typing import List, Optional
+from pydantic import BaseModel
 
 # Paths
 DB_PATH = os.path.join(os.path.dirname(__file__), "locations.db")
 
 load_dotenv()
 
-app = FastAPI()
+import upstream
+from tides import NOAA_DATUM, NOAA_DEFAULT_STATION, NOAA_LOCAL_TZ, NOAA_UNITS, fetch_series
+from moon import local_midnights, moon_days
+import series
+import solunar
+from tide_cache import PredictionCache
+from harmonics import HarmonicEngine
+from stations import StationIndex, load_catalog
+from search import init_search, search_locations
+from db import UPSERT_LOCATION, UsageBuffer, database, now
+from metrics import REGISTRY, MetricsMiddleware, ProfiledRoute, TimedJSONResponse, stage
+from prefetch import Prefetcher
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await upstream.start()
+    location_usage.start()
+    prefetcher.start()
+    yield
+    await prefetcher.stop()
+    await location_usage.stop()
+    await upstream.close()
+    db.close_all()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
+app.router.route_class = ProfiledRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,9 +52,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+db = database(DB_PATH)
+location_usage = UsageBuffer(db)
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db.conn()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS locations (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -38,86 +72,119 @@ def init_db():
         last_used TEXT DEFAULT CURRENT_TIMESTAMP
     )''')
     conn.commit()
-    conn.close()
+    init_search(conn)
 
 init_db()
+load_catalog(DB_PATH)
+station_index = StationIndex.from_db(DB_PATH)
+
+hilo_cache = PredictionCache(DB_PATH, max_entries=int(os.getenv("HILO_CACHE_SIZE", "4096")))
+harmonic_engine = HarmonicEngine(DB_PATH)
+forecast_cache = solunar.ForecastCache(DB_PATH, max_entries=int(os.getenv("SOLUNAR_CACHE_SIZE", "16384")))
+
+# noaa: always NOAA; harmonic: offline engine when the station has constituents;
+# fallback: NOAA, switching to the offline engine when NOAA is slow or down
+TIDE_SOURCE = os.getenv("TIDE_SOURCE", "fallback")
+NOAA_FALLBACK_TIMEOUT = float(os.getenv("NOAA_FALLBACK_TIMEOUT", "4"))
+TIDE_BATCH_MAX_ITEMS = int(os.getenv("TIDE_BATCH_MAX_ITEMS", "200"))
+TIDE_BATCH_MAX_DAYS = int(os.getenv("TIDE_BATCH_MAX_DAYS", "31"))
+TIDE_BATCH_CONCURRENCY = int(os.getenv("TIDE_BATCH_CONCURRENCY", "8"))
+TIDE_RANGE_MAX_DAYS = int(os.getenv("TIDE_RANGE_MAX_DAYS", "366"))
+TIDE_RANGE_MAX_POINTS = int(os.getenv("TIDE_RANGE_MAX_POINTS", "20000"))
+TIDE_RANGE_MAX_AGE = int(os.getenv("TIDE_RANGE_MAX_AGE", "86400"))
+
+async def get_hilo(station, begin, end):
+    """Hilo predictions for [begin, end] and their source ("noaa" or "harmonic")."""
+    station = station or NOAA_DEFAULT_STATION
+    offline = TIDE_SOURCE != "noaa" and harmonic_engine.has_station(station)
+
+    def harmonic():
+        with stage("harmonic"):
+            return harmonic_engine.predict_hilo(station, begin, end)
+
+    if offline and TIDE_SOURCE == "harmonic":
+        return await asyncio.to_thread(harmonic), "harmonic"
+    if not offline:
+        return await hilo_cache.get_hilo(station, begin, end), "noaa"
+    # Warm days need no fetch, so skip the timeout and shield tasks
+    cached = hilo_cache.cached(station, begin, end)
+    if cached is not None:
+        return cached, "noaa"
+    try:
+        # Shielded so a slow fetch still completes and warms the cache
+        fetch = asyncio.shield(hilo_cache.get_hilo(station, begin, end))
+        return await asyncio.wait_for(fetch, NOAA_FALLBACK_TIMEOUT), "noaa"
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError):
+        return await asyncio.to_thread(harmonic), "harmonic"
+
+async def get_series(station, begin, end, interval, tz):
+    """Water levels from local midnight of ``begin`` to the end of ``end``: (times, heights, source, fallback)."""
+    offline = TIDE_SOURCE != "noaa" and harmonic_engine.has_station(station)
+    step = 6 if interval == "6" else 60
+
+    def harmonic():
+        with stage("harmonic"):
+            return harmonic_engine.predict_series(station, begin, end, step_minutes=step)
+
+    if offline and TIDE_SOURCE == "harmonic":
+        return (*await asyncio.to_thread(harmonic), "harmonic", False)
+    start, stop = local_midnights([begin, end + datetime.timedelta(days=1)], tz)
+    try:
+        fetch = fetch_series(station, float(start), float(stop), interval)
+        if offline:
+            fetch = asyncio.wait_for(fetch, NOAA_FALLBACK_TIMEOUT)
+        return (*await fetch, "noaa", False)
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError):
+        if not offline:
+            raise
+        return (*await asyncio.to_thread(harmonic), "harmonic", True)
+
+prefetcher = Prefetcher(
+    db, hilo_cache, forecast_cache, station_index, get_hilo, default_tz=NOAA_LOCAL_TZ,
+    offline=lambda station: TIDE_SOURCE == "harmonic" and harmonic_engine.has_station(station),
+)
 
 @app.get("/")
 def root():
     return {"status": "Tide MCP backend running"}
 
-NOAA_DEFAULT_STATION = "8467150"  # Bridgeport, CT (fallback)
-NOAA_PRODUCT = "predictions"
-NOAA_DATUM = "MLLW"
-NOAA_UNITS = "english"
-NOAA_TIMEZONE = "lst_ldt"
-NOAA_API = "https://api.tidesandcurrents.noaa.gov/api/prod/datagetter"
-MOON_API = "https://api.farmsense.net/v1/moonphases/"
-
-# Hardcoded NOAA stations (id, name, lat, lon)
-NOAA_STATIONS = [
-    {"id": "8418150", "name": "Portland, ME", "lat": 43.6615, "lon": -70.2553},
-    {"id": "8419807", "name": "Kennebunkport, ME", "lat": 43.3618, "lon": -70.4762},
-    {"id": "8413320", "name": "Bar Harbor, ME", "lat": 44.3876, "lon": -68.2039},
-    {"id": "8419317", "name": "Wells, ME", "lat": 43.3212, "lon": -70.5806},
-    {"id": "8419528", "name": "York, ME", "lat": 43.1617, "lon": -70.6467},
-    {"id": "8423745", "name": "Portsmouth, NH", "lat": 43.0718, "lon": -70.7626},
-    {"id": "8429489", "name": "Hampton, NH", "lat": 42.9117, "lon": -70.8120},
-    {"id": "8440466", "name": "Newburyport, MA", "lat": 42.8126, "lon": -70.8773},
-    {"id": "8441841", "name": "Gloucester, MA", "lat": 42.6159, "lon": -70.6610},
-    {"id": "8442645", "name": "Salem, MA", "lat": 42.5195, "lon": -70.8967},
-    {"id": "8443970", "name": "Boston, MA", "lat": 42.3601, "lon": -71.0589},
-    {"id": "8446493", "name": "Plymouth, MA", "lat": 41.9584, "lon": -70.6673},
-    {"id": "8447435", "name": "Chatham, MA", "lat": 41.6826, "lon": -69.9656},
-    {"id": "8447930", "name": "Hyannis, MA", "lat": 41.6525, "lon": -70.2881},
-    {"id": "8447180", "name": "Sandwich, MA", "lat": 41.7587, "lon": -70.4934},
-    {"id": "8452660", "name": "Newport, RI", "lat": 41.4901, "lon": -71.3128},
-    {"id": "8454658", "name": "Narragansett, RI", "lat": 41.4501, "lon": -71.4495},
-    {"id": "8455189", "name": "Westerly, RI", "lat": 41.3776, "lon": -71.8273},
-    {"id": "8461490", "name": "Stonington, CT", "lat": 41.3357, "lon": -71.9054},
-    {"id": "8461809", "name": "Mystic, CT", "lat": 41.3543, "lon": -71.9665},
-    {"id": "8465705", "name": "Old Saybrook, CT", "lat": 41.2915, "lon": -72.3764},
-    {"id": "8467150", "name": "Bridgeport, CT", "lat": 41.1792, "lon": -73.1894},
-    {"id": "8468448", "name": "Stamford, CT", "lat": 41.0534, "lon": -73.5387},
-]
-
-# Haversine formula to compute distance between two lat/lon points
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # km
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+# --- STATION LOOKUP ---
+def resolve_station(station, lat, lon, types=None):
+    """Station id to query, plus the catalog station when estimated from lat/lon.
+
+    With ``types``, a catalog station of another type is replaced by the
+    nearest one of those types, reported as estimated.
+    """
+    if not station and lat is not None and lon is not None:
+        with stage("station_resolution"):
+            nearest = station_index.nearest(lat, lon, k=1, types=types)
+        if nearest:
+            return nearest[0]["id"], nearest[0]
+        return NOAA_DEFAULT_STATION, None
+    station = station or NOAA_DEFAULT_STATION
+    info = station_index.get(station)
+    if types is not None and info and info.get("type") not in types:
+        return resolve_station(None, info["lat"], info["lon"], types)
+    return station, None
+
+def moon_for(days, station_id, lat=None, lon=None):
+    """Moon data for the request location, or the station's when none was given."""
+    info = station_index.get(station_id)
+    if (lat is None or lon is None) and info:
+        lat, lon = info["lat"], info["lon"]
+    with stage("moon"):
+        return moon_days(days, lat, lon, info["timezone"] if info else NOAA_LOCAL_TZ)
 
 
 # --- LOCATION DB UTILITIES ---
 def get_locations(query=None, limit=5):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if query:
-        q = f"%{query.lower()}%"
-        c.execute("SELECT * FROM locations WHERE LOWER(town) LIKE ? OR LOWER(state) LIKE ? OR zip LIKE ? ORDER BY last_used DESC LIMIT ?", (q, q, q, limit))
-    else:
-        c.execute("SELECT * FROM locations ORDER BY last_used DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return [dict(zip([col[0] for col in c.description], row)) for row in rows]
+    with stage("db_read"):
+        return search_locations(db.conn(), query, limit)
 
 def add_or_update_location(town, state, zip_code, lat, lon, stationId):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Check if already exists
-    c.execute("SELECT id FROM locations WHERE town=? AND state=?", (town, state))
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE locations SET last_used=CURRENT_TIMESTAMP WHERE id=?", (row[0],))
-    else:
-        c.execute("INSERT INTO locations (town, state, zip, lat, lon, stationId) VALUES (?, ?, ?, ?, ?, ?)", (town, state, zip_code, lat, lon, stationId))
-    conn.commit()
-    conn.close()
+    conn = db.conn()
+    with stage("db_write"), conn:
+        conn.execute(UPSERT_LOCATION, (town, state, zip_code, lat, lon, stationId, now()))
 
 @app.get("/locations/search")
 def locations_search(query: str = Query(...), limit: int = 5):
@@ -130,11 +197,61 @@ def add_location(town: str, state: str, zip_code: str, lat: float, lon: float, s
     return {"status": "added"}
 
 @app.get("/stations/nearby")
-def stations_nearby(lat: float = Query(...), lon: float = Query(...), limit: int = 5):
-    return {"stations": []}
+def stations_nearby(lat: float = Query(...), lon: float = Query(...), limit: int = Query(5, ge=1, le=100)):
+    return {"stations": station_index.nearest(lat, lon, k=limit)}
+
+class Point(BaseModel):
+    lat: float
+    lon: float
+
+class NearbyBatchRequest(BaseModel):
+    points: List[Point]
+    limit: int = 1
+
+@app.post("/stations/nearby/batch")
+def stations_nearby_batch(req: NearbyBatchRequest):
+    limit = max(1, min(req.limit, 100))
+    with stage("station_resolution"):
+        nearest = station_index.nearest_batch([p.lat for p in req.points], [p.lon for p in req.points], k=limit)
+    return {"results": [
+        {"lat": p.lat, "lon": p.lon, "stations": nearest[i]}
+        for i, p in enumerate(req.points)
+    ]}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"hilo": hilo_cache.stats(), "solunar": forecast_cache.stats(), "prefetch": prefetcher.stats()}
+
+@REGISTRY.collector
+def cache_metrics():
+    caches = {"hilo": hilo_cache.stats(), "solunar": forecast_cache.stats()}
+    lookups = []
+    for name, stats in caches.items():
+        lookups.append(({"cache": name, "result": "hit"}, stats["hits"]))
+        lookups.append(({"cache": name, "result": "disk_hit"}, stats["disk_hits"]))
+        lookups.append(({"cache": name, "result": "miss"}, stats["misses"]))
+    return [
+        ("tide_cache_lookups_total", "counter", "Cache lookups by result", lookups),
+        ("tide_cache_hit_ratio", "gauge", "Share of lookups served from memory or disk",
+         [({"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()]),
+        ("tide_cache_entries", "gauge", "Entries in the in-memory tier",
+         [({"cache": name}, stats["entries"]) for name, stats in caches.items()]),
+        ("tide_cache_coalesced_total", "counter", "Misses that joined an in-flight fetch",
+         [({"cache": "hilo"}, caches["hilo"]["coalesced"])]),
+        ("tide_location_writes_pending", "gauge", "Location touches waiting for the next flush",
+         [({}, location_usage.pending())]),
+        ("tide_prefetch_fetches_total", "counter", "Station ranges fetched by the prefetcher",
+         [({"result": "ok"}, prefetcher.fetched), ({"result": "error"}, prefetcher.errors)]),
+        ("tide_prefetch_budget_remaining", "gauge", "Prefetch fetches left in today's budget",
+         [({}, max(0, prefetcher.budget - prefetcher.spent))]),
+    ]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/tide/today")
-def tide_today(
+async def tide_today(
     date: str = Query(None),
     station: str = Query(None),
     lat: float = Query(None),
@@ -144,52 +261,34 @@ def tide_today(
     zip: str = Query('', alias='zip')
 ):
     if date is None:
-        date = datetime.date.today().strftime("%Y-%m-%d")
-    estimated = False
-    used_station = station
-    # If no station provided, but lat/lon provided, find nearest station
-    if not station and lat is not None and lon is not None:
-        min_dist = float('inf')
-        nearest = None
-        for s in NOAA_STATIONS:
-            dist = haversine(lat, lon, s["lat"], s["lon"])
-            if dist < min_dist:
-                min_dist = dist
-                nearest = s
-        used_station = nearest["id"] if nearest else NOAA_DEFAULT_STATION
-        estimated = True
-        source_station = nearest
-        # Save location to locations.db
-        if town and state:
-            add_or_update_location(town, state, zip, lat, lon, used_station)
+        day = datetime.date.today()
     else:
-        source_station = None
-    params = {
-        "station": used_station or NOAA_DEFAULT_STATION,
-        "product": NOAA_PRODUCT,
-        "date": "today",
-        "datum": NOAA_DATUM,
-        "units": NOAA_UNITS,
-        "time_zone": NOAA_TIMEZONE,
-        "format": "json",
-        "interval": "hilo"
-    }
-    resp = requests.get(NOAA_API, params=params)
-    data = resp.json()
-    highs = [t for t in data.get("predictions", []) if t["type"] == "H"]
-    lows = [t for t in data.get("predictions", []) if t["type"] == "L"]
-    today_jd = int(datetime.datetime.strptime(date, "%Y-%m-%d").strftime("%j"))
-    moon_resp = requests.get(MOON_API, params={"d": today_jd})
-    moon_data = moon_resp.json()
-    moon_phase = moon_data[0]["Phase"] if moon_data else "Unknown"
-    response = {"date": date, "highs": highs, "lows": lows, "moon_phase": moon_phase}
+        try:
+            day = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(400, "date must be YYYY-MM-DD")
+    date = day.strftime("%Y-%m-%d")
+    # If no station provided, but lat/lon provided, find nearest station
+    used_station, source_station = resolve_station(station, lat, lon)
+    estimated = source_station is not None
+    # Save location to locations.db (written in the background)
+    if estimated and town and state:
+        location_usage.touch(town, state, zip, lat, lon, used_station)
+    try:
+        tides, source = await get_hilo(used_station, day, day)
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as exc:
+        raise HTTPException(502, batch_error(exc))
+    highs = tides[date]["highs"]
+    lows = tides[date]["lows"]
+    moon = moon_for([day], used_station, lat, lon)[0]
+    response = {"date": date, "highs": highs, "lows": lows, "moon_phase": moon["phase"], "moon": moon, "source": source}
     if estimated:
         response["estimated"] = True
         response["source_station"] = source_station
     return response
 
 @app.get("/tide/week")
-def tide_week(
+async def tide_week(
     station: str = Query(None),
     lat: float = Query(None),
     lon: float = Query(None),
@@ -197,72 +296,225 @@ def tide_week(
     state: str = Query(None),
     zip: str = Query('', alias='zip')
 ):
-    estimated = False
-    used_station = station
     # If no station provided, but lat/lon provided, find nearest station
-    if not station and lat is not None and lon is not None:
-        min_dist = float('inf')
-        nearest = None
-        for s in NOAA_STATIONS:
-            dist = haversine(lat, lon, s["lat"], s["lon"])
-            if dist < min_dist:
-                min_dist = dist
-                nearest = s
-        used_station = nearest["id"] if nearest else NOAA_DEFAULT_STATION
-        estimated = True
-        source_station = nearest
-        # Save location to locations.db
-        if town and state:
-            add_or_update_location(town, state, zip, lat, lon, used_station)
-    else:
-        source_station = None
-    week = []
+    used_station, source_station = resolve_station(station, lat, lon)
+    estimated = source_station is not None
+    # Save location to locations.db (written in the background)
+    if estimated and town and state:
+        location_usage.touch(town, state, zip, lat, lon, used_station)
     today = datetime.date.today()
+    days = [today + datetime.timedelta(days=i) for i in range(7)]
+    # One NOAA range request for the whole week, moon data in one batch
+    try:
+        tides, source = await get_hilo(used_station, days[0], days[-1])
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as exc:
+        raise HTTPException(502, batch_error(exc))
+    moons = moon_for(days, used_station, lat, lon)
     week = []
-    today = datetime.date.today()
-    for i in range(7):
-        day = today + datetime.timedelta(days=i)
-        date_str = day.strftime("%Y%m%d")
-        params = {
-            "station": used_station or NOAA_DEFAULT_STATION,
-            "product": NOAA_PRODUCT,
-            "date": date_str,
-            "datum": NOAA_DATUM,
-            "units": NOAA_UNITS,
-            "time_zone": NOAA_TIMEZONE,
-            "format": "json",
-            "interval": "hilo"
-        }
-        resp = requests.get(NOAA_API, params=params)
-        print(f"[DEBUG] NOAA API /predictions {params} status={resp.status_code} body={resp.text[:200]}")
-        data = resp.json()
-        predictions = data.get("predictions", [])
-        highs = [t for t in predictions if t["type"] == "H"]
-        lows = [t for t in predictions if t["type"] == "L"]
-        try:
-            jd = int(day.strftime("%j"))
-            moon_resp = requests.get(MOON_API, params={"d": jd})
-            moon_data = moon_resp.json()
-            moon_phase = moon_data[0]["Phase"] if moon_data else "Unknown"
-        except Exception:
-            moon_phase = "Unknown"
-        day_result = {"date": day.strftime("%Y-%m-%d"), "highs": highs, "lows": lows, "moon_phase": moon_phase}
+    for i, day in enumerate(days):
+        date_str = day.strftime("%Y-%m-%d")
+        day_result = {"date": date_str, "highs": tides[date_str]["highs"], "lows": tides[date_str]["lows"], "moon_phase": moons[i]["phase"], "moon": moons[i]}
         week.append(day_result)
-    response = {"week": week}
+    response = {"week": week, "source": source}
     if estimated:
         response["estimated"] = True
         response["source_station"] = source_station
     return response
 
+class TideBatchItem(BaseModel):
+    station: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+
+class TideBatchRequest(BaseModel):
+    items: List[TideBatchItem]
+    begin: Optional[str] = None  # YYYY-MM-DD, default today
+    end: Optional[str] = None  # YYYY-MM-DD, default begin
+
+def batch_error(exc):
+    if isinstance(exc, httpx.HTTPStatusError):
+        return f"upstream returned {exc.response.status_code}"
+    if isinstance(exc, (httpx.HTTPError, asyncio.TimeoutError)):
+        return f"upstream unavailable: {type(exc).__name__}"
+    return str(exc) or type(exc).__name__
+
+@app.post("/tide/batch")
+async def tide_batch(req: TideBatchRequest):
+    """Tides and moon data for many stations / points over one date range.
+
+    Points are resolved to stations in one vectorized pass, every distinct
+    station is fetched once, and at most ``TIDE_BATCH_CONCURRENCY`` fetches run
+    at a time. A failing item carries an ``error`` instead of failing the batch.
+    """
+    if len(req.items) > TIDE_BATCH_MAX_ITEMS:
+        raise HTTPException(400, f"at most {TIDE_BATCH_MAX_ITEMS} items per batch")
+    try:
+        begin = datetime.date.fromisoformat(req.begin) if req.begin else datetime.date.today()
+        end = datetime.date.fromisoformat(req.end) if req.end else begin
+    except ValueError:
+        raise HTTPException(400, "begin and end must be YYYY-MM-DD")
+    if end < begin or (end - begin).days >= TIDE_BATCH_MAX_DAYS:
+        raise HTTPException(400, f"date range must be 1 to {TIDE_BATCH_MAX_DAYS} days")
+    days = [begin + datetime.timedelta(days=i) for i in range((end - begin).days + 1)]
+
+    # Resolve stations: explicit ids as given, points in one nearest-station pass
+    points = [i for i, item in enumerate(req.items) if not item.station and item.lat is not None and item.lon is not None]
+    with stage("station_resolution"):
+        nearest = station_index.nearest_batch([req.items[i].lat for i in points], [req.items[i].lon for i in points], k=1)
+    resolved = [(item.station, None) if item.station else None for item in req.items]
+    for i, found in zip(points, nearest):
+        resolved[i] = (found[0]["id"], found[0]) if found else (NOAA_DEFAULT_STATION, None)
+
+    # One fetch per distinct station
+    limit = asyncio.Semaphore(max(1, TIDE_BATCH_CONCURRENCY))
+
+    async def fetch(station):
+        async with limit:
+            return await get_hilo(station, begin, end)
+
+    unique = list(dict.fromkeys(r[0] for r in resolved if r))
+    fetched = dict(zip(unique, await asyncio.gather(*(fetch(s) for s in unique), return_exceptions=True)))
+
+    moons = {}
+    results = []
+    for item, res in zip(req.items, resolved):
+        request = {"station": item.station, "lat": item.lat, "lon": item.lon}
+        if res is None:
+            results.append({"request": request, "error": "station or lat/lon required"})
+            continue
+        station, source_station = res
+        tides = fetched[station]
+        if isinstance(tides, BaseException):
+            results.append({"request": request, "station": station, "error": batch_error(tides)})
+            continue
+        tides, source = tides
+        key = (station, item.lat, item.lon)
+        if key not in moons:
+            moons[key] = moon_for(days, station, item.lat, item.lon)
+        out = []
+        for i, day in enumerate(days):
+            date_str = day.strftime("%Y-%m-%d")
+            moon = moons[key][i]
+            out.append({"date": date_str, "highs": tides[date_str]["highs"], "lows": tides[date_str]["lows"], "moon_phase": moon["phase"], "moon": moon})
+        result = {"request": request, "station": station, "days": out, "source": source}
+        if source_station is not None:
+            result["estimated"] = True
+            result["source_station"] = source_station
+        results.append(result)
+    return {"begin": begin.isoformat(), "end": end.isoformat(), "results": results}
+
+@app.get("/tide/range")
+async def tide_range(
+    request: Request,
+    begin: str = Query(...),
+    end: str = Query(None),
+    station: str = Query(None),
+    lat: float = Query(None),
+    lon: float = Query(None),
+    interval: str = Query("h"),
+    points: int = Query(None),
+    format: str = Query("ndjson"),
+):
+    """Predicted water levels for [begin, end], every 6 minutes (``interval=6``) or hour (``h``).
+
+    ``points`` downsamples to that many points with LTTB. ``format=ndjson``
+    streams a header line and one ``{"t", "v"}`` line per point (t in Unix
+    seconds); ``format=columnar`` returns base64 uint32 time offsets from
+    ``t0`` and float32 heights. Responses carry a strong ETag.
+    """
+    if interval not in ("6", "h"):
+        raise HTTPException(400, "interval must be 6 or h")
+    if format not in ("ndjson", "columnar"):
+        raise HTTPException(400, "format must be ndjson or columnar")
+    if points is not None and not 3 <= points <= TIDE_RANGE_MAX_POINTS:
+        raise HTTPException(400, f"points must be 3 to {TIDE_RANGE_MAX_POINTS}")
+    try:
+        first = datetime.date.fromisoformat(begin)
+        last = datetime.date.fromisoformat(end) if end else first
+    except ValueError:
+        raise HTTPException(400, "begin and end must be YYYY-MM-DD")
+    if last < first or (last - first).days >= TIDE_RANGE_MAX_DAYS:
+        raise HTTPException(400, f"date range must be 1 to {TIDE_RANGE_MAX_DAYS} days")
+
+    # Subordinate stations have only hilo predictions, no water level series
+    used_station, source_station = resolve_station(station, lat, lon, types={"R"})
+    info = station_index.get(used_station)
+    tz = info["timezone"] if info else NOAA_LOCAL_TZ
+    try:
+        t, v, source, fallback = await get_series(used_station, first, last, interval, tz)
+    except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as exc:
+        raise HTTPException(502, batch_error(exc))
+    total = len(t)
+    if points:
+        def downsample():
+            with stage("downsample"):
+                return series.lttb(t, v, points)
+
+        idx = await asyncio.to_thread(downsample)
+        t, v = t[idx], v[idx]
+
+    meta = {
+        "station": used_station, "begin": first.isoformat(), "end": last.isoformat(), "interval": interval,
+        "source": source, "datum": NOAA_DATUM, "units": NOAA_UNITS, "time_zone": tz,
+        "count": len(t), "total": total,
+    }
+    if source_station is not None:
+        meta["estimated"] = True
+        meta["source_station"] = source_station
+    tag = series.etag({**meta, "format": format}, t, v)
+    # Harmonic stand-ins for a failed NOAA fetch shouldn't stick in caches
+    max_age = 300 if fallback else TIDE_RANGE_MAX_AGE
+    headers = {"ETag": tag, "Cache-Control": f"public, max-age={max_age}"}
+    if series.etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    if format == "columnar":
+        return TimedJSONResponse(series.columnar(meta, t, v), headers=headers)
+    return StreamingResponse(series.ndjson(meta, t, v), media_type="application/x-ndjson", headers=headers)
+
 @app.get("/predictions/week")
-def predictions_week():
+async def predictions_week(
+    station: str = Query(None),
+    lat: float = Query(None),
+    lon: float = Query(None),
+):
+    used_station, source_station = resolve_station(station, lat, lon)
+    info = station_index.get(used_station)
+    if lat is None or lon is None:
+        lat, lon = (info["lat"], info["lon"]) if info else (None, None)
     today = datetime.date.today()
-    predictions = []
-    for i in range(7):
-        day = today + datetime.timedelta(days=i)
-        predictions.append({
-            "date": day.strftime("%Y-%m-%d"),
-            "fishing": "Good" if i % 2 == 0 else "Fair",
-            "hunting": "Average" if i % 3 == 0 else "Below Average"
-        })
-    return {"predictions": predictions}
+    days = [today + datetime.timedelta(days=i) for i in range(7)]
+    dates = [d.strftime("%Y-%m-%d") for d in days]
+    if lat is None or lon is None:
+        # Unknown station and no location: nothing to compute moon times for
+        return {"predictions": [], "station": used_station}
+    key = forecast_cache.key(used_station, lat, lon)
+    cached = await asyncio.to_thread(forecast_cache.get, key, dates)
+    if len(cached) == len(dates):
+        predictions = [cached[d] for d in dates]
+    else:
+        tz = info["timezone"] if info else NOAA_LOCAL_TZ
+        try:
+            tides, _ = await get_hilo(used_station, days[0], days[-1])
+        except (httpx.HTTPError, asyncio.TimeoutError, ValueError):
+            tides = None
+        turning = solunar.turning_times(tides, tz)
+        with stage("solunar"):
+            predictions = solunar.forecast(days, [lat], [lon], [tz], [turning])[0]
+        # Scores without tides are a fallback; don't pin them
+        if len(turning):
+            await asyncio.to_thread(forecast_cache.put, [(key, day) for day in predictions])
+    response = {"predictions": predictions, "station": used_station}
+    if source_station is not None:
+        response["estimated"] = True
+        response["source_station"] = source_station
+    return response
+
+async def precompute_predictions(days=30):
+    """Cache ``days`` days of forecasts for every location in locations.db."""
+    rows = await asyncio.to_thread(
+        lambda: db.conn().execute("SELECT lat, lon, stationId FROM locations WHERE lat IS NOT NULL AND lon IS NOT NULL").fetchall()
+    )
+    return await solunar.precompute(
+        forecast_cache, rows, station_index, get_hilo, days=days,
+        default_tz=NOAA_LOCAL_TZ, concurrency=TIDE_BATCH_CONCURRENCY,
+    )
@@ -0,0 +1,333 @@
+"""Request instrumentation: stage timings, counters, histograms, profiling.
+
+``stage(name)`` times a block (station resolution, DB read/write, upstream
+call, serialization, ...) into the ``tide_stage_duration_seconds`` histogram
+and into the current request's trace, which ``MetricsMiddleware`` returns as a
+``Server-Timing`` header. ``REGISTRY.render()`` produces the Prometheus text
+format served at ``/metrics``.
+
+Profiling is opt-in: a request is profiled when it sends ``X-Profile:
+<PROFILE_TOKEN>`` or is picked by ``PROFILE_SAMPLE_RATE``. A sampler thread
+records stacks every ``PROFILE_INTERVAL_MS`` while the request runs and writes
+collapsed stacks (flamegraph.pl / speedscope input) to ``PROFILE_DIR``. It
+samples the event loop thread plus any worker thread working for the request:
+sync endpoints (through ``ProfiledRoute``) and ``stage()`` blocks run with
+``asyncio.to_thread`` register their thread while they run. Loop samples show
+whatever the loop is running, so concurrent requests share them.
+"""
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter as Tally
+
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("tide.metrics")
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def count(self, *labels):
+        row = self._values.get(labels)
+        return sum(row[:-1]) if row else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, row in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), row[:-1]):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else repr(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {row[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, type, help, [(labels dict, value)])]``, called at scrape time."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for fn in self.collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter("tide_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+REQUEST_TIME = REGISTRY.histogram("tide_http_request_duration_seconds", "HTTP request latency", ["route"])
+STAGE_TIME = REGISTRY.histogram("tide_stage_duration_seconds", "Time spent per request stage", ["stage"])
+UPSTREAM_REQUESTS = REGISTRY.counter("tide_upstream_requests_total", "Upstream calls by host and HTTP status (or error type)", ["host", "status"])
+UPSTREAM_ERRORS = REGISTRY.counter("tide_upstream_errors_total", "Upstream calls that failed (transport errors and 4xx/5xx)", ["host", "kind"])
+UPSTREAM_TIME = REGISTRY.histogram("tide_upstream_duration_seconds", "Upstream call latency", ["host"])
+
+_trace = contextvars.ContextVar("tide_trace", default=None)
+_sampler = contextvars.ContextVar("tide_sampler", default=None)
+
+
+@contextlib.contextmanager
+def track_thread():
+    """Include the calling thread in the current request's profile, if any, for the block."""
+    sampler = _sampler.get()
+    if sampler is None:
+        yield
+        return
+    ident = threading.get_ident()
+    sampler.add(ident)
+    try:
+        yield
+    finally:
+        sampler.discard(ident)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a block as request stage ``name``."""
+    start = time.perf_counter()
+    try:
+        with track_thread():
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_TIME.observe(elapsed, name)
+        trace = _trace.get()
+        if trace is not None:
+            trace[name] = trace.get(name, 0.0) + elapsed
+
+
+def observe_upstream(host, status, elapsed):
+    """Record one upstream attempt; ``status`` is an HTTP status or an exception name."""
+    UPSTREAM_REQUESTS.inc(host, str(status))
+    UPSTREAM_TIME.observe(elapsed, host)
+    if not isinstance(status, int):
+        UPSTREAM_ERRORS.inc(host, "transport")
+    elif status >= 400:
+        UPSTREAM_ERRORS.inc(host, "http")
+    trace = _trace.get()
+    if trace is not None:
+        trace["upstream"] = trace.get("upstream", 0.0) + elapsed
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records rendering as the ``serialization`` stage."""
+
+    def render(self, content):
+        with stage("serialization"):
+            return super().render(content)
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose sync endpoint registers its threadpool thread with the request's sampler."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            call = endpoint
+
+            @functools.wraps(call)
+            def endpoint(*args, **kw):
+                with track_thread():
+                    return call(*args, **kw)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class Sampler:
+    """Samples the stacks of a set of threads at a fixed interval into collapsed stacks.
+
+    ``thread_id`` is always sampled; ``add`` / ``discard`` track other threads
+    (nested registrations of one thread are counted).
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Tally()
+        self._threads = Tally()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] += 1
+
+    def discard(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] -= 1
+            if self._threads[thread_id] <= 0:
+                del self._threads[thread_id]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = {self.thread_id, *self._threads}
+            frames = sys._current_frames()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        return path
+
+
+def _profile_requested(scope):
+    if PROFILE_TOKEN:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile" and hmac.compare_digest(value, PROFILE_TOKEN.encode()):
+                return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class MetricsMiddleware:
+    """Counts and times every HTTP request, adds ``Server-Timing``, runs the profiler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = {}
+        token = _trace.set(trace)
+        sampler = Sampler(threading.get_ident()).start() if _profile_requested(scope) else None
+        sampler_token = _sampler.set(sampler)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = ", ".join(f"{name};dur={secs * 1000:.2f}" for name, secs in trace.items())
+                if timing:
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", timing.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            _trace.reset(token)
+            _sampler.reset(sampler_token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUESTS.inc(scope["method"], path, status)
+            REQUEST_TIME.observe(elapsed, path)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(json.dumps({
+                    "route": path, "status": status, "ms": round(elapsed * 1000, 3),
+                    "stages": {k: round(v * 1000, 3) for k, v in trace.items()},
+                }))
+            if sampler is not None:
+                sampler.stop()
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{path.strip('/').replace('/', '_') or 'root'}-{os.getpid()}.folded"
+                try:
+                    written = await asyncio.to_thread(sampler.write, os.path.join(PROFILE_DIR, name))
+                    logger.info("profile for %s written to %s", path, written)
+                except OSError as exc:
+                    logger.warning("could not write profile: %s", exc)
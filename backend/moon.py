@@ -0,0 +1,177 @@
+"""Moon phase, illumination, age and rise/set times computed locally.
+
+Positions use the truncated lunar and solar series from Meeus, "Astronomical
+Algorithms" (ch. 25 and 47), good to a few arcminutes, which puts rise/set
+times within a couple of minutes. Everything is evaluated with NumPy over a
+(days x samples) grid, so a week or a year is one batched call.
+"""
+import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+SYNODIC_MONTH = 29.530588853  # days
+STEP_MINUTES = 10
+
+PRINCIPAL_PHASES = ["New Moon", "First Quarter", "Full Moon", "Last Quarter"]
+INTERMEDIATE_PHASES = ["Waxing Crescent", "Waxing Gibbous", "Waning Gibbous", "Waning Crescent"]
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def local_midnights(dates, tz="UTC"):
+    """Unix seconds of local midnight for each date in ``tz``."""
+    zone = ZoneInfo(tz)
+    return np.array([
+        (datetime.datetime(d.year, d.month, d.day, tzinfo=zone) - _EPOCH).total_seconds()
+        for d in dates
+    ])
+
+
+def julian_day(unix_seconds):
+    return np.asarray(unix_seconds, dtype=float) / 86400.0 + 2440587.5
+
+
+def sun_moon_position(jd):
+    """Geocentric ecliptic longitudes, moon RA/Dec and horizontal parallax (radians)."""
+    T = (jd - 2451545.0) / 36525.0
+    Lp = np.radians(218.3164477 + 481267.88123421 * T)
+    D = np.radians(297.8501921 + 445267.1114034 * T)
+    M = np.radians(357.5291092 + 35999.0502909 * T)
+    Mp = np.radians(134.9633964 + 477198.8675055 * T)
+    F = np.radians(93.2720950 + 483202.0175233 * T)
+
+    moon_lon = Lp + np.radians(
+        6.289 * np.sin(Mp)
+        + 1.274 * np.sin(2 * D - Mp)
+        + 0.658 * np.sin(2 * D)
+        + 0.214 * np.sin(2 * Mp)
+        - 0.186 * np.sin(M)
+        - 0.114 * np.sin(2 * F)
+    )
+    moon_lat = np.radians(
+        5.128 * np.sin(F)
+        + 0.280 * np.sin(Mp + F)
+        + 0.277 * np.sin(Mp - F)
+        + 0.173 * np.sin(2 * D - F)
+    )
+    distance = 385001.0 - 20905.0 * np.cos(Mp) - 3699.0 * np.cos(2 * D - Mp) - 2956.0 * np.cos(2 * D)
+    parallax = np.arcsin(6378.14 / distance)
+
+    L0 = np.radians(280.46646 + 36000.76983 * T)
+    sun_lon = L0 + np.radians(1.914602 * np.sin(M) + 0.019993 * np.sin(2 * M))
+
+    eps = np.radians(23.439291 - 0.0130042 * T)
+    ra = np.arctan2(np.sin(moon_lon) * np.cos(eps) - np.tan(moon_lat) * np.sin(eps), np.cos(moon_lon))
+    dec = np.arcsin(np.sin(moon_lat) * np.cos(eps) + np.cos(moon_lat) * np.sin(eps) * np.sin(moon_lon))
+    return sun_lon, moon_lon, ra, dec, parallax
+
+
+def elongation(jd):
+    """Moon-sun elongation in degrees, 0..360 (0 = new, 180 = full)."""
+    sun_lon, moon_lon, _, _, _ = sun_moon_position(jd)
+    return np.degrees(moon_lon - sun_lon) % 360.0
+
+
+def hour_angle(jd, ra, lon):
+    gmst = np.radians(280.46061837 + 360.98564736629 * (jd - 2451545.0))
+    return (gmst + np.radians(lon) - ra + np.pi) % (2 * np.pi) - np.pi
+
+
+def moon_horizontal(jd, lat, lon, ra, dec, parallax):
+    """Altitude (degrees), rise/set threshold h0 (degrees) and hour angle (radians)
+    for a precomputed moon position."""
+    phi = np.radians(lat)
+    H = hour_angle(jd, ra, lon)
+    alt = np.arcsin(np.sin(phi) * np.sin(dec) + np.cos(phi) * np.cos(dec) * np.cos(H))
+    h0 = 0.7275 * np.degrees(parallax) - 0.5667
+    return np.degrees(alt), h0, H
+
+
+def moon_altitude(jd, lat, lon):
+    """Geocentric altitude (degrees) and rise/set altitude threshold h0 (degrees)."""
+    _, _, ra, dec, parallax = sun_moon_position(jd)
+    alt, h0, _ = moon_horizontal(jd, lat, lon, ra, dec, parallax)
+    return alt, h0
+
+
+def _first_crossing(t, f, rising, valid=None):
+    """First zero crossing of f along axis 1, linearly interpolated. NaN if none.
+
+    ``valid`` masks sample pairs that may hold a crossing (e.g. to skip the
+    jump where an angle wraps around).
+    """
+    a, b = f[:, :-1], f[:, 1:]
+    mask = (a < 0) & (b >= 0) if rising else (a >= 0) & (b < 0)
+    if valid is not None:
+        mask &= valid
+    idx = mask.argmax(axis=1)
+    rows = np.arange(f.shape[0])
+    fa, fb = a[rows, idx], b[rows, idx]
+    frac = fa / (fa - fb)
+    times = t[rows, idx] + frac * (t[rows, idx + 1] - t[rows, idx])
+    return np.where(mask.any(axis=1), times, np.nan)
+
+
+def moon_data(dates, lat=None, lon=None, tz="UTC"):
+    """Vectorized moon data for a sequence of dates.
+
+    Returns a dict of arrays: ``phase`` (names), ``illumination`` (0..1 at local
+    noon), ``age`` (days since new moon at local noon) and, when lat/lon are
+    given, ``moonrise``/``moonset`` as Unix seconds (NaN when the moon does not
+    rise or set that day).
+    """
+    start = local_midnights(dates, tz)
+    end = local_midnights([d + datetime.timedelta(days=1) for d in dates], tz)
+
+    e_start = elongation(julian_day(start))
+    e_end = e_start + (elongation(julian_day(end)) - e_start) % 360.0
+    q_start = np.floor(e_start / 90.0).astype(int)
+    q_end = np.floor(e_end / 90.0).astype(int)
+    phase = np.where(
+        q_end > q_start,
+        np.array(PRINCIPAL_PHASES)[q_end % 4],
+        np.array(INTERMEDIATE_PHASES)[q_start % 4],
+    )
+
+    e_noon = elongation(julian_day((start + end) / 2))
+    result = {
+        "phase": phase,
+        "illumination": (1 - np.cos(np.radians(e_noon))) / 2,
+        "age": e_noon / 360.0 * SYNODIC_MONTH,
+    }
+
+    if lat is not None and lon is not None:
+        samples = 24 * 60 // STEP_MINUTES + 1
+        frac = np.linspace(0.0, 1.0, samples)
+        t = start[:, None] + (end - start)[:, None] * frac[None, :]
+        alt, h0 = moon_altitude(julian_day(t), lat, lon)
+        f = alt - h0
+        result["moonrise"] = _first_crossing(t, f, rising=True)
+        result["moonset"] = _first_crossing(t, f, rising=False)
+    return result
+
+
+def _clock(ts, zone):
+    if np.isnan(ts):
+        return None
+    return datetime.datetime.fromtimestamp(float(ts), zone).strftime("%H:%M")
+
+
+def moon_days(dates, lat=None, lon=None, tz="UTC"):
+    """``moon_data`` as one JSON-ready dict per date."""
+    data = moon_data(dates, lat, lon, tz)
+    zone = ZoneInfo(tz)
+    days = []
+    for i, d in enumerate(dates):
+        day = {
+            "date": d.strftime("%Y-%m-%d"),
+            "phase": str(data["phase"][i]),
+            "illumination": round(float(data["illumination"][i]), 3),
+            "age": round(float(data["age"][i]), 2),
+        }
+        if "moonrise" in data:
+            day["moonrise"] = _clock(data["moonrise"][i], zone)
+            day["moonset"] = _clock(data["moonset"][i], zone)
+        days.append(day)
+    return days
@@ -0,0 +1,192 @@
+"""Background prefetch of predictions for the most used stations.
+
+``locations.last_used`` ranks stations by recent use. For the top
+``PREFETCH_STATIONS`` the scheduler keeps the next ``PREFETCH_DAYS`` days of
+hilo predictions in ``PredictionCache`` and the matching solunar forecasts
+(moon events and scores) in ``ForecastCache``, so the first request of the day
+is served warm. After local midnight only the one new day per station is
+missing, and those fetches are spaced ``PREFETCH_SPACING`` seconds apart and
+capped at ``PREFETCH_BUDGET`` upstream fetches per day. Upstream calls also go
+through the global ``UPSTREAM_RATE_LIMIT`` in ``upstream``.
+"""
+import asyncio
+import datetime
+import logging
+import os
+
+import httpx
+
+import solunar
+
+logger = logging.getLogger("tide.prefetch")
+
+PREFETCH_STATIONS = int(os.getenv("PREFETCH_STATIONS", "50"))  # 0 disables prefetching
+PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS", "7"))
+PREFETCH_BUDGET = int(os.getenv("PREFETCH_BUDGET", "200"))  # upstream fetches per day
+PREFETCH_SPACING = float(os.getenv("PREFETCH_SPACING", "1"))
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "3600"))
+PREFETCH_RECENT_DAYS = int(os.getenv("PREFETCH_RECENT_DAYS", "30"))
+PREFETCH_LOCATIONS = int(os.getenv("PREFETCH_LOCATIONS", "1000"))
+PREFETCH_START_DELAY = float(os.getenv("PREFETCH_START_DELAY", "10"))
+
+# Most recent rows considered when ranking; walks the last_used index
+RANK_SCAN = 20000
+
+
+def popular_stations(conn, limit, recent_days=PREFETCH_RECENT_DAYS):
+    """Station ids ranked by recent use, each use weighted by 1 / (1 + age in days)."""
+    rows = conn.execute('''SELECT stationId, SUM(1.0 / (1.0 + julianday('now') - julianday(last_used))) AS score
+        FROM (SELECT stationId, last_used FROM locations
+              WHERE last_used >= datetime('now', ?) ORDER BY last_used DESC LIMIT ?)
+        WHERE stationId IS NOT NULL AND stationId != ''
+        GROUP BY stationId ORDER BY score DESC LIMIT ?''', (f"-{recent_days} days", RANK_SCAN, limit)).fetchall()
+    return [r[0] for r in rows]
+
+
+def recent_locations(conn, stations, limit=PREFETCH_LOCATIONS, recent_days=PREFETCH_RECENT_DAYS):
+    """(lat, lon, stationId) of recently used locations near ``stations``."""
+    if not stations:
+        return []
+    marks = ",".join("?" * len(stations))
+    return conn.execute(f'''SELECT lat, lon, stationId FROM locations
+        WHERE stationId IN ({marks}) AND lat IS NOT NULL AND lon IS NOT NULL AND last_used >= datetime('now', ?)
+        ORDER BY last_used DESC LIMIT ?''', list(stations) + [f"-{recent_days} days", limit]).fetchall()
+
+
+def seconds_until_midnight(now=None):
+    now = now or datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return (midnight - now).total_seconds()
+
+
+class Prefetcher:
+    """Warms the hilo and forecast caches for popular stations on a schedule.
+
+    The window is today (the server's local date, as the ``/tide`` and
+    ``/predictions`` endpoints use) through ``days - 1`` days ahead. ``run``
+    does one pass; ``start`` runs a pass every ``interval`` seconds and right
+    after local midnight, when the window rolls forward.
+    """
+
+    def __init__(self, db, hilo_cache, forecast_cache, station_index, get_hilo, stations=PREFETCH_STATIONS,
+                 days=PREFETCH_DAYS, budget=PREFETCH_BUDGET, spacing=PREFETCH_SPACING, interval=PREFETCH_INTERVAL,
+                 default_tz="UTC", offline=None):
+        self.db = db
+        self.hilo_cache = hilo_cache
+        self.forecast_cache = forecast_cache
+        self.station_index = station_index
+        self.get_hilo = get_hilo
+        self.stations = stations
+        self.days = days
+        self.budget = budget
+        self.spacing = spacing
+        self.interval = interval
+        self.default_tz = default_tz
+        # Stations answered without upstream calls or the hilo cache
+        self.offline = offline or (lambda station: False)
+        self._task = None
+        self.day = None
+        self.spent = 0
+        self.runs = 0
+        self.fetched = 0
+        self.errors = 0
+        self.forecasts = 0
+
+    def stats(self):
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "budget": self.budget,
+            "spent": self.spent,
+            "runs": self.runs,
+            "fetched": self.fetched,
+            "errors": self.errors,
+            "forecasts": self.forecasts,
+        }
+
+    def _uncached_forecasts(self, locations, dates):
+        todo = {}
+        for lat, lon, station in locations:
+            key = self.forecast_cache.key(station, lat, lon)
+            if key not in todo and self.forecast_cache.missing(key, dates):
+                todo[key] = (lat, lon, station)
+        return todo
+
+    async def run(self, today=None):
+        """One pass. Returns (stations fetched, forecast locations stored)."""
+        today = today or datetime.date.today()
+        if today != self.day:
+            self.day, self.spent = today, 0
+        self.runs += 1
+        begin, end = today, today + datetime.timedelta(days=self.days - 1)
+        # Each worker thread uses its own connection (see db.Database)
+        stations = await asyncio.to_thread(lambda: popular_stations(self.db.conn(), self.stations))
+
+        warm = []
+        fetched = 0
+        for station in stations:
+            if self.offline(station):
+                warm.append(station)
+                continue
+            if not await asyncio.to_thread(self.hilo_cache.missing, station, begin, end):
+                warm.append(station)
+                continue
+            if self.spent >= self.budget:
+                logger.info("prefetch budget of %d fetches for %s used up", self.budget, today)
+                break
+            if fetched:
+                await asyncio.sleep(self.spacing)
+            self.spent += 1
+            try:
+                # Straight to the cache: no harmonic fallback to hide a failed fetch
+                await self.hilo_cache.get_hilo(station, begin, end)
+            except (httpx.HTTPError, asyncio.TimeoutError, ValueError) as exc:
+                self.errors += 1
+                logger.warning("prefetch of %s failed: %r", station, exc)
+                continue
+            fetched += 1
+            warm.append(station)
+        self.fetched += fetched
+
+        # Forecasts only where tides are cached, so they cost no upstream calls
+        dates = [(begin + datetime.timedelta(days=i)).isoformat() for i in range(self.days)]
+        locations = list(await asyncio.to_thread(lambda: recent_locations(self.db.conn(), warm)))
+        for station in warm:
+            info = self.station_index.get(station)
+            if info:
+                locations.append((info["lat"], info["lon"], station))
+        todo = await asyncio.to_thread(self._uncached_forecasts, locations, dates)
+        stored = 0
+        if todo:
+            stored = await solunar.precompute(
+                self.forecast_cache, list(todo.values()), self.station_index, self.get_hilo,
+                days=self.days, start=begin, default_tz=self.default_tz,
+            )
+            self.forecasts += stored
+        logger.info("prefetch: %d popular stations, %d fetched, %d forecasts", len(stations), fetched, stored)
+        return fetched, stored
+
+    async def _run(self, delay):
+        await asyncio.sleep(delay)
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Keep the schedule alive whatever broke this pass
+                logger.exception("prefetch pass failed")
+            # A second past midnight so date.today() has rolled over
+            await asyncio.sleep(min(self.interval, seconds_until_midnight() + 1))
+
+    def start(self, delay=PREFETCH_START_DELAY):
+        if self._task is None and self.stations > 0 and self.days > 0:
+            self._task = asyncio.create_task(self._run(delay))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
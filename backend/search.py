@@ -0,0 +1,187 @@
+"""Location search over the ``locations`` table.
+
+Text queries go through an FTS5 index (``locations_fts``, external content,
+kept in sync by triggers) with prefix matching for autocomplete. The best
+BM25 candidates are re-ranked with a ``last_used`` recency boost. A single
+short prefix that matches a large part of the table ("b", "ma") skips BM25
+and walks the ``last_used`` index instead, since ranking every match would
+cost a scan. All-digit queries are ZIP lookups on the ``locations_zip`` index.
+"""
+import re
+
+RECENCY_WEIGHT = 1.0  # bm25 points for a location used right now, decaying by day
+CANDIDATES = 200  # BM25 hits re-ranked by recency
+DENSE_PREFIX = 1000  # matches above which a single-word prefix walks last_used
+BM25_WEIGHTS = "10.0, 2.0, 1.0"  # town, state, zip
+REBUILD_HASHSIZE = 64 << 20  # FTS5 pending-terms buffer for a full rebuild (default 1MB)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+SECONDARY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS locations_zip ON locations(zip)",
+    "CREATE INDEX IF NOT EXISTS locations_last_used ON locations(last_used)",
+]
+
+TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS locations_ai AFTER INSERT ON locations BEGIN
+        INSERT INTO locations_fts(rowid, town, state, zip) VALUES (new.id, new.town, new.state, new.zip);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS locations_ad AFTER DELETE ON locations BEGIN
+        INSERT INTO locations_fts(locations_fts, rowid, town, state, zip) VALUES ('delete', old.id, old.town, old.state, old.zip);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS locations_au AFTER UPDATE OF town, state, zip ON locations BEGIN
+        INSERT INTO locations_fts(locations_fts, rowid, town, state, zip) VALUES ('delete', old.id, old.town, old.state, old.zip);
+        INSERT INTO locations_fts(rowid, town, state, zip) VALUES (new.id, new.town, new.state, new.zip);
+    END''',
+]
+
+
+def init_search(conn):
+    """Indexes, (town, state) uniqueness and the FTS5 table for ``locations``.
+
+    Runs in one IMMEDIATE transaction, so workers starting together take
+    turns and only the first one builds anything.
+    """
+    conn.commit()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        keyed = c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='locations_town_state'").fetchone()
+        # Older databases may hold duplicate (town, state) rows; keep the oldest
+        # row of each group with the most recent last_used before adding the key
+        if not keyed and c.execute("SELECT 1 FROM locations GROUP BY town, state HAVING COUNT(*) > 1 LIMIT 1").fetchone():
+            c.execute("CREATE TEMP TABLE locations_keep (id INTEGER PRIMARY KEY, last_used TEXT)")
+            c.execute('''INSERT INTO locations_keep
+                SELECT MIN(id), MAX(last_used) FROM locations GROUP BY town, state HAVING COUNT(*) > 1''')
+            c.execute('''UPDATE locations SET last_used = (SELECT k.last_used FROM locations_keep k WHERE k.id = locations.id)
+                WHERE id IN (SELECT id FROM locations_keep)''')
+            c.execute("DELETE FROM locations WHERE id NOT IN (SELECT MIN(id) FROM locations GROUP BY town, state)")
+            c.execute("DROP TABLE temp.locations_keep")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS locations_town_state ON locations(town, state)")
+        for index in SECONDARY_INDEXES:
+            c.execute(index)
+        exists = c.execute("SELECT 1 FROM sqlite_master WHERE name='locations_fts'").fetchone()
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS locations_fts USING fts5(
+            town, state, zip,
+            content='locations', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='1 2 3'
+        )''')
+        if not exists:
+            c.execute(f"INSERT INTO locations_fts(locations_fts, rank) VALUES ('rank', 'bm25({BM25_WEIGHTS})')")
+            c.execute("INSERT INTO locations_fts(locations_fts) VALUES ('rebuild')")
+        for trigger in TRIGGERS:
+            c.execute(trigger)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def fts_query(query):
+    """Prefix-match every word of ``query``; None if it has no searchable words."""
+    tokens = TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def _rows(c):
+    cols = [col[0] for col in c.description]
+    return [dict(zip(cols, row)) for row in c.fetchall()]
+
+
+def search_locations(conn, query=None, limit=5):
+    c = conn.cursor()
+    query = (query or "").strip()
+    if not query:
+        c.execute("SELECT * FROM locations ORDER BY last_used DESC LIMIT ?", (limit,))
+        return _rows(c)
+    if query.isdigit():
+        # ZIP prefix as an index range scan; one or two digits match so many
+        # rows that walking the recency index finds the first few sooner
+        upper = query[:-1] + chr(ord(query[-1]) + 1)
+        index = "locations_zip" if len(query) >= 3 else "locations_last_used"
+        c.execute(
+            f"SELECT * FROM locations INDEXED BY {index} WHERE zip >= ? AND zip < ? ORDER BY last_used DESC LIMIT ?",
+            (query, upper, limit),
+        )
+        return _rows(c)
+    match = fts_query(query)
+    if match is None:
+        return []
+    tokens = TOKEN_RE.findall(query.lower())
+    if len(tokens) == 1:
+        c.execute("SELECT rowid FROM locations_fts WHERE locations_fts MATCH ? LIMIT ?", (match, DENSE_PREFIX + 1))
+        if len(c.fetchall()) > DENSE_PREFIX:
+            like = tokens[0].replace("\\", "\\\\").replace("_", "\\_") + "%"
+            c.execute('''SELECT * FROM locations INDEXED BY locations_last_used
+                WHERE town LIKE ? ESCAPE '\\' OR town LIKE ? ESCAPE '\\' OR state LIKE ? ESCAPE '\\'
+                ORDER BY last_used DESC LIMIT ?''', (like, "% " + like, like, limit))
+            return _rows(c)
+    c.execute('''WITH hits AS (
+            SELECT rowid, rank FROM locations_fts WHERE locations_fts MATCH ? ORDER BY rank LIMIT ?
+        )
+        SELECT l.* FROM hits JOIN locations l ON l.id = hits.rowid
+        ORDER BY hits.rank - ? / (1.0 + MAX(0.0, julianday('now') - julianday(l.last_used)))
+        LIMIT ?''', (match, max(CANDIDATES, limit), RECENCY_WEIGHT, limit))
+    return _rows(c)
+
+
+def bulk_load(conn, rows, station_index=None, batch_size=50000, progress=None):
+    """Upsert many locations at once.
+
+    ``rows`` is an iterable of (town, state, zip, lat, lon, stationId) tuples;
+    a missing stationId is filled in from ``station_index``. The FTS triggers
+    and secondary indexes are dropped for the load and rebuilt once at the
+    end; the (town, state) key stays, since the upsert needs it.
+    ``progress(total)`` is called after each committed batch.
+    Returns the number of rows processed.
+    """
+    c = conn.cursor()
+    for name in ("locations_ai", "locations_ad", "locations_au"):
+        c.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for name in ("locations_zip", "locations_last_used"):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+    total = 0
+    batch = []
+
+    def flush():
+        if station_index is not None:
+            todo = [i for i, r in enumerate(batch) if not r[5] and r[3] is not None and r[4] is not None]
+            if todo:
+                ids = station_index.nearest_ids([batch[i][3] for i in todo], [batch[i][4] for i in todo])
+                for i, sid in zip(todo, ids):
+                    batch[i] = batch[i][:5] + (sid,)
+        c.executemany('''INSERT INTO locations (town, state, zip, lat, lon, stationId) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(town, state) DO UPDATE SET
+                zip = COALESCE(NULLIF(excluded.zip, ''), zip),
+                lat = COALESCE(excluded.lat, lat),
+                lon = COALESCE(excluded.lon, lon),
+                stationId = COALESCE(excluded.stationId, stationId)''', batch)
+        conn.commit()
+        batch.clear()
+        if progress:
+            progress(total)
+
+    try:
+        for row in rows:
+            batch.append(tuple(row))
+            if len(batch) >= batch_size:
+                total += len(batch)
+                flush()
+        if batch:
+            total += len(batch)
+            flush()
+    finally:
+        conn.rollback()
+        for index in SECONDARY_INDEXES:
+            c.execute(index)
+        c.execute("INSERT INTO locations_fts(locations_fts, rank) VALUES ('hashsize', ?)", (REBUILD_HASHSIZE,))
+        c.execute("INSERT INTO locations_fts(locations_fts) VALUES ('rebuild')")
+        c.execute("INSERT INTO locations_fts(locations_fts, rank) VALUES ('hashsize', 1048576)")
+        for trigger in TRIGGERS:
+            c.execute(trigger)
+        conn.commit()
+    return total
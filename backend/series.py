@@ -0,0 +1,81 @@
+"""Tide curves for charts: downsampling and compact encodings.
+
+``lttb`` picks ``n`` points that keep the curve's shape (Largest Triangle
+Three Buckets). ``ndjson`` streams a header line then one ``{"t", "v"}`` line
+per point, a chunk at a time; ``columnar`` packs times as little-endian uint32
+seconds after ``t0`` and heights as float32, both base64 encoded, so a
+JavaScript client can wrap them in a ``Uint32Array`` / ``Float32Array``.
+"""
+import base64
+import hashlib
+import json
+
+import numpy as np
+
+NDJSON_CHUNK = 2048
+
+
+def lttb(t, v, n):
+    """Indices of the ``n`` points of (t, v) chosen by Largest Triangle Three Buckets."""
+    size = len(t)
+    if n >= size or n < 3:
+        return np.arange(size)
+    every = (size - 2) / (n - 2)
+    idx = np.empty(n, dtype=np.int64)
+    idx[0], idx[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start = int(i * every) + 1
+        stop = int((i + 1) * every) + 1
+        # Average of the next bucket (the last point for the final bucket)
+        nstop = min(int((i + 2) * every) + 1, size)
+        avg_t = t[stop:nstop].mean()
+        avg_v = v[stop:nstop].mean()
+        area = np.abs((t[a] - avg_t) * (v[start:stop] - v[a]) - (t[a] - t[start:stop]) * (avg_v - v[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
+def etag(meta, t, v):
+    """Strong validator over the response metadata and the exact values sent."""
+    h = hashlib.sha256(json.dumps(meta, sort_keys=True).encode())
+    h.update(np.ascontiguousarray(t, dtype=np.int64).tobytes())
+    h.update(np.round(v, 3).tobytes())
+    return f'"{h.hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match, tag):
+    """Whether an ``If-None-Match`` header matches ``tag``, using weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = tag[2:] if tag.startswith("W/") else tag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def ndjson(meta, t, v, chunk=NDJSON_CHUNK):
+    yield json.dumps(meta).encode() + b"\n"
+    t = t.astype(np.int64)
+    for c in range(0, len(t), chunk):
+        yield "".join(
+            f'{{"t":{ts},"v":{h:.3f}}}\n' for ts, h in zip(t[c:c + chunk].tolist(), v[c:c + chunk].tolist())
+        ).encode()
+
+
+def columnar(meta, t, v):
+    t = t.astype(np.int64)
+    t0 = int(t[0]) if len(t) else 0
+    return {
+        **meta,
+        "t0": t0,
+        "t": base64.b64encode((t - t0).astype("<u4").tobytes()).decode(),
+        "v": base64.b64encode(v.astype("<f4").tobytes()).decode(),
+    }
@@ -0,0 +1,393 @@
+"""Solunar fishing and hunting forecasts.
+
+Major periods are the two hours centred on the moon's upper transit and on its
+lower transit ("underfoot"); minor periods are the hour centred on moonrise and
+on moonset. Each hour of the day is scored by how much of it falls inside a
+period, weighted up around new and full moon; fishing scores also count the
+hours around tide turning points (hilo times).
+
+The moon's position does not depend on the observer, so it is computed once on
+a shared 5-minute UTC grid and gathered for every (location, day, sample).
+Only the hour angle and altitude are evaluated per location, which makes a
+month for hundreds of locations a single batch of array operations.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import threading
+from collections import OrderedDict
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from db import database
+from metrics import stage
+from moon import _first_crossing, elongation, julian_day, local_midnights, moon_data, moon_horizontal, sun_moon_position
+
+STEP_SECONDS = 600  # rise/set/transit sampling per location
+GRID_SECONDS = 300  # shared ephemeris grid; every UTC offset is a multiple of 15 min
+SAMPLES = 25 * 3600 // STEP_SECONDS + 1  # covers 25-hour DST days
+
+MAJOR_MINUTES = 120
+MINOR_MINUTES = 60
+TIDE_MINUTES = 120  # window around a tide turning point
+MINOR_WEIGHT = 0.6
+TIDE_WEIGHT = 0.4  # share of the fishing score from tides
+PHASE_WEIGHT = 0.3  # share of the score that depends on the moon phase
+BEST_HOURS = 6  # daily score is the mean of the best hours
+
+# Cut points near the quartiles of two months of scores at US coastal points
+# with semidiurnal tides
+FISHING_LABELS = [(65, "Excellent"), (52, "Good"), (42, "Fair"), (0, "Poor")]
+HUNTING_LABELS = [(70, "Excellent"), (62, "Good"), (55, "Average"), (0, "Below Average")]
+
+
+def label(score, labels):
+    for threshold, name in labels:
+        if score >= threshold:
+            return name
+    return labels[-1][1]
+
+
+def solunar_events(dates, lats, lons, tzs):
+    """Transit, underfoot, moonrise and moonset for every location and day.
+
+    ``lats``/``lons``/``tzs`` describe L locations, ``dates`` D consecutive
+    days. Returns (L, D + 2) arrays of Unix seconds (NaN when an event does not
+    happen that day) including one padding day on each side, so periods that
+    spill over midnight can be scored, plus ``start``/``end`` local midnights.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    ext = [dates[0] - datetime.timedelta(days=1)] + list(dates) + [dates[-1] + datetime.timedelta(days=1)]
+    bounds = {tz: local_midnights(ext + [ext[-1] + datetime.timedelta(days=1)], tz) for tz in set(tzs)}
+    mids = np.array([bounds[tz] for tz in tzs]).reshape(len(tzs), len(ext) + 1)
+    start, end = mids[:, :-1], mids[:, 1:]
+
+    t = start[..., None] + STEP_SECONDS * np.arange(SAMPLES)
+    t0 = start.min()
+    idx = np.rint((t - t0) / GRID_SECONDS).astype(int)
+    jd_grid = julian_day(t0 + GRID_SECONDS * np.arange(idx.max() + 1))
+    _, _, ra, dec, parallax = sun_moon_position(jd_grid)
+    alt, h0, H = moon_horizontal(
+        jd_grid[idx], lats[:, None, None], lons[:, None, None], ra[idx], dec[idx], parallax[idx],
+    )
+
+    rows = t.reshape(-1, SAMPLES)
+    past_end = (t > end[..., None]).reshape(-1, SAMPLES)
+    horizon = np.where(past_end, np.nan, (alt - h0).reshape(-1, SAMPLES))
+    upper = np.where(past_end, np.nan, H.reshape(-1, SAMPLES))
+    lower = np.where(past_end, np.nan, H.reshape(-1, SAMPLES) % (2 * np.pi) - np.pi)
+    shape = start.shape
+    return {
+        "start": start,
+        "end": end,
+        # Hour angle passes 0 at transit and +-pi underfoot; skip the wrap jumps
+        "transit": _first_crossing(rows, upper, True, np.abs(np.diff(upper, axis=1)) < np.pi).reshape(shape),
+        "underfoot": _first_crossing(rows, lower, True, np.abs(np.diff(lower, axis=1)) < np.pi).reshape(shape),
+        "moonrise": _first_crossing(rows, horizon, True).reshape(shape),
+        "moonset": _first_crossing(rows, horizon, False).reshape(shape),
+    }
+
+
+def _overlap(hour_start, centers, width):
+    """Fraction of each hour inside the windows of ``width`` seconds around ``centers``.
+
+    ``hour_start`` is (L, D, 24), ``centers`` (L, D, K); NaN centers count as 0.
+    """
+    lo = np.maximum(hour_start[..., None], centers[:, :, None, :] - width / 2)
+    hi = np.minimum(hour_start[..., None] + 3600, centers[:, :, None, :] + width / 2)
+    return np.nan_to_num(np.clip(hi - lo, 0, 3600) / 3600).max(axis=-1, initial=0.0)
+
+
+def activity(events, turning=None):
+    """Hourly and daily fishing/hunting scores (0-100) for ``solunar_events`` output.
+
+    ``turning`` is an (L, K) array of tide turning times (NaN padded), or None.
+    Returns a dict of (L, D, 24) ``fishing_hourly``/``hunting_hourly`` and
+    (L, D) ``fishing``/``hunting``.
+    """
+    start = events["start"]
+    days = start.shape[1] - 2
+    hour_start = start[:, 1:-1, None] + 3600 * np.arange(24)
+
+    def neighbours(*names):
+        # Events of the day before, the day and the day after
+        return np.concatenate([
+            np.stack([events[n][:, d:d + 3] for d in range(days)], axis=1) for n in names
+        ], axis=-1)
+
+    major = _overlap(hour_start, neighbours("transit", "underfoot"), MAJOR_MINUTES * 60)
+    minor = _overlap(hour_start, neighbours("moonrise", "moonset"), MINOR_MINUTES * 60)
+    sol = np.maximum(major, MINOR_WEIGHT * minor)
+
+    # 1 at new and full moon, 0 at the quarters
+    noon = (start[:, 1:-1] + events["end"][:, 1:-1]) / 2
+    phase = np.abs(np.cos(np.radians(elongation(julian_day(noon)))))
+    weight = (1 - PHASE_WEIGHT + PHASE_WEIGHT * phase)[..., None]
+
+    if turning is not None and turning.size:
+        centers = np.broadcast_to(turning[:, None, :], (turning.shape[0], days, turning.shape[1]))
+        tide = _overlap(hour_start, centers, TIDE_MINUTES * 60)
+    else:
+        tide = np.zeros_like(sol)
+    fishing = 100 * weight * ((1 - TIDE_WEIGHT) * sol + TIDE_WEIGHT * tide)
+    hunting = 100 * weight * sol
+    return {
+        "fishing_hourly": fishing,
+        "hunting_hourly": hunting,
+        "fishing": np.sort(fishing, axis=-1)[..., -BEST_HOURS:].mean(axis=-1),
+        "hunting": np.sort(hunting, axis=-1)[..., -BEST_HOURS:].mean(axis=-1),
+    }
+
+
+def turning_times(tides, tz):
+    """Unix seconds of every hilo event in a ``fetch_hilo`` style result."""
+    if not tides:
+        return np.array([])
+    zone = ZoneInfo(tz)
+    times = [
+        datetime.datetime.strptime(e["t"], "%Y-%m-%d %H:%M").replace(tzinfo=zone).timestamp()
+        for day in tides.values() for e in day["highs"] + day["lows"]
+    ]
+    return np.sort(np.array(times, dtype=float))
+
+
+def _pad(rows):
+    width = max((len(r) for r in rows), default=0)
+    out = np.full((len(rows), width), np.nan)
+    for i, r in enumerate(rows):
+        out[i, :len(r)] = r
+    return out
+
+
+def forecast(dates, lats, lons, tzs, turning=None):
+    """JSON-ready daily forecasts, one list of ``len(dates)`` dicts per location.
+
+    ``turning`` is a list with one array of tide turning times per location
+    (empty when tides are unavailable), or None.
+    """
+    events = solunar_events(dates, lats, lons, tzs)
+    scores = activity(events, _pad(turning) if turning is not None else None)
+    phases = {tz: moon_data(dates, tz=tz)["phase"] for tz in set(tzs)}
+    results = []
+    for i, tz in enumerate(tzs):
+        zone = ZoneInfo(tz)
+
+        def clock(ts):
+            return datetime.datetime.fromtimestamp(float(ts), zone).strftime("%H:%M")
+
+        def periods(names, width, d):
+            centers = sorted(events[n][i, d + 1] for n in names if not np.isnan(events[n][i, d + 1]))
+            return [{"start": clock(c - width * 30), "end": clock(c + width * 30)} for c in centers]
+
+        has_tides = turning is not None and len(turning[i]) > 0
+        days = []
+        for d, date in enumerate(dates):
+            fishing = float(scores["fishing"][i, d])
+            hunting = float(scores["hunting"][i, d])
+            days.append({
+                "date": date.strftime("%Y-%m-%d"),
+                "fishing": label(fishing, FISHING_LABELS),
+                "hunting": label(hunting, HUNTING_LABELS),
+                "fishing_score": round(fishing),
+                "hunting_score": round(hunting),
+                "moon_phase": str(phases[tz][d]),
+                "major": periods(("transit", "underfoot"), MAJOR_MINUTES, d),
+                "minor": periods(("moonrise", "moonset"), MINOR_MINUTES, d),
+                "hourly": {
+                    "fishing": [round(float(v)) for v in scores["fishing_hourly"][i, d]],
+                    "hunting": [round(float(v)) for v in scores["hunting_hourly"][i, d]],
+                },
+                "tides": has_tides,
+            })
+        results.append(days)
+    return results
+
+
+class ForecastCache:
+    """Daily forecasts per (station, location, date).
+
+    Like ``PredictionCache``: an in-process LRU in front of the
+    ``solunar_cache`` table, which survives restarts and is shared by workers.
+    """
+
+    def __init__(self, db_path, max_entries=16384):
+        self.db = database(db_path)
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.init_db()
+
+    def init_db(self):
+        conn = self.db.conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS solunar_cache (
+            location TEXT,
+            date TEXT,
+            payload TEXT,
+            computed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (location, date)
+        )''')
+        conn.commit()
+
+    @staticmethod
+    def key(station, lat, lon):
+        # ~1 km of rounding; moon times differ by seconds over that distance
+        return f"{station}:{lat:.2f}:{lon:.2f}"
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def missing(self, location, dates):
+        """``dates`` not cached for ``location`` in either tier. Not counted in ``stats``."""
+        with self._lock:
+            dates = [d for d in dates if (location, d) not in self._lru]
+        if not dates:
+            return []
+        marks = ",".join("?" * len(dates))
+        with stage("db_read"):
+            rows = self.db.conn().execute(
+                f"SELECT date FROM solunar_cache WHERE location=? AND date IN ({marks})", [location] + dates,
+            ).fetchall()
+        found = {r[0] for r in rows}
+        return [d for d in dates if d not in found]
+
+    def _put_memory(self, items):
+        with self._lock:
+            for k, value in items:
+                self._lru[k] = value
+                self._lru.move_to_end(k)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def get(self, location, dates):
+        """Cached days for ``location`` among ``dates`` ("YYYY-MM-DD"), by date."""
+        found = {}
+        missing = []
+        with self._lock:
+            for date in dates:
+                value = self._lru.get((location, date))
+                if value is None:
+                    missing.append(date)
+                else:
+                    self._lru.move_to_end((location, date))
+                    found[date] = value
+        self.hits += len(found)
+        if missing:
+            conn = self.db.conn()
+            marks = ",".join("?" * len(missing))
+            with stage("db_read"):
+                rows = conn.execute(
+                    f"SELECT date, payload FROM solunar_cache WHERE location=? AND date IN ({marks})",
+                    [location] + missing,
+                ).fetchall()
+                loaded = {date: json.loads(payload) for date, payload in rows}
+            self._put_memory(((location, d), v) for d, v in loaded.items())
+            self.disk_hits += len(loaded)
+            self.misses += len(missing) - len(loaded)
+            found.update(loaded)
+        return found
+
+    def put(self, items):
+        """Store ``(location, day)`` pairs; ``day["date"]`` is the date key."""
+        items = [((location, day["date"]), day) for location, day in items]
+        self._put_memory(items)
+        conn = self.db.conn()
+        with stage("db_write"), conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO solunar_cache (location, date, payload) VALUES (?, ?, ?)",
+                [(k[0], k[1], json.dumps(day)) for k, day in items],
+            )
+        return len(items)
+
+
+async def precompute(cache, locations, station_index, get_hilo, days=30, start=None,
+                     default_tz="UTC", concurrency=8, chunk=64):
+    """Forecast ``days`` days for every (lat, lon, stationId) in ``locations``.
+
+    Missing station ids are resolved in one nearest-station pass, tides are
+    fetched once per station (``get_hilo(station, begin, end)``, at most
+    ``concurrency`` at a time) and the forecasts are computed ``chunk``
+    locations per batch. Returns the number of locations stored.
+    """
+    start = start or datetime.date.today()
+    dates = [start + datetime.timedelta(days=i) for i in range(days)]
+    locations = [(lat, lon, sid) for lat, lon, sid in locations if lat is not None and lon is not None]
+    todo = [i for i, loc in enumerate(locations) if not loc[2]]
+    if todo:
+        ids = station_index.nearest_ids([locations[i][0] for i in todo], [locations[i][1] for i in todo])
+        for i, sid in zip(todo, ids):
+            locations[i] = locations[i][:2] + (sid,)
+    # One forecast per cache key
+    unique = {}
+    for lat, lon, sid in locations:
+        unique.setdefault(cache.key(sid, lat, lon), (lat, lon, sid))
+
+    limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def fetch(sid):
+        async with limit:
+            tides, _ = await get_hilo(sid, dates[0], dates[-1])
+            return tides
+
+    stations = list(dict.fromkeys(sid for _, _, sid in unique.values()))
+    fetched = await asyncio.gather(*(fetch(s) for s in stations), return_exceptions=True)
+    tides = {s: t for s, t in zip(stations, fetched) if not isinstance(t, BaseException)}
+
+    keys = list(unique)
+    stored = 0
+    for c in range(0, len(keys), chunk):
+        batch = [unique[k] for k in keys[c:c + chunk]]
+        tzs = []
+        for _, _, sid in batch:
+            info = station_index.get(sid)
+            tzs.append(info["timezone"] if info else default_tz)
+        turning = [turning_times(tides.get(sid), tz) for (_, _, sid), tz in zip(batch, tzs)]
+        results = await asyncio.to_thread(
+            forecast, dates, [b[0] for b in batch], [b[1] for b in batch], tzs, turning,
+        )
+        items = [(k, day) for k, loc_days, turn in zip(keys[c:c + chunk], results, turning) if len(turn) for day in loc_days]
+        if items:
+            await asyncio.to_thread(cache.put, items)
+            stored += len(items) // len(dates)
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solunar forecast tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pre = sub.add_parser("precompute", help="forecast every location in locations.db and cache it")
+    pre.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    import main as app
+    import upstream
+
+    async def run():
+        await upstream.start()
+        try:
+            return await app.precompute_predictions(args.days)
+        finally:
+            await upstream.close()
+
+    print(f"Cached {args.days}-day forecasts for {asyncio.run(run())} locations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""NOAA tide prediction station catalog and nearest-station lookup.
+
+The catalog (``stations_raw.json``, the NOAA metadata API ``tidepredictions``
+listing) is loaded into the ``stations`` table. Lookups go through a KD-tree
+over unit-sphere (x, y, z) coordinates, where chord distance is monotonic in
+great-circle distance, so k-nearest queries stay O(log n) as the catalog grows.
+"""
+import heapq
+import json
+import math
+import os
+import sqlite3
+
+import numpy as np
+
+STATIONS_PATH = os.path.join(os.path.dirname(__file__), "stations_raw.json")
+EARTH_RADIUS_KM = 6371
+LEAF_SIZE = 16
+
+# NOAA timezonecorr (hours from UTC) -> IANA zone used for lst_ldt
+TIMEZONES = {
+    -4: "America/Puerto_Rico",
+    -5: "America/New_York",
+    -6: "America/Chicago",
+    -7: "America/Denver",
+    -8: "America/Los_Angeles",
+    -9: "America/Anchorage",
+    -10: "Pacific/Honolulu",
+    -11: "Pacific/Pago_Pago",
+    9: "Pacific/Palau",
+    10: "Pacific/Guam",
+    12: "Pacific/Majuro",
+}
+
+
+def timezone_for(corr):
+    if corr is None:
+        return "UTC"
+    corr = int(corr)
+    if corr in TIMEZONES:
+        return TIMEZONES[corr]
+    # Etc/GMT zones have inverted signs
+    return f"Etc/GMT{-corr:+d}" if corr else "UTC"
+
+
+# Haversine formula to compute distance between two lat/lon points
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Vectorized haversine (km); arguments broadcast against each other."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def to_xyz(lat, lon):
+    phi, lam = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)], axis=-1)
+
+
+STATIONS_SCHEMA = '''CREATE TABLE IF NOT EXISTS stations (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    state TEXT,
+    lat REAL,
+    lon REAL,
+    type TEXT,
+    reference_id TEXT,
+    timezone TEXT
+)'''
+
+
+def catalog_timezone(station_id, path=STATIONS_PATH):
+    """IANA zone of a station in the bundled catalog, or None if it isn't listed."""
+    with open(path) as f:
+        catalog = json.load(f)["stations"]
+    for s in catalog:
+        if str(s["id"]) == str(station_id):
+            return timezone_for(s.get("timezonecorr"))
+    return None
+
+
+def catalog_row(s):
+    """A ``stations`` row from a NOAA metadata API station record."""
+    return (
+        str(s["id"]), s.get("name"), s.get("state"), s["lat"], s["lng"],
+        s.get("type"), s.get("reference_id"), timezone_for(s.get("timezonecorr")),
+    )
+
+
+def bulk_load(conn, rows, batch_size=50000, progress=None):
+    """Upsert ``stations`` rows (see ``catalog_row``) in large transactions."""
+    c = conn.cursor()
+    c.execute(STATIONS_SCHEMA)
+    total = 0
+    batch = []
+
+    def flush():
+        c.executemany('''INSERT INTO stations (id, name, state, lat, lon, type, reference_id, timezone)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                name = excluded.name, state = excluded.state, lat = excluded.lat, lon = excluded.lon,
+                type = excluded.type, reference_id = excluded.reference_id, timezone = excluded.timezone''', batch)
+        conn.commit()
+        batch.clear()
+        if progress:
+            progress(total)
+
+    for row in rows:
+        if row[3] is None or row[4] is None:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            total += len(batch)
+            flush()
+    if batch:
+        total += len(batch)
+        flush()
+    return total
+
+
+def load_catalog(db_path, path=STATIONS_PATH):
+    """Create the ``stations`` table and fill it from the bundled catalog if empty."""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute(STATIONS_SCHEMA)
+    if c.execute("SELECT COUNT(*) FROM stations").fetchone()[0] == 0 and os.path.exists(path):
+        with open(path) as f:
+            catalog = json.load(f)["stations"]
+        bulk_load(conn, (catalog_row(s) for s in catalog))
+    conn.commit()
+    conn.close()
+
+
+class StationIndex:
+    """k-nearest station lookup backed by a KD-tree on unit-sphere coordinates."""
+
+    def __init__(self, stations):
+        self.stations = stations
+        self.by_id = {s["id"]: s for s in stations}
+        self.lat = np.array([s["lat"] for s in stations], dtype=float)
+        self.lon = np.array([s["lon"] for s in stations], dtype=float)
+        self.xyz = to_xyz(self.lat, self.lon).reshape(-1, 3)
+        self._xyz_t = np.ascontiguousarray(self.xyz.T)
+        self._ids = np.array([s["id"] for s in stations], dtype=object)
+        self._order = np.arange(len(stations))
+        self._nodes = []
+        self._by_types = {}
+        if stations:
+            self._build(0, len(stations))
+
+    @classmethod
+    def from_db(cls, db_path):
+        conn = sqlite3.connect(db_path)
+        c = conn.cursor()
+        c.execute("SELECT id, name, state, lat, lon, type, timezone FROM stations ORDER BY id")
+        cols = [col[0] for col in c.description]
+        stations = [dict(zip(cols, row)) for row in c.fetchall()]
+        conn.close()
+        return cls(stations)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def get(self, station_id):
+        return self.by_id.get(station_id)
+
+    def _build(self, start, end):
+        node = len(self._nodes)
+        self._nodes.append(None)
+        if end - start <= LEAF_SIZE:
+            self._nodes[node] = (start, end, -1, 0.0, -1, -1)
+            return node
+        members = self._order[start:end]
+        pts = self.xyz[members]
+        axis = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        mid = (start + end) // 2
+        self._order[start:end] = members[np.argpartition(pts[:, axis], mid - start)]
+        split = self.xyz[self._order[mid], axis]
+        left = self._build(start, mid)
+        right = self._build(mid, end)
+        self._nodes[node] = (start, end, axis, split, left, right)
+        return node
+
+    def _search(self, node, q, k, heap):
+        start, end, axis, split, left, right = self._nodes[node]
+        if axis < 0:
+            members = self._order[start:end]
+            d2 = ((self.xyz[members] - q) ** 2).sum(axis=1)
+            for i, d in zip(members, d2):
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d, i))
+                elif d < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d, i))
+            return
+        diff = q[axis] - split
+        near, far = (left, right) if diff < 0 else (right, left)
+        self._search(near, q, k, heap)
+        if len(heap) < k or diff * diff < -heap[0][0]:
+            self._search(far, q, k, heap)
+
+    def of_types(self, types):
+        """Index over the stations whose ``type`` is in ``types`` (built once per set)."""
+        key = frozenset(types)
+        index = self._by_types.get(key)
+        if index is None:
+            index = self._by_types[key] = StationIndex([s for s in self.stations if s.get("type") in key])
+        return index
+
+    def nearest(self, lat, lon, k=1, types=None):
+        """The k nearest stations as dicts with an added ``distance_km``.
+
+        ``types`` limits the search to those station types, e.g. ``{"R"}`` for
+        reference stations (subordinate ``S`` stations only have hilo predictions).
+        """
+        if types is not None:
+            return self.of_types(types).nearest(lat, lon, k)
+        if not self.stations:
+            return []
+        heap = []
+        self._search(0, to_xyz(lat, lon), min(k, len(self.stations)), heap)
+        results = []
+        for neg_d2, i in sorted(heap, reverse=True):
+            chord = math.sqrt(-neg_d2)
+            distance = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+            results.append(dict(self.stations[i], distance_km=round(distance, 3)))
+        return results
+
+    def nearest_ids(self, lats, lons, chunk=256):
+        """Nearest station id for each point; the largest dot product on the
+        unit sphere is the smallest great-circle distance, so this is a matmul.
+        Small chunks keep each (chunk x stations) block in cache."""
+        q = to_xyz(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)).reshape(-1, 3)
+        if not self.stations:
+            return [None] * len(q)
+        if not len(q):
+            return []
+        best = np.concatenate([(q[s:s + chunk] @ self._xyz_t).argmax(axis=1) for s in range(0, len(q), chunk)])
+        return list(self._ids[best])
+
+    def nearest_batch(self, lats, lons, k=1, chunk=512):
+        """k nearest stations for many points using a vectorized haversine."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        k = min(k, len(self.stations))
+        if k <= 0:
+            return [[] for _ in lats]
+        results = []
+        for s in range(0, len(lats), chunk):
+            d = haversine_np(lats[s:s + chunk, None], lons[s:s + chunk, None], self.lat[None, :], self.lon[None, :])
+            best = np.argpartition(d, k - 1, axis=1)[:, :k] if k < d.shape[1] else np.tile(np.arange(d.shape[1]), (len(d), 1))
+            rows = np.arange(len(d))[:, None]
+            best = best[rows, np.argsort(d[rows, best], axis=1)]
+            for r in range(len(d)):
+                results.append([dict(self.stations[i], distance_km=round(float(d[r, i]), 3)) for i in best[r]])
+        return results
@@ -0,0 +1,96 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import json
+
+import httpx
+import pytest
+
+from bench import load
+from bench.__main__ import compare
+from bench.fake_upstream import FakeUpstream
+from tides import NOAA_API
+
+
+async def get(fake, **params):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=fake)) as client:
+        return await client.get(NOAA_API, params=params)
+
+
+@pytest.mark.asyncio
+async def test_fake_upstream_synthesizes_hilo_for_range():
+    fake = FakeUpstream()
+    resp = await get(fake, station="8467150", begin_date="20250427", end_date="20250428", interval="hilo")
+    predictions = resp.json()["predictions"]
+    assert resp.status_code == 200
+    assert {p["t"][:10] for p in predictions} == {"2025-04-27", "2025-04-28"}
+    assert 7 <= len(predictions) <= 9
+    types = [p["type"] for p in predictions]
+    assert all(a != b for a, b in zip(types, types[1:]))
+    hourly = (await get(fake, station="8467150", begin_date="20250427", end_date="20250427", interval="h")).json()
+    assert len(hourly["predictions"]) == 24
+
+
+@pytest.mark.asyncio
+async def test_fake_upstream_errors_and_recorded_payloads(tmp_path):
+    recorded = {"predictions": [
+        {"t": "2025-04-27 03:12", "v": "6.512", "type": "H"},
+        {"t": "2025-04-28 09:30", "v": "-0.210", "type": "L"},
+    ]}
+    (tmp_path / "8467150.json").write_text(json.dumps(recorded))
+    fake = FakeUpstream(payloads_dir=str(tmp_path))
+    resp = await get(fake, station="8467150", begin_date="20250428", end_date="20250428", interval="hilo")
+    assert resp.json()["predictions"] == recorded["predictions"][1:]
+    # Outside the recorded range falls back to synthetic data
+    resp = await get(fake, station="8467150", begin_date="20250501", end_date="20250501", interval="hilo")
+    assert resp.json()["predictions"][0]["t"].startswith("2025-05-01")
+    assert fake.stats()["recorded_hits"] == 1
+
+    failing = FakeUpstream(error_rate=1.0)
+    resp = await get(failing, station="8467150", begin_date="20250428", end_date="20250428", interval="hilo")
+    assert resp.status_code == 503 and failing.stats()["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fake_upstream_replays_shipped_payload_in_its_format():
+    fake = FakeUpstream()
+    assert fake.recorded_days()["9447130"] == ("2015-01-01", "2015-01-01")
+    resp = await get(fake, station="9447130", begin_date="20150101", end_date="20150101",
+                     interval="hilo", time_zone="lst_ldt", units="english")
+    assert resp.json()["predictions"][0] == {"t": "2015-01-01 03:06", "v": "10.141", "type": "H"}
+    # A recording in local time and feet cannot answer a GMT/metric query
+    resp = await get(fake, station="9447130", begin_date="20150101", end_date="20150101",
+                     interval="hilo", time_zone="gmt", units="metric")
+    assert resp.json()["predictions"][0]["t"] != "2015-01-01 03:06"
+    assert fake.stats()["recorded_hits"] == 1
+
+
+def test_percentiles():
+    values = list(range(1, 101))
+    assert load.percentile(values, 50) == 50
+    assert load.percentile(values, 99) == 99
+    assert load.percentile([7], 95) == 7
+    summary = load.summarize([0.001, 0.002, 0.003], errors=1, elapsed=2.0)
+    assert summary["requests"] == 4 and summary["rps"] == 2.0 and summary["p50_ms"] == 2.0
+
+
+@pytest.mark.asyncio
+async def test_load_run_smoke():
+    results = await load.run(concurrency=4, requests=20, latency_ms=0, jitter_ms=0, stations=3, table_size=200)
+    assert set(results) == set(load.ENDPOINTS)
+    for result in results.values():
+        assert result["requests"] == 20 and result["errors"] == 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert results["/tide/week"]["upstream"]["requests"] <= 3
+    for endpoint in ("/tide/today", "/tide/week"):
+        cold = results[endpoint]["cold"]
+        assert 1 <= cold["requests"] < 20 and cold["p50_ms"] <= cold["p99_ms"] <= cold["max_ms"]
+        assert results[endpoint]["warm_p99_ms"] >= 0
+    assert results["/tide/today"]["upstream"]["recorded_hits"] > 0
+
+
+def test_compare_flags_regressions(capsys):
+    old = {"load": {"/tide/week": {"p95_ms": 10.0, "rps": 100.0, "errors": 0}}}
+    new = {"load": {"/tide/week": {"p95_ms": 11.0, "rps": 50.0, "errors": 3}}}
+    assert compare(old, new, threshold=0.2) == ["load./tide/week.rps"]
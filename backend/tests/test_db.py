@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import threading
+
+import httpx
+import pytest
+from httpx import AsyncClient, ASGITransport
+import main
+from main import app
+import upstream
+from db import Database, UsageBuffer
+from search import init_search
+from tide_cache import PredictionCache
+
+SCHEMA = '''CREATE TABLE locations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    town TEXT, state TEXT, zip TEXT, lat REAL, lon REAL, stationId TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_used TEXT DEFAULT CURRENT_TIMESTAMP
+)'''
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "locations.db"))
+    db.conn().execute(SCHEMA)
+    init_search(db.conn())
+    yield db
+    db.close_all()
+
+
+def test_connections_are_per_thread_and_wal(db):
+    assert db.conn() is db.conn()
+    assert db.conn().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = []
+    t = threading.Thread(target=lambda: other.append(db.conn()))
+    t.start()
+    t.join()
+    assert other[0] is not db.conn()
+
+
+def test_usage_buffer_batches_writes(db):
+    buffer = UsageBuffer(db)
+    buffer.touch("Salem", "MA", "01970", 42.5195, -70.8967, "8442645")
+    buffer.touch("Salem", "MA", "01970", 42.5195, -70.8967, "8442645")
+    buffer.touch("Newport", "RI", "02840", 41.4901, -71.3128, "8452660")
+    assert buffer.pending() == 2
+    assert db.conn().execute("SELECT COUNT(*) FROM locations").fetchone()[0] == 0
+    assert buffer.flush() == 2
+    assert buffer.pending() == 0
+    db.conn().execute("UPDATE locations SET last_used = '2000-01-01 00:00:00'")
+    db.conn().commit()
+    buffer.touch("Salem", "MA", "01970", 42.5195, -70.8967, "8442645")
+    buffer.flush()
+    rows = dict(db.conn().execute("SELECT town, last_used FROM locations").fetchall())
+    assert rows["Salem"] > "2000-01-01 00:00:00"
+    assert rows["Newport"] == "2000-01-01 00:00:00"
+    assert db.conn().execute("SELECT COUNT(*) FROM locations").fetchone()[0] == 2
+
+
+@pytest.mark.asyncio
+async def test_tide_request_defers_location_write(tmp_path, monkeypatch):
+    buffer = UsageBuffer(main.db)
+    monkeypatch.setattr(main, "location_usage", buffer)
+    monkeypatch.setattr(main, "hilo_cache", PredictionCache(str(tmp_path / "cache.db")))
+    await upstream.start(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"predictions": []})))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/tide/today", params={"lat": 42.52, "lon": -70.89, "town": "Salem", "state": "MA", "zip": "01970"})
+        assert resp.status_code == 200
+        assert buffer.pending() == 1
+    finally:
+        await upstream.close()
@@ -0,0 +1,140 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import io
+import json
+import sqlite3
+
+import pytest
+import import_data
+from import_data import import_locations, import_stations, location_row, read_ahead, read_json_array, records, station_row
+from search import search_locations
+
+TOWNS = [
+    {"town": "Cohasset", "state": "MA", "zip": "02025", "lat": 42.2418, "lon": -70.8037, "stationId": "8443970"},
+    {"town": "Bridgeport", "state": "CT", "zip": "06604", "lat": 41.1792, "lon": -73.1894, "stationId": "8467150"},
+    {"town": "Bar Harbor", "state": "ME", "zip": "04609", "lat": 44.3876, "lon": -68.2039},
+]
+
+
+def load(db_path, path, **kwargs):
+    return import_locations(str(db_path), (location_row(r) for r in records(str(path), **kwargs)))
+
+
+def rows(db_path):
+    conn = sqlite3.connect(str(db_path))
+    found = {r[0]: r[1:] for r in conn.execute("SELECT town, state, zip, stationId FROM locations")}
+    conn.close()
+    return found
+
+
+def test_json_array_streams_across_chunks(monkeypatch):
+    monkeypatch.setattr(import_data, "CHUNK_SIZE", 7)
+    text = json.dumps({"count": 3, "stations": [{"id": "1", "name": "a, [b]"}, {"id": "2"}, {"id": "3"}]})
+    assert [r["id"] for r in read_json_array(io.StringIO(text), key="stations")] == ["1", "2", "3"]
+    assert list(read_json_array(io.StringIO(" [ ] "))) == []
+    with pytest.raises(ValueError):
+        list(read_json_array(io.StringIO('{"a": 1}')))
+    # Only a top-level member named "stations" counts, not the same text in strings or nested objects
+    text = json.dumps({"note": 'the "stations" list', "meta": {"stations": [0]}, "tags": ["stations"],
+                       "stations": [{"id": "1"}]})
+    assert [r["id"] for r in read_json_array(io.StringIO(text), key="stations")] == ["1"]
+    with pytest.raises(ValueError):
+        list(read_json_array(io.StringIO('{"meta": {"stations": [0]}}'), key="stations"))
+
+
+@pytest.mark.parametrize("suffix", ["json", "ndjson", "csv"])
+def test_import_formats(tmp_path, suffix):
+    path = tmp_path / f"towns.{suffix}"
+    if suffix == "json":
+        path.write_text(json.dumps(TOWNS))
+    elif suffix == "ndjson":
+        path.write_text("\n".join(json.dumps(t) for t in TOWNS) + "\n")
+    else:
+        lines = ["town,state,zip,lat,lon,stationId"]
+        lines += [f'"{t["town"]}",{t["state"]},{t["zip"]},{t["lat"]},{t["lon"]},{t.get("stationId", "")}' for t in TOWNS]
+        path.write_text("\n".join(lines) + "\n")
+    db_path = tmp_path / "locations.db"
+    assert load(db_path, path) == 3
+    found = rows(db_path)
+    assert found["Cohasset"] == ("MA", "02025", "8443970")
+    # Missing stationId gets the nearest station from the catalog
+    assert found["Bar Harbor"][2] is not None
+
+
+def test_reimport_is_idempotent(tmp_path):
+    path = tmp_path / "towns.json"
+    path.write_text(json.dumps(TOWNS))
+    db_path = tmp_path / "locations.db"
+    load(db_path, path)
+    first = rows(db_path)
+    moved = [dict(TOWNS[0], stationId="8444525")]
+    path.write_text(json.dumps(TOWNS + moved))
+    load(db_path, path)
+    second = rows(db_path)
+    assert len(second) == len(first) == 3
+    assert second["Cohasset"][2] == "8444525"
+    # FTS index and triggers are back after the load
+    conn = sqlite3.connect(str(db_path))
+    assert [r["town"] for r in search_locations(conn, "coha")] == ["Cohasset"]
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='trigger'").fetchone()[0] == 3
+    conn.close()
+
+
+def test_numeric_zip_and_missing_coordinates(tmp_path):
+    path = tmp_path / "towns.json"
+    path.write_text(json.dumps([dict(TOWNS[0], zip=2025)]))
+    db_path = tmp_path / "locations.db"
+    load(db_path, path)
+    assert rows(db_path)["Cohasset"][1] == "02025"
+    # A later import without coordinates keeps the ones already stored
+    path.write_text(json.dumps([{"town": "Cohasset", "state": "MA", "zip": "02025"}]))
+    load(db_path, path)
+    conn = sqlite3.connect(str(db_path))
+    assert conn.execute("SELECT lat, lon FROM locations WHERE town = 'Cohasset'").fetchone() == (42.2418, -70.8037)
+    conn.close()
+
+
+def test_gazetteer(tmp_path):
+    path = tmp_path / "gaz.txt"
+    path.write_text(
+        "USPS\tGEOID\tNAME\tINTPTLAT\tINTPTLONG   \n"
+        "CT\t0908000\tBridgeport city\t41.187\t-73.196\n"
+        "MA\t2513625\tCohasset CDP\t42.242\t-70.804\n"
+    )
+    db_path = tmp_path / "locations.db"
+    assert load(db_path, path, fmt="census") == 2
+    assert set(rows(db_path)) == {"Bridgeport", "Cohasset"}
+
+
+def test_import_stations(tmp_path):
+    db_path = str(tmp_path / "stations.db")
+    recs = [
+        {"id": "1", "name": "One", "state": "MA", "lat": "42.1", "lng": "-70.1", "timezonecorr": -5},
+        {"id": 2, "name": "Two", "lat": 21.3, "lon": -157.9, "timezonecorr": -10},
+        {"id": "3", "name": "No position"},
+    ]
+    assert import_stations(db_path, map(station_row, recs)) == 2
+    assert import_stations(db_path, map(station_row, recs[:1])) == 1
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT id, lat, timezone FROM stations ORDER BY id").fetchall() == [
+        ("1", 42.1, "America/New_York"),
+        ("2", 21.3, "Pacific/Honolulu"),
+    ]
+    conn.close()
+
+
+def test_read_ahead_preserves_order_and_errors():
+    assert list(read_ahead(iter(range(25)), batch_size=4, depth=2)) == list(range(25))
+
+    def broken():
+        yield 1
+        raise ValueError("bad record")
+
+    with pytest.raises(ValueError):
+        list(read_ahead(broken()))
+    # Abandoning the iterator early doesn't leave the reader thread blocked
+    it = read_ahead(iter(range(100000)), batch_size=10, depth=1)
+    assert next(it) == 0
+    it.close()
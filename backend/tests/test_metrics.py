@@ -0,0 +1,150 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import time
+
+import httpx
+import pytest
+from httpx import AsyncClient, ASGITransport
+import main
+import metrics
+import upstream
+from main import app
+from tide_cache import PredictionCache
+from tides import NOAA_API
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "hilo_cache", PredictionCache(str(tmp_path / "cache.db")))
+
+
+def noaa(status=200):
+    def handler(request):
+        if status != 200:
+            return httpx.Response(status)
+        d = request.url.params["begin_date"]
+        d = f"{d[:4]}-{d[4:6]}-{d[6:]}"
+        return httpx.Response(200, json={"predictions": [
+            {"t": f"{d} 03:12", "v": "6.512", "type": "H"},
+            {"t": f"{d} 09:30", "v": "-0.210", "type": "L"},
+        ]})
+    return httpx.MockTransport(handler)
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_registry_renders_prometheus_text():
+    registry = metrics.Registry()
+    counter = registry.counter("demo_total", "Demo counter", ["path"])
+    hist = registry.histogram("demo_seconds", "Demo latency", buckets=(0.1, 1.0))
+    counter.inc('/a"b')
+    counter.inc('/a"b', amount=2)
+    hist.observe(0.05)
+    hist.observe(0.5)
+    hist.observe(3.0)
+    registry.collector(lambda: [("demo_ratio", "gauge", "Demo gauge", [({"cache": "x"}, 0.5)])])
+    text = registry.render()
+    assert '# TYPE demo_total counter' in text
+    assert 'demo_total{path="/a\\"b"} 3' in text
+    assert 'demo_seconds_bucket{le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{le="+Inf"} 3' in text
+    assert 'demo_seconds_count 3' in text
+    assert 'demo_ratio{cache="x"} 0.5' in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_after_requests():
+    await upstream.start(transport=noaa())
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            before = sample((await ac.get("/metrics")).text,
+                            'tide_http_requests_total{method="GET",route="/tide/today",status="200"}') or 0
+            for _ in range(2):
+                resp = await ac.get("/tide/today", params={"station": "8467150", "date": "2025-04-27"})
+                assert resp.status_code == 200
+            timing = resp.headers["server-timing"]
+            text = (await ac.get("/metrics")).text
+    finally:
+        await upstream.close()
+    assert "serialization;dur=" in timing and "moon;dur=" in timing
+    assert resp.json()["highs"][0]["t"] == "2025-04-27 03:12"
+    assert sample(text, 'tide_http_requests_total{method="GET",route="/tide/today",status="200"}') == before + 2
+    host = httpx.URL(NOAA_API).host
+    assert sample(text, f'tide_upstream_requests_total{{host="{host}",status="200"}}') >= 1
+    assert sample(text, 'tide_stage_duration_seconds_count{stage="moon"}') >= 2
+    assert sample(text, 'tide_cache_hit_ratio{cache="hilo"}') == 0.5
+    assert sample(text, 'tide_cache_lookups_total{cache="hilo",result="miss"}') == 1
+
+
+@pytest.mark.asyncio
+async def test_upstream_errors_counted(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF", 0)
+    monkeypatch.setattr(upstream, "UPSTREAM_RETRIES", 1)
+    host = httpx.URL(NOAA_API).host
+    before = metrics.UPSTREAM_ERRORS.value(host, "http")
+    await upstream.start(transport=noaa(status=503))
+    try:
+        with pytest.raises(httpx.HTTPStatusError):
+            await upstream.get_json(NOAA_API, params={"begin_date": "20250427"})
+    finally:
+        await upstream.close()
+    assert metrics.UPSTREAM_ERRORS.value(host, "http") - before == 2
+    assert metrics.UPSTREAM_REQUESTS.value(host, "503") >= 2
+
+
+@pytest.mark.asyncio
+async def test_profile_written_for_matching_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path / "profiles"))
+
+    @app.get("/_slow_for_profile")
+    async def slow():
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+        return {"ok": True}
+
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            await ac.get("/_slow_for_profile", headers={"X-Profile": "wrong"})
+            assert not (tmp_path / "profiles").exists()
+            resp = await ac.get("/_slow_for_profile", headers={"X-Profile": "secret"})
+    finally:
+        app.router.routes[:] = [r for r in app.router.routes if getattr(r, "path", None) != "/_slow_for_profile"]
+    assert resp.status_code == 200
+    [profile] = list((tmp_path / "profiles").iterdir())
+    assert profile.suffix == ".folded"
+    lines = profile.read_text().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("slow (test_metrics.py" in line for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_profile_samples_sync_endpoint_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path / "profiles"))
+
+    # Sync endpoints run in the threadpool, not on the event loop thread
+    @app.get("/_sync_for_profile")
+    def busy_sync(n: int = 1):
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+        return {"n": n}
+
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            resp = await ac.get("/_sync_for_profile", params={"n": 3}, headers={"X-Profile": "secret"})
+    finally:
+        app.router.routes[:] = [r for r in app.router.routes if getattr(r, "path", None) != "/_sync_for_profile"]
+    assert resp.status_code == 200 and resp.json() == {"n": 3}
+    [profile] = list((tmp_path / "profiles").iterdir())
+    assert any("busy_sync (test_metrics.py" in line for line in profile.read_text().splitlines())
@@ -0,0 +1,44 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import datetime
+
+from moon import moon_data, moon_days
+
+NEW_YORK = (40.7128, -74.0060)
+
+
+def test_principal_phases_april_2024():
+    start = datetime.date(2024, 4, 1)
+    days = moon_days([start + datetime.timedelta(days=i) for i in range(30)], tz="America/New_York")
+    phases = {d["date"]: d["phase"] for d in days}
+    assert phases["2024-04-01"] == "Last Quarter"
+    assert phases["2024-04-08"] == "New Moon"  # total solar eclipse
+    assert phases["2024-04-15"] == "First Quarter"
+    assert phases["2024-04-23"] == "Full Moon"
+    assert [p for p in phases.values() if p in ("New Moon", "Full Moon")] == ["New Moon", "Full Moon"]
+
+
+def test_illumination_and_age():
+    day = moon_days([datetime.date(2024, 4, 23)], tz="America/New_York")[0]
+    assert day["illumination"] > 0.99
+    assert 14 < day["age"] < 15.5
+    day = moon_days([datetime.date(2024, 4, 8)], tz="America/New_York")[0]
+    assert day["illumination"] < 0.01
+
+
+def test_moonrise_moonset_new_york():
+    day = moon_days([datetime.date(2024, 4, 23)], *NEW_YORK, tz="America/New_York")[0]
+    # Full moon rises around sunset and sets around sunrise
+    assert "19:30" < day["moonrise"] < "20:00"
+    assert "05:30" < day["moonset"] < "06:05"
+
+
+def test_year_is_one_batch():
+    dates = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(366)]
+    data = moon_data(dates, *NEW_YORK, tz="America/New_York")
+    assert data["phase"].shape == (366,)
+    assert data["moonrise"].shape == (366,)
+    # About 12-13 full moons in a year, each named on exactly one day
+    assert 12 <= (data["phase"] == "Full Moon").sum() <= 13
@@ -0,0 +1,170 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import datetime
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import main
+import solunar
+import upstream
+from db import database
+from import_data import LOCATIONS_SCHEMA
+from prefetch import Prefetcher, popular_stations, seconds_until_midnight
+from tide_cache import PredictionCache
+from tests.test_tide_cache import make_fetch
+
+TODAY = datetime.date(2025, 4, 27)
+
+
+def locations_db(path, rows):
+    """``rows``: (town, stationId, days since last use)."""
+    conn = sqlite3.connect(path)
+    conn.execute(LOCATIONS_SCHEMA)
+    for town, station, age in rows:
+        info = main.station_index.get(station)
+        conn.execute(
+            "INSERT INTO locations (town, state, lat, lon, stationId, last_used) VALUES (?, 'MA', ?, ?, ?, datetime('now', ?))",
+            (town, info["lat"], info["lon"], station, f"-{age} days"),
+        )
+    conn.commit()
+    conn.close()
+    return database(path)
+
+
+@pytest.fixture
+def stations():
+    return [s["id"] for s in main.station_index.stations[:4]]
+
+
+def test_popular_stations_ranked_by_recent_use(tmp_path, stations):
+    a, b, c, d = stations
+    db = locations_db(str(tmp_path / "loc.db"), [
+        ("A1", a, 0), ("A2", a, 1),
+        ("B1", b, 0), ("B2", b, 0), ("B3", b, 2),
+        ("C1", c, 20),
+        ("D1", d, 90),  # outside the ranking window
+    ])
+    assert popular_stations(db.conn(), 10, recent_days=30) == [b, a, c]
+    assert popular_stations(db.conn(), 1, recent_days=30) == [b]
+    db.close_all()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_budget_and_window_roll(tmp_path, stations):
+    db = locations_db(str(tmp_path / "loc.db"), [
+        (f"Town {i}", station, i) for i, station in enumerate(stations[:3])
+    ])
+    calls = []
+    hilo = PredictionCache(str(tmp_path / "cache.db"), fetch=make_fetch(calls))
+    forecasts = solunar.ForecastCache(str(tmp_path / "cache.db"))
+
+    async def get_hilo(station, begin, end):
+        return await hilo.get_hilo(station, begin, end), "noaa"
+
+    prefetcher = Prefetcher(db, hilo, forecasts, main.station_index, get_hilo, stations=10, days=3,
+                            budget=2, spacing=0)
+    assert await prefetcher.run(TODAY) == (2, 2)
+    end = TODAY + datetime.timedelta(days=2)
+    assert calls == [(stations[0], TODAY, end), (stations[1], TODAY, end)]
+    info = main.station_index.get(stations[0])
+    key = forecasts.key(stations[0], info["lat"], info["lon"])
+    assert forecasts.missing(key, [(TODAY + datetime.timedelta(days=i)).isoformat() for i in range(3)]) == []
+    assert hilo.stats()["hits"] == 6  # forecasts read the tides just fetched
+
+    # Budget is spent for the day; a second pass only checks the caches
+    assert await prefetcher.run(TODAY) == (0, 0)
+    assert len(calls) == 2 and prefetcher.stats()["spent"] == 2
+
+    # Next day: budget resets and warm stations need just the new last day
+    tomorrow = TODAY + datetime.timedelta(days=1)
+    await prefetcher.run(tomorrow)
+    new_end = tomorrow + datetime.timedelta(days=2)
+    assert calls[2:] == [(stations[0], new_end, new_end), (stations[1], new_end, new_end)]
+    assert prefetcher.stats()["spent"] == 2
+    db.close_all()
+
+
+@pytest.mark.asyncio
+async def test_database_read_on_worker_threads(tmp_path, stations):
+    db = locations_db(str(tmp_path / "loc.db"), [("A", stations[0], 0)])
+    threads = []
+    conn = db.conn
+
+    def record():
+        threads.append(threading.get_ident())
+        return conn()
+
+    db.conn = record
+    hilo = PredictionCache(str(tmp_path / "cache.db"), fetch=make_fetch([]))
+    forecasts = solunar.ForecastCache(str(tmp_path / "cache.db"))
+
+    async def get_hilo(station, begin, end):
+        return await hilo.get_hilo(station, begin, end), "noaa"
+
+    prefetcher = Prefetcher(db, hilo, forecasts, main.station_index, get_hilo, days=2, spacing=0)
+    await prefetcher.run(TODAY)
+    assert len(threads) == 2 and threading.get_ident() not in threads
+    db.close_all()
+
+
+@pytest.mark.asyncio
+async def test_offline_stations_skip_upstream(tmp_path, stations):
+    db = locations_db(str(tmp_path / "loc.db"), [("A", stations[0], 0)])
+    calls = []
+    hilo = PredictionCache(str(tmp_path / "cache.db"), fetch=make_fetch(calls))
+    forecasts = solunar.ForecastCache(str(tmp_path / "cache.db"))
+
+    async def get_hilo(station, begin, end):
+        return await make_fetch([])(station, begin, end), "harmonic"
+
+    prefetcher = Prefetcher(db, hilo, forecasts, main.station_index, get_hilo, days=2, offline=lambda s: True)
+    assert await prefetcher.run(TODAY) == (0, 1)
+    assert calls == []
+    db.close_all()
+
+
+@pytest.mark.asyncio
+async def test_schedule_survives_failed_passes(caplog):
+    prefetcher = Prefetcher(None, None, None, main.station_index, None, interval=0.01)
+    passes = []
+
+    async def run():
+        passes.append(len(passes))
+        if len(passes) < 3:
+            raise KeyError("boom")
+
+    prefetcher.run = run
+    prefetcher.start(delay=0)
+    for _ in range(200):
+        if len(passes) >= 4:
+            break
+        await asyncio.sleep(0.01)
+    await prefetcher.stop()
+    assert len(passes) >= 4 and prefetcher._task is None
+    assert "prefetch pass failed" in caplog.text and "KeyError" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_calls():
+    limiter = upstream.RateLimiter(rate=50, burst=1)
+    start = time.perf_counter()
+    for _ in range(5):
+        await limiter.acquire()
+    # First call uses the burst token, the other four wait ~20 ms each
+    assert time.perf_counter() - start >= 0.07
+    unlimited = upstream.RateLimiter(rate=0)
+    start = time.perf_counter()
+    for _ in range(1000):
+        await unlimited.acquire()
+    assert time.perf_counter() - start < 0.05
+
+
+def test_seconds_until_midnight():
+    assert seconds_until_midnight(datetime.datetime(2025, 4, 27, 23, 59, 30)) == 30
+    assert seconds_until_midnight(datetime.datetime(2025, 4, 27, 0, 0)) == 86400
@@ -0,0 +1,156 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import sqlite3
+
+import pytest
+import search
+from search import bulk_load, fts_query, init_search, search_locations
+
+SCHEMA = '''CREATE TABLE locations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    town TEXT, state TEXT, zip TEXT, lat REAL, lon REAL, stationId TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_used TEXT DEFAULT CURRENT_TIMESTAMP
+)'''
+
+TOWNS = [
+    ("Boston", "MA", "02108", 42.3601, -71.0589, "8443970"),
+    ("Bourne", "MA", "02532", 41.7412, -70.5989, "8447180"),
+    ("Bridgeport", "CT", "06604", 41.1792, -73.1894, "8467150"),
+    ("Cohasset", "MA", "02025", 42.2418, -70.8037, "8443970"),
+    ("East Boston", "MA", "02128", 42.3702, -71.0389, "8443970"),
+]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "search.db"))
+    conn.execute(SCHEMA)
+    init_search(conn)
+    bulk_load(conn, TOWNS)
+    yield conn
+    conn.close()
+
+
+def towns(rows):
+    return [r["town"] for r in rows]
+
+
+def test_fts_query_escapes_input():
+    assert fts_query('bos" OR *') == '"bos"* "or"*'
+    assert fts_query("  ,, ") is None
+
+
+def test_prefix_autocomplete(conn):
+    assert set(towns(search_locations(conn, "bo"))) == {"Boston", "Bourne", "East Boston"}
+    assert set(towns(search_locations(conn, "Boston, ma"))) == {"Boston", "East Boston"}
+    assert towns(search_locations(conn, "bridgeport ct")) == ["Bridgeport"]
+    assert search_locations(conn, "nowhere") == []
+
+
+def test_recency_breaks_ties(conn):
+    conn.execute("UPDATE locations SET last_used = datetime('now', '-300 days') WHERE town = 'Boston'")
+    conn.commit()
+    assert towns(search_locations(conn, "boston"))[0] == "East Boston"
+    conn.execute("UPDATE locations SET last_used = CURRENT_TIMESTAMP WHERE town = 'Boston'")
+    conn.execute("UPDATE locations SET last_used = datetime('now', '-300 days') WHERE town = 'East Boston'")
+    conn.commit()
+    assert towns(search_locations(conn, "boston"))[0] == "Boston"
+
+
+def test_zip_lookup_uses_index(conn):
+    assert towns(search_locations(conn, "02025")) == ["Cohasset"]
+    assert set(towns(search_locations(conn, "021"))) == {"Boston", "East Boston"}
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM locations INDEXED BY locations_zip WHERE zip >= '02025' AND zip < '02026'").fetchall()
+    assert "locations_zip" in str(plan)
+
+
+def test_dense_prefix_walks_recent(conn, monkeypatch):
+    monkeypatch.setattr(search, "DENSE_PREFIX", 1)
+    conn.execute("UPDATE locations SET last_used = datetime('now', '-10 days')")
+    conn.execute("UPDATE locations SET last_used = CURRENT_TIMESTAMP WHERE town = 'Bourne'")
+    conn.commit()
+    assert towns(search_locations(conn, "b", limit=1)) == ["Bourne"]
+    assert "East Boston" in towns(search_locations(conn, "b", limit=5))
+
+
+def test_index_follows_inserts_and_updates(conn):
+    conn.execute("INSERT INTO locations (town, state, zip) VALUES ('Gloucester', 'MA', '01930')")
+    conn.execute("UPDATE locations SET town = 'Bournedale' WHERE town = 'Bourne'")
+    conn.commit()
+    assert towns(search_locations(conn, "glou")) == ["Gloucester"]
+    assert towns(search_locations(conn, "bournedale")) == ["Bournedale"]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO locations (town, state) VALUES ('Boston', 'MA')")
+
+
+def test_bulk_load_is_idempotent_and_fills_station(conn):
+    class Index:
+        def nearest_ids(self, lats, lons):
+            return ["9999999"] * len(lats)
+
+    n = bulk_load(conn, TOWNS + [("Salem", "MA", "", 42.5195, -70.8967, None)], station_index=Index())
+    assert n == 6
+    assert conn.execute("SELECT COUNT(*) FROM locations").fetchone()[0] == 6
+    assert conn.execute("SELECT stationId FROM locations WHERE town='Salem'").fetchone()[0] == "9999999"
+    assert towns(search_locations(conn, "sal")) == ["Salem"]
+
+
+def test_duplicates_are_merged_before_unique_key(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "dupes.db"))
+    conn.execute(SCHEMA)
+    conn.execute("INSERT INTO locations (town, state, last_used) VALUES ('Salem', 'MA', '2024-01-01 00:00:00')")
+    conn.execute("INSERT INTO locations (town, state, last_used) VALUES ('Salem', 'MA', '2025-01-01 00:00:00')")
+    init_search(conn)
+    rows = conn.execute("SELECT id, last_used FROM locations").fetchall()
+    assert rows == [(1, "2025-01-01 00:00:00")]
+    conn.close()
+
+
+def test_dedupe_scales_to_large_tables(tmp_path):
+    import time
+
+    conn = sqlite3.connect(str(tmp_path / "many.db"))
+    conn.execute(SCHEMA)
+    rows = [(f"Town {i}", "MA", f"2024-01-{1 + j:02d} 00:00:00") for i in range(20000) for j in range(2)]
+    conn.executemany("INSERT INTO locations (town, state, last_used) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    start = time.perf_counter()
+    init_search(conn)
+    # The old correlated UPDATE took tens of seconds here
+    assert time.perf_counter() - start < 5
+    assert conn.execute("SELECT COUNT(*), MIN(last_used) FROM locations").fetchone() == (20000, "2024-01-02 00:00:00")
+    conn.close()
+
+
+def test_concurrent_init_builds_once(tmp_path):
+    import threading
+
+    path = str(tmp_path / "race.db")
+    setup = sqlite3.connect(path)
+    setup.execute(SCHEMA)
+    setup.executemany("INSERT INTO locations (town, state, zip) VALUES (?, ?, ?)", [t[:3] for t in TOWNS])
+    setup.commit()
+    setup.close()
+    errors = []
+
+    def worker():
+        conn = sqlite3.connect(path, timeout=10)
+        try:
+            init_search(conn)
+        except sqlite3.Error as exc:
+            errors.append(exc)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    conn = sqlite3.connect(path)
+    assert towns(search_locations(conn, "bos", 10)) == ["Boston", "East Boston"]
+    conn.close()
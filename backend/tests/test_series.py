@@ -0,0 +1,181 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import base64
+import json
+import threading
+
+import httpx
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+import main
+import series
+import upstream
+from bench.fake_upstream import FakeUpstream
+from harmonics import HarmonicEngine
+from main import app
+from tests.test_harmonics import STATION
+
+
+@pytest.fixture
+def noaa(monkeypatch):
+    monkeypatch.setattr(main, "TIDE_SOURCE", "noaa")
+    return FakeUpstream()
+
+
+async def get_range(fake, **params):
+    await upstream.start(transport=httpx.ASGITransport(app=fake))
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            headers = {"If-None-Match": params.pop("etag")} if "etag" in params else {}
+            return await ac.get("/tide/range", params=params, headers=headers)
+    finally:
+        await upstream.close()
+
+
+def test_lttb_keeps_shape():
+    t = np.arange(20000) * 360.0
+    v = 3 + 3 * np.cos(2 * np.pi * t / (12.42 * 3600))
+    idx = series.lttb(t, v, 300)
+    assert len(idx) == 300 and idx[0] == 0 and idx[-1] == len(t) - 1
+    assert np.all(np.diff(idx) > 0)
+    # Peaks and troughs survive: ~2 per bucket of ~67 points, each within a sample of the extreme
+    assert v[idx].max() > 5.99 and v[idx].min() < 0.01
+    np.testing.assert_array_equal(series.lttb(t[:10], v[:10], 50), np.arange(10))
+
+
+@pytest.mark.asyncio
+async def test_tide_range_ndjson_streams_a_season(noaa):
+    resp = await get_range(noaa, station="8467150", begin="2025-01-01", end="2025-03-31", interval="6")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = resp.text.splitlines()
+    meta = json.loads(lines[0])
+    assert meta["source"] == "noaa" and meta["interval"] == "6"
+    rows = [json.loads(line) for line in lines[1:]]
+    # 90 local days minus the hour lost to DST on March 9
+    assert meta["count"] == meta["total"] == len(rows) == 90 * 240 - 10
+    t = np.array([r["t"] for r in rows])
+    assert np.all(np.diff(t) == 360)
+    # NOAA serves at most 31 days of 6-minute data per request
+    assert noaa.stats()["requests"] == 3
+
+
+@pytest.mark.asyncio
+async def test_tide_range_columnar_downsampled_with_etag(noaa):
+    params = dict(station="8467150", begin="2025-04-01", end="2025-09-30", interval="h", points=500, format="columnar")
+    resp = await get_range(noaa, **params)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["count"] == 500 and data["total"] == 183 * 24
+    t = data["t0"] + np.frombuffer(base64.b64decode(data["t"]), dtype="<u4").astype(np.int64)
+    v = np.frombuffer(base64.b64decode(data["v"]), dtype="<f4")
+    assert len(t) == len(v) == 500 and np.all(np.diff(t) > 0)
+    assert 0 <= v.min() < 0.1 and 5.9 < v.max() <= 6.0
+    assert len(resp.content) < 8000
+    tag = resp.headers["etag"]
+    assert tag.startswith('"') and resp.headers["cache-control"] == f"public, max-age={main.TIDE_RANGE_MAX_AGE}"
+
+    again = await get_range(noaa, **params, etag=tag)
+    assert again.status_code == 304 and again.content == b"" and again.headers["etag"] == tag
+    # Lists, weak validators and "*" match too
+    for header in (f'"stale", W/{tag}', "*"):
+        assert (await get_range(noaa, **params, etag=header)).status_code == 304
+    assert (await get_range(noaa, **params, etag='"stale", W/"other"')).status_code == 200
+    other = await get_range(noaa, **{**params, "points": 400})
+    assert other.status_code == 200 and other.headers["etag"] != tag
+
+
+@pytest.mark.asyncio
+async def test_tide_range_downsamples_off_the_event_loop(noaa, monkeypatch):
+    threads = []
+    lttb = series.lttb
+
+    def record(*args):
+        threads.append(threading.get_ident())
+        return lttb(*args)
+
+    monkeypatch.setattr(series, "lttb", record)
+    resp = await get_range(noaa, station="8467150", begin="2025-06-01", end="2025-06-30", points=100)
+    assert resp.status_code == 200
+    assert threads and threads[0] != threading.get_ident()
+
+
+def test_etag_matches():
+    assert series.etag_matches('"a"', '"a"') and series.etag_matches('W/"a"', '"a"')
+    assert series.etag_matches(' "b" ,W/"a"', '"a"') and series.etag_matches(" * ", '"a"')
+    assert not series.etag_matches('"b", W/"c"', '"a"') and not series.etag_matches(None, '"a"')
+
+
+@pytest.mark.asyncio
+async def test_tide_range_uses_reference_stations(noaa):
+    # Charlestown (8443838) is a subordinate station: NOAA has only its highs and lows
+    charlestown = main.station_index.get("8443838")
+    assert charlestown["type"] == "S"
+    assert main.station_index.nearest(charlestown["lat"], charlestown["lon"])[0]["id"] == "8443838"
+    for params in (dict(lat=charlestown["lat"], lon=charlestown["lon"]), dict(station="8443838")):
+        resp = await get_range(noaa, begin="2025-06-01", **params)
+        assert resp.status_code == 200
+        meta = json.loads(resp.text.splitlines()[0])
+        assert meta["station"] == "8443970" and meta["estimated"] is True
+        assert meta["source_station"]["type"] == "R"
+
+
+def failing_chunk(fake, month):
+    """``fake`` with NOAA error payloads for requests that start in ``month`` (YYYYMM)."""
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and f"begin_date={month}".encode() in scope["query_string"]:
+            return await fake._send(send, 200, {"error": {"message": "No Predictions data was found."}})
+        return await fake(scope, receive, send)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_tide_range_rejects_partial_series(noaa, tmp_path, monkeypatch):
+    params = dict(station="8467150", begin="2025-01-01", end="2025-03-31", interval="6")
+    resp = await get_range(failing_chunk(noaa, "202502"), **params)
+    assert resp.status_code == 502 and resp.json()["detail"] == "NOAA error: No Predictions data was found."
+
+    # Stations with constituents fall back to a complete harmonic curve
+    engine = HarmonicEngine(str(tmp_path / "harmonics.db"), bundle_path=None)
+    engine.store(STATION)
+    monkeypatch.setattr(main, "harmonic_engine", engine)
+    monkeypatch.setattr(main, "TIDE_SOURCE", "fallback")
+    resp = await get_range(failing_chunk(noaa, "202502"), **{**params, "station": "9999999"})
+    meta = json.loads(resp.text.splitlines()[0])
+    assert resp.status_code == 200 and meta["source"] == "harmonic"
+    assert meta["count"] == 90 * 240 - 10
+    assert resp.headers["cache-control"] == "public, max-age=300"
+
+
+@pytest.mark.asyncio
+async def test_tide_range_validation(noaa):
+    for params in (
+        dict(begin="2025-01-01", interval="15"),
+        dict(begin="2025-01-01", format="csv"),
+        dict(begin="2025-01-01", points=2),
+        dict(begin="2025-01-01", end="2026-06-01"),
+        dict(begin="2025-02-01", end="2025-01-01"),
+        dict(begin="01/01/2025"),
+    ):
+        assert (await get_range(noaa, **params)).status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_tide_range_falls_back_to_harmonics(tmp_path, monkeypatch):
+    engine = HarmonicEngine(str(tmp_path / "harmonics.db"), bundle_path=None)
+    engine.store(STATION)
+    monkeypatch.setattr(main, "harmonic_engine", engine)
+    monkeypatch.setattr(main, "TIDE_SOURCE", "fallback")
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF", 0)
+    resp = await get_range(FakeUpstream(error_rate=1.0), station="9999999", begin="2025-06-01", end="2025-06-07")
+    assert resp.status_code == 200
+    meta = json.loads(resp.text.splitlines()[0])
+    assert meta["source"] == "harmonic" and meta["count"] == 7 * 24
+    assert resp.headers["cache-control"] == "public, max-age=300"
+
+    # Without harmonics for the station the upstream failure is reported
+    resp = await get_range(FakeUpstream(error_rate=1.0), station="8467150", begin="2025-06-01")
+    assert resp.status_code == 502 and resp.json()["detail"] == "upstream returned 503"
@@ -0,0 +1,136 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import datetime
+
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+import main
+import solunar
+import upstream
+from main import app
+from moon import julian_day, moon_altitude, moon_data
+from stations import StationIndex
+from tide_cache import PredictionCache
+from tests.test_tides import fake_upstream
+
+BOSTON = (42.3601, -71.0589, "America/New_York")
+SEATTLE = (47.6062, -122.3321, "America/Los_Angeles")
+APRIL = [datetime.date(2024, 4, 1) + datetime.timedelta(days=i) for i in range(10)]
+
+
+def test_events_match_moon_track():
+    events = solunar.solunar_events(APRIL, [BOSTON[0]], [BOSTON[1]], [BOSTON[2]])
+    for d in range(1, 4):
+        t = events["start"][0, d] + np.arange(0, 86400, 60.0)
+        alt, _ = moon_altitude(julian_day(t), BOSTON[0], BOSTON[1])
+        assert abs(events["transit"][0, d] - t[alt.argmax()]) < 10 * 60
+        assert abs(events["underfoot"][0, d] - t[alt.argmin()]) < 10 * 60
+    rise_set = moon_data(APRIL, BOSTON[0], BOSTON[1], BOSTON[2])
+    np.testing.assert_allclose(events["moonrise"][0, 1:-1], rise_set["moonrise"], atol=60)
+    np.testing.assert_allclose(events["moonset"][0, 1:-1], rise_set["moonset"], atol=60)
+
+
+def test_batch_matches_single_locations():
+    places = [BOSTON, SEATTLE]
+    both = solunar.solunar_events(APRIL, [p[0] for p in places], [p[1] for p in places], [p[2] for p in places])
+    for i, (lat, lon, tz) in enumerate(places):
+        one = solunar.solunar_events(APRIL, [lat], [lon], [tz])
+        for name in ("transit", "underfoot", "moonrise", "moonset"):
+            np.testing.assert_array_equal(both[name][i], one[name][0])
+
+
+def test_periods_and_tides_drive_scores():
+    events = solunar.solunar_events(APRIL, [BOSTON[0]], [BOSTON[1]], [BOSTON[2]])
+    plain = solunar.activity(events)
+    hourly = plain["hunting_hourly"][0, 0]
+    transit_hour = int((events["transit"][0, 1] - events["start"][0, 1]) // 3600)
+    assert hourly[transit_hour] == hourly.max() > 0
+    # A tide change in an otherwise quiet hour raises fishing there, not hunting
+    quiet = int(np.argmin(hourly))
+    turning = np.array([[events["start"][0, 1] + quiet * 3600 + 1800]])
+    tidal = solunar.activity(events, turning)
+    assert tidal["fishing_hourly"][0, 0, quiet] > plain["fishing_hourly"][0, 0, quiet]
+    np.testing.assert_array_equal(tidal["hunting_hourly"], plain["hunting_hourly"])
+    # New moon (2024-04-08) outscores the first quarter (2024-04-15) for the same periods
+    new, quarter = (datetime.date(2024, 4, 8), datetime.date(2024, 4, 15))
+    scores = solunar.activity(solunar.solunar_events([new, quarter], [BOSTON[0]] * 2, [BOSTON[1]] * 2, [BOSTON[2]] * 2))
+    assert scores["hunting"][0, 0] > scores["hunting"][0, 1]
+
+
+def test_forecast_shape():
+    days = solunar.forecast(APRIL[:3], [BOSTON[0]], [BOSTON[1]], [BOSTON[2]])[0]
+    assert [d["date"] for d in days] == ["2024-04-01", "2024-04-02", "2024-04-03"]
+    for day in days:
+        assert day["fishing"] in [name for _, name in solunar.FISHING_LABELS]
+        assert day["hunting"] in [name for _, name in solunar.HUNTING_LABELS]
+        assert len(day["hourly"]["fishing"]) == len(day["hourly"]["hunting"]) == 24
+        assert 1 <= len(day["major"]) <= 2 and len(day["minor"]) <= 2
+        assert day["tides"] is False
+
+
+def test_cache_round_trip(tmp_path):
+    cache = solunar.ForecastCache(str(tmp_path / "solunar.db"))
+    key = cache.key("8443970", *BOSTON[:2])
+    days = solunar.forecast(APRIL[:2], [BOSTON[0]], [BOSTON[1]], [BOSTON[2]])[0]
+    cache.put([(key, day) for day in days])
+    cache.clear()
+    assert cache.get(key, ["2024-04-01", "2024-04-02", "2024-04-03"]) == {d["date"]: d for d in days}
+    assert cache.get(key, ["2024-04-01"])["2024-04-01"] == days[0]
+    assert cache.stats()["disk_hits"] == 2 and cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_precompute_fetches_each_station_once(tmp_path):
+    index = StationIndex([
+        {"id": "A", "lat": 42.35, "lon": -71.05, "timezone": "America/New_York"},
+        {"id": "B", "lat": 47.60, "lon": -122.34, "timezone": "America/Los_Angeles"},
+    ])
+    calls = []
+
+    async def get_hilo(station, begin, end):
+        calls.append(station)
+        await asyncio.sleep(0)
+        days = {}
+        day = begin
+        while day <= end:
+            d = day.strftime("%Y-%m-%d")
+            days[d] = {"highs": [{"t": f"{d} 04:00"}], "lows": [{"t": f"{d} 10:12"}]}
+            day += datetime.timedelta(days=1)
+        return days, "noaa"
+
+    cache = solunar.ForecastCache(str(tmp_path / "solunar.db"))
+    locations = [(42.36, -71.06, None), (42.25, -70.80, "A"), (47.61, -122.33, None), (None, None, "A")]
+    stored = await solunar.precompute(cache, locations, index, get_hilo, days=30, start=APRIL[0])
+    assert stored == 3
+    assert sorted(calls) == ["A", "B"]
+    cached = cache.get(cache.key("B", 47.61, -122.33), [d.strftime("%Y-%m-%d") for d in APRIL])
+    assert len(cached) == 10 and all(day["tides"] for day in cached.values())
+
+
+@pytest.mark.asyncio
+async def test_predictions_week_endpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "hilo_cache", PredictionCache(str(tmp_path / "cache.db")))
+    monkeypatch.setattr(main, "forecast_cache", solunar.ForecastCache(str(tmp_path / "cache.db")))
+    calls = []
+    await upstream.start(transport=fake_upstream(calls))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            first = (await ac.get("/predictions/week")).json()
+            second = (await ac.get("/predictions/week")).json()
+            near = (await ac.get("/predictions/week", params={"lat": 41.17, "lon": -73.18})).json()
+        assert first == second
+        assert first["station"] == "8467150"
+        week = first["predictions"]
+        assert len(week) == 7 and week[0]["date"] == datetime.date.today().strftime("%Y-%m-%d")
+        assert all(day["tides"] for day in week)
+        assert main.forecast_cache.stats()["hits"] == 7
+        assert near["estimated"] is True and near["source_station"]["id"] == "8467150"
+        assert len(calls) == 1
+    finally:
+        await upstream.close()
@@ -0,0 +1,91 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+from main import app, station_index
+from stations import StationIndex, haversine, load_catalog, timezone_for
+
+
+def test_catalog_loaded():
+    assert len(station_index) > 3000
+    bridgeport = station_index.get("8467150")
+    assert bridgeport["name"] == "BRIDGEPORT"
+    assert bridgeport["timezone"] == "America/New_York"
+    assert timezone_for(-10) == "Pacific/Honolulu"
+    assert timezone_for(13) == "Etc/GMT-13"
+
+
+def test_kdtree_matches_brute_force():
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(-60, 70, 200)
+    lons = rng.uniform(-180, 180, 200)
+    for lat, lon in zip(lats, lons):
+        got = [s["id"] for s in station_index.nearest(lat, lon, k=5)]
+        dists = sorted((haversine(lat, lon, s["lat"], s["lon"]), s["id"]) for s in station_index.stations)
+        assert got == [sid for _, sid in dists[:5]]
+
+
+def test_nearest_by_type():
+    lat, lon = 42.36, -71.06
+    refs = station_index.nearest(lat, lon, k=3, types={"R"})
+    assert len(refs) == 3 and all(s["type"] == "R" for s in refs)
+    dists = sorted((haversine(lat, lon, s["lat"], s["lon"]), s["id"]) for s in station_index.stations if s["type"] == "R")
+    assert [s["id"] for s in refs] == [sid for _, sid in dists[:3]]
+    assert station_index.nearest(lat, lon, types={"X"}) == []
+
+
+def test_batch_matches_single_lookup():
+    lats = [41.05, 42.36, 21.3, 47.6]
+    lons = [-73.54, -71.06, -157.86, -122.33]
+    batch = station_index.nearest_batch(lats, lons, k=3)
+    for i in range(len(lats)):
+        single = station_index.nearest(lats[i], lons[i], k=3)
+        assert [s["id"] for s in batch[i]] == [s["id"] for s in single]
+        assert batch[i][0]["distance_km"] == pytest.approx(single[0]["distance_km"], abs=0.01)
+
+
+def test_empty_index(tmp_path):
+    db = str(tmp_path / "empty.db")
+    load_catalog(db, path=str(tmp_path / "missing.json"))
+    index = StationIndex.from_db(db)
+    assert index.nearest(41.0, -73.0) == []
+    assert index.nearest_batch([41.0], [-73.0]) == [[]]
+
+
+@pytest.mark.asyncio
+async def test_stations_nearby_endpoint():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/stations/nearby", params={"lat": 41.0534, "lon": -73.5387, "limit": 3})
+        assert resp.status_code == 200
+        stations = resp.json()["stations"]
+        assert len(stations) == 3
+        assert stations[0]["distance_km"] <= stations[1]["distance_km"] <= stations[2]["distance_km"]
+
+        resp = await ac.post("/stations/nearby/batch", json={"points": [{"lat": 41.0534, "lon": -73.5387}, {"lat": 21.3, "lon": -157.86}], "limit": 2})
+        assert resp.status_code == 200
+        results = resp.json()["results"]
+        assert results[0]["stations"][0]["id"] == stations[0]["id"]
+        assert results[1]["stations"][0]["state"] == "HI"
+
+
+@pytest.mark.asyncio
+async def test_stations_nearby_invalid():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.get("/stations/nearby", params={"lat": "north", "lon": 0})
+        assert resp.status_code == 422
+
+
+def test_nearest_ids_matches_kdtree():
+    rng = np.random.default_rng(7)
+    lats = rng.uniform(20, 60, 500)
+    lons = rng.uniform(-170, -60, 500)
+    ids = station_index.nearest_ids(lats, lons)
+    for sid, lat, lon in zip(ids, lats, lons):
+        s = station_index.get(sid)
+        # Compare distances: a few stations share identical coordinates
+        assert haversine(lat, lon, s["lat"], s["lon"]) == pytest.approx(station_index.nearest(lat, lon)[0]["distance_km"], abs=0.01)
@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import datetime
+
+import pytest
+from tide_cache import PredictionCache
+
+
+def make_fetch(calls, delay=0):
+    async def fetch(station, begin, end):
+        calls.append((station, begin, end))
+        await asyncio.sleep(delay)
+        days = {}
+        day = begin
+        while day <= end:
+            d = day.strftime("%Y-%m-%d")
+            days[d] = {"highs": [{"t": f"{d} 03:12", "v": "6.5", "type": "H"}], "lows": []}
+            day += datetime.timedelta(days=1)
+        return days
+    return fetch
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(tmp_path):
+    calls = []
+    cache = PredictionCache(str(tmp_path / "cache.db"), fetch=make_fetch(calls, delay=0.05))
+    day = datetime.date(2025, 4, 27)
+    week_end = day + datetime.timedelta(days=6)
+    results = await asyncio.gather(
+        cache.get_hilo("8467150", day, week_end),
+        cache.get_hilo("8467150", day, week_end),
+        cache.get_hilo("8467150", day, day),
+    )
+    assert len(calls) == 1
+    assert results[0] == results[1]
+    assert results[2]["2025-04-27"] == results[0]["2025-04-27"]
+    assert cache.stats()["coalesced"] == 8
+
+
+@pytest.mark.asyncio
+async def test_disk_tier_survives_restart_and_lru_evicts(tmp_path):
+    calls = []
+    db_path = str(tmp_path / "cache.db")
+    cache = PredictionCache(db_path, max_entries=3, fetch=make_fetch(calls))
+    day = datetime.date(2025, 4, 27)
+    await cache.get_hilo("8467150", day, day + datetime.timedelta(days=4))
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["evictions"] == 2
+
+    restarted = PredictionCache(db_path, fetch=make_fetch(calls))
+    result = await restarted.get_hilo("8467150", day, day + datetime.timedelta(days=4))
+    assert len(calls) == 1
+    assert len(result) == 5
+    assert restarted.stats()["disk_hits"] == 5
+
+
+@pytest.mark.asyncio
+async def test_empty_days_are_not_cached(tmp_path):
+    calls = []
+
+    async def failing_fetch(station, begin, end):
+        calls.append(station)
+        return {}
+
+    cache = PredictionCache(str(tmp_path / "cache.db"), fetch=failing_fetch)
+    day = datetime.date(2025, 4, 27)
+    assert (await cache.get_hilo("8467150", day, day))["2025-04-27"] == {"highs": [], "lows": []}
+    await cache.get_hilo("8467150", day, day)
+    assert len(calls) == 2
@@ -0,0 +1,261 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import asyncio
+import datetime
+
+import httpx
+import pytest
+from httpx import AsyncClient, ASGITransport
+import main
+from main import app
+import upstream
+from tide_cache import PredictionCache
+from tides import NOAA_API
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "hilo_cache", PredictionCache(str(tmp_path / "cache.db")))
+
+
+def fake_upstream(calls, noaa_failures=0):
+    def handler(request):
+        url = str(request.url).split("?")[0]
+        calls.append(request)
+        if url == NOAA_API:
+            if noaa_failures and sum(1 for r in calls if str(r.url).startswith(NOAA_API)) <= noaa_failures:
+                return httpx.Response(503)
+            begin = datetime.datetime.strptime(request.url.params["begin_date"], "%Y%m%d").date()
+            end = datetime.datetime.strptime(request.url.params["end_date"], "%Y%m%d").date()
+            predictions = []
+            day = begin
+            while day <= end:
+                d = day.strftime("%Y-%m-%d")
+                predictions.append({"t": f"{d} 03:12", "v": "6.512", "type": "H"})
+                predictions.append({"t": f"{d} 09:30", "v": "-0.210", "type": "L"})
+                day += datetime.timedelta(days=1)
+            return httpx.Response(200, json={"predictions": predictions})
+        return httpx.Response(404)
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_tide_week_single_range_request():
+    calls = []
+    await upstream.start(transport=fake_upstream(calls))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/tide/week", params={"station": "8467150"})
+        assert resp.status_code == 200
+        week = resp.json()["week"]
+        assert len(week) == 7
+        for day in week:
+            assert len(day["highs"]) == 1 and len(day["lows"]) == 1
+            assert day["highs"][0]["t"].startswith(day["date"])
+            assert day["moon_phase"] == day["moon"]["phase"]
+        noaa_calls = [c for c in calls if str(c.url).startswith(NOAA_API)]
+        assert len(noaa_calls) == len(calls) == 1
+        assert noaa_calls[0].url.params["begin_date"] == week[0]["date"].replace("-", "")
+        assert noaa_calls[0].url.params["end_date"] == week[-1]["date"].replace("-", "")
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_today_retries_upstream_errors(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF", 0)
+    calls = []
+    await upstream.start(transport=fake_upstream(calls, noaa_failures=1))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/tide/today", params={"station": "8467150", "date": "2025-04-27"})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["date"] == "2025-04-27"
+        assert data["highs"][0]["t"] == "2025-04-27 03:12"
+        assert data["lows"][0]["v"] == "-0.210"
+        assert data["moon_phase"] == "New Moon"
+        assert data["moon"]["moonrise"] < data["moon"]["moonset"]
+        assert len([c for c in calls if str(c.url).startswith(NOAA_API)]) == 2
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_today_and_week_report_upstream_failures(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF", 0)
+    await upstream.start(transport=fake_upstream([], noaa_failures=100))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            today = await ac.get("/tide/today", params={"station": "8467150", "date": "2025-04-27"})
+            week = await ac.get("/tide/week", params={"station": "8467150"})
+        for resp in (today, week):
+            assert resp.status_code == 502
+            assert resp.json()["detail"] == "upstream returned 503"
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_today_and_week_report_noaa_error_payloads(monkeypatch):
+    monkeypatch.setattr(main, "TIDE_SOURCE", "noaa")
+
+    def handler(request):
+        return httpx.Response(200, json={"error": {"message": "No Predictions data was found."}})
+
+    await upstream.start(transport=httpx.MockTransport(handler))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            today = await ac.get("/tide/today", params={"station": "nodata", "date": "2025-04-27"})
+            week = await ac.get("/tide/week", params={"station": "nodata"})
+        for resp in (today, week):
+            assert resp.status_code == 502
+            assert resp.json()["detail"] == "NOAA error: No Predictions data was found."
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_today_normalizes_and_validates_date():
+    calls = []
+    await upstream.start(transport=fake_upstream(calls))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.get("/tide/today", params={"station": "8467150", "date": "2025-4-7"})
+            bad = await ac.get("/tide/today", params={"station": "8467150", "date": "April 7"})
+        assert resp.status_code == 200
+        assert resp.json()["date"] == "2025-04-07"
+        assert resp.json()["highs"][0]["t"] == "2025-04-07 03:12"
+        assert bad.status_code == 400
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_week_served_from_cache():
+    calls = []
+    await upstream.start(transport=fake_upstream(calls))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            first = await ac.get("/tide/week", params={"station": "8467150"})
+            second = await ac.get("/tide/week", params={"station": "8467150"})
+            stats = (await ac.get("/cache/stats")).json()["hilo"]
+        assert first.json() == second.json()
+        assert len([c for c in calls if str(c.url).startswith(NOAA_API)]) == 1
+        assert stats["misses"] == 7 and stats["hits"] == 7
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_batch_dedupes_stations():
+    calls = []
+    await upstream.start(transport=fake_upstream(calls))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            resp = await ac.post("/tide/batch", json={
+                "begin": "2025-04-27", "end": "2025-04-29",
+                "items": [
+                    {"station": "8467150"},
+                    {"lat": 41.17, "lon": -73.18},  # Bridgeport, resolves to 8467150
+                    {"station": "8443970"},
+                    {"station": "8467150"},
+                    {"lat": 41.17},
+                ],
+            })
+        assert resp.status_code == 200
+        data = resp.json()
+        results = data["results"]
+        assert (data["begin"], data["end"]) == ("2025-04-27", "2025-04-29")
+        assert [r.get("station") for r in results] == ["8467150", "8467150", "8443970", "8467150", None]
+        assert [d["date"] for d in results[0]["days"]] == ["2025-04-27", "2025-04-28", "2025-04-29"]
+        assert results[0]["days"][0]["highs"][0]["t"] == "2025-04-27 03:12"
+        assert results[1]["estimated"] is True and results[1]["source_station"]["id"] == "8467150"
+        assert "estimated" not in results[0]
+        assert results[4]["error"] == "station or lat/lon required"
+        assert sorted(c.url.params["station"] for c in calls) == ["8443970", "8467150"]
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_batch_per_item_errors_and_concurrency_cap(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF", 0)
+    monkeypatch.setattr(main, "TIDE_BATCH_CONCURRENCY", 2)
+    ok = fake_upstream([])
+    active = {"now": 0, "max": 0}
+
+    async def handler(request):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        try:
+            await asyncio.sleep(0.01)
+            if request.url.params["station"] == "bad":
+                return httpx.Response(500)
+            return ok.handler(request)
+        finally:
+            active["now"] -= 1
+
+    await upstream.start(transport=httpx.MockTransport(handler))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            items = [{"station": s} for s in ["8467150", "bad", "8443970", "8447930", "8452660"]]
+            resp = await ac.post("/tide/batch", json={"begin": "2025-04-27", "items": items})
+        results = resp.json()["results"]
+        assert resp.status_code == 200
+        assert results[1] == {"request": {"station": "bad", "lat": None, "lon": None}, "station": "bad", "error": "upstream returned 500"}
+        assert all(len(r["days"]) == 1 for i, r in enumerate(results) if i != 1)
+        assert active["max"] == 2
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_batch_noaa_error_payload_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "TIDE_SOURCE", "fallback")
+    ok = fake_upstream([])
+    noaa_calls = []
+
+    def handler(request):
+        if request.url.params.get("station") in ("nodata", "9447130"):
+            noaa_calls.append(request)
+            return httpx.Response(200, json={"error": {"message": "No Predictions data was found."}})
+        return ok.handler(request)
+
+    await upstream.start(transport=httpx.MockTransport(handler))
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            items = [{"station": "nodata"}, {"station": "9447130"}, {"station": "8467150"}]
+            for _ in range(2):
+                resp = await ac.post("/tide/batch", json={"begin": "2025-04-27", "items": items})
+                results = resp.json()["results"]
+                assert resp.status_code == 200
+                assert results[0]["error"] == "NOAA error: No Predictions data was found."
+                # Stations with bundled constituents fall back to harmonic predictions
+                assert results[1]["source"] == "harmonic" and results[1]["days"][0]["highs"]
+                assert results[2]["source"] == "noaa"
+        # Nothing was cached for the failed stations, so the second batch asked again
+        assert len(noaa_calls) == 4
+    finally:
+        await upstream.close()
+
+
+@pytest.mark.asyncio
+async def test_tide_batch_validates_range():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        bad_date = await ac.post("/tide/batch", json={"begin": "04/27/2025", "items": []})
+        backwards = await ac.post("/tide/batch", json={"begin": "2025-04-27", "end": "2025-04-20", "items": []})
+        too_long = await ac.post("/tide/batch", json={"begin": "2025-01-01", "end": "2025-06-01", "items": []})
+    assert bad_date.status_code == backwards.status_code == too_long.status_code == 400
@@ -0,0 +1,212 @@
+import asyncio
+import datetime
+import json
+import threading
+from collections import OrderedDict
+
+from db import database
+from metrics import stage
+
+from tides import NOAA_DATUM, NOAA_DEFAULT_STATION, NOAA_TIMEZONE, NOAA_UNITS, fetch_hilo
+
+
+class PredictionCache:
+    """Hilo predictions cached per (station, date, datum, units, time_zone).
+
+    Tier 1 is an in-process LRU bounded to ``max_entries`` days, tier 2 is the
+    ``prediction_cache`` table in SQLite, which survives restarts and is shared
+    by all uvicorn workers. Concurrent misses for the same day share a single
+    upstream fetch.
+    """
+
+    def __init__(self, db_path, max_entries=4096, fetch=fetch_hilo):
+        self.db_path = db_path
+        self.db = database(db_path)
+        self.max_entries = max_entries
+        self.fetch = fetch
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.init_db()
+
+    def init_db(self):
+        conn = self.db.conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS prediction_cache (
+            station TEXT,
+            date TEXT,
+            datum TEXT,
+            units TEXT,
+            time_zone TEXT,
+            payload TEXT,
+            fetched_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (station, date, datum, units, time_zone)
+        )''')
+        conn.commit()
+
+    @staticmethod
+    def key(station, date):
+        return (station, date, NOAA_DATUM, NOAA_UNITS, NOAA_TIMEZONE)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def missing(self, station, begin, end):
+        """Dates in [begin, end] held by neither tier. Not counted in ``stats``."""
+        dates = []
+        day = begin
+        while day <= end:
+            key = self.key(station, day.strftime("%Y-%m-%d"))
+            with self._lock:
+                cached = key in self._lru
+            if not cached:
+                dates.append(key)
+            day += datetime.timedelta(days=1)
+        found = self._get_disk(dates) if dates else {}
+        return [key[1] for key in dates if key not in found]
+
+    def cached(self, station, begin, end):
+        """Days of [begin, end] when the memory tier holds all of them, else None."""
+        result = {}
+        day = begin
+        while day <= end:
+            date = day.strftime("%Y-%m-%d")
+            value = self._get_memory(self.key(station or NOAA_DEFAULT_STATION, date))
+            if value is None:
+                return None
+            result[date] = value
+            day += datetime.timedelta(days=1)
+        self.hits += len(result)
+        return result
+
+    # --- memory tier ---
+    def _get_memory(self, key):
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+            return value
+
+    def _put_memory(self, key, value):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+
+    # --- disk tier ---
+    def _get_disk(self, keys):
+        conn = self.db.conn()
+        found = {}
+        with stage("db_read"):
+            for key in keys:
+                row = conn.execute(
+                    "SELECT payload FROM prediction_cache WHERE station=? AND date=? AND datum=? AND units=? AND time_zone=?",
+                    key,
+                ).fetchone()
+                if row:
+                    found[key] = json.loads(row[0])
+        return found
+
+    def _put_disk(self, items):
+        conn = self.db.conn()
+        with stage("db_write"), conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO prediction_cache (station, date, datum, units, time_zone, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                [key + (json.dumps(value),) for key, value in items],
+            )
+
+    async def get_hilo(self, station, begin, end):
+        """Same contract as ``tides.fetch_hilo``, served from cache where possible."""
+        station = station or NOAA_DEFAULT_STATION
+        dates = []
+        day = begin
+        while day <= end:
+            dates.append(day.strftime("%Y-%m-%d"))
+            day += datetime.timedelta(days=1)
+
+        result = {}
+        missing = []
+        for date in dates:
+            value = self._get_memory(self.key(station, date))
+            if value is not None:
+                self.hits += 1
+                result[date] = value
+            else:
+                missing.append(date)
+        if not missing:
+            return result
+
+        found = await asyncio.to_thread(self._get_disk, [self.key(station, d) for d in missing])
+        waiting = {}
+        owned = []
+        for date in missing:
+            key = self.key(station, date)
+            if key in found:
+                self.disk_hits += 1
+                self._put_memory(key, found[key])
+                result[date] = found[key]
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[date] = self._inflight[key]
+            else:
+                self.misses += 1
+                owned.append(date)
+
+        if owned:
+            loop = asyncio.get_running_loop()
+            futures = {d: loop.create_future() for d in owned}
+            for d, fut in futures.items():
+                self._inflight[self.key(station, d)] = fut
+            try:
+                first = datetime.date.fromisoformat(owned[0])
+                last = datetime.date.fromisoformat(owned[-1])
+                fetched = await self.fetch(station, first, last)
+                to_store = []
+                for d in owned:
+                    value = fetched.get(d, {"highs": [], "lows": []})
+                    result[d] = value
+                    futures[d].set_result(value)
+                    # Empty days usually mean an upstream error; don't pin them
+                    if value["highs"] or value["lows"]:
+                        self._put_memory(self.key(station, d), value)
+                        to_store.append((self.key(station, d), value))
+                if to_store:
+                    await asyncio.to_thread(self._put_disk, to_store)
+            except BaseException as exc:
+                for fut in futures.values():
+                    if fut.done():
+                        continue
+                    if isinstance(exc, asyncio.CancelledError):
+                        fut.cancel()
+                    else:
+                        fut.set_exception(exc)
+                        # Mark retrieved so unawaited futures don't warn
+                        fut.exception()
+                raise
+            finally:
+                for d in owned:
+                    self._inflight.pop(self.key(station, d), None)
+
+        for date, fut in waiting.items():
+            result[date] = await fut
+        return {d: result[d] for d in dates}
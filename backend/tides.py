@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+import logging
+import os
+
+import numpy as np
+
+import upstream
+
+logger = logging.getLogger("tide.tides")
+
+NOAA_DEFAULT_STATION = "8467150"  # Bridgeport, CT (fallback)
+NOAA_PRODUCT = "predictions"
+NOAA_DATUM = "MLLW"
+NOAA_UNITS = "english"
+NOAA_TIMEZONE = "lst_ldt"
+NOAA_LOCAL_TZ = "America/New_York"  # lst_ldt for the hardcoded New England stations
+# NOAA's longest range per request for each series interval
+SERIES_CHUNK_DAYS = {"6": 31, "h": 365}
+NOAA_API = os.getenv("NOAA_API_URL", "https://api.tidesandcurrents.noaa.gov/api/prod/datagetter")
+
+
+def split_hilo(predictions):
+    highs = [t for t in predictions if t["type"] == "H"]
+    lows = [t for t in predictions if t["type"] == "L"]
+    return {"highs": highs, "lows": lows}
+
+
+def noaa_error(data):
+    """ValueError for a datagetter ``{"error": {"message": ...}}`` payload."""
+    error = data["error"]
+    return ValueError(f"NOAA error: {error.get('message', error) if isinstance(error, dict) else error}")
+
+
+async def fetch_hilo(station, begin, end):
+    """Fetch hilo predictions for [begin, end] in one request.
+
+    Returns a dict of "YYYY-MM-DD" -> {"highs": [...], "lows": [...]} with an
+    entry for every day in the range.
+    """
+    params = {
+        "station": station or NOAA_DEFAULT_STATION,
+        "product": NOAA_PRODUCT,
+        "begin_date": begin.strftime("%Y%m%d"),
+        "end_date": end.strftime("%Y%m%d"),
+        "datum": NOAA_DATUM,
+        "units": NOAA_UNITS,
+        "time_zone": NOAA_TIMEZONE,
+        "format": "json",
+        "interval": "hilo"
+    }
+    data = await upstream.get_json(NOAA_API, params=params)
+    if "error" in data:
+        # e.g. an unknown station or a range without predictions; never cache it as empty days
+        raise noaa_error(data)
+    by_day = {}
+    for t in data.get("predictions", []):
+        by_day.setdefault(t["t"][:10], []).append(t)
+    days = {}
+    day = begin
+    while day <= end:
+        key = day.strftime("%Y-%m-%d")
+        days[key] = split_hilo(by_day.get(key, []))
+        day += datetime.timedelta(days=1)
+    return days
+
+
+async def fetch_series(station, start, stop, interval="h"):
+    """Water levels every 6 minutes (``interval="6"``) or hour (``"h"``) for Unix seconds [start, stop).
+
+    Requested in GMT so times are unambiguous across DST changes, in as few
+    requests as NOAA's range limits allow. Returns (times, heights) arrays.
+    """
+    first = datetime.datetime.fromtimestamp(start, datetime.timezone.utc).date()
+    last = datetime.datetime.fromtimestamp(stop - 1, datetime.timezone.utc).date()
+    chunks = []
+    day = first
+    while day <= last:
+        chunk_end = min(last, day + datetime.timedelta(days=SERIES_CHUNK_DAYS[interval] - 1))
+        chunks.append((day, chunk_end))
+        day = chunk_end + datetime.timedelta(days=1)
+    pages = await asyncio.gather(*(upstream.get_json(NOAA_API, params={
+        "station": station or NOAA_DEFAULT_STATION,
+        "product": NOAA_PRODUCT,
+        "begin_date": b.strftime("%Y%m%d"),
+        "end_date": e.strftime("%Y%m%d"),
+        "datum": NOAA_DATUM,
+        "units": NOAA_UNITS,
+        "time_zone": "gmt",
+        "format": "json",
+        "interval": interval,
+    }) for b, e in chunks))
+    times, heights = [], []
+    for data in pages:
+        if "error" in data:
+            # A failed chunk would leave a hole in the curve; fail the whole range instead
+            raise noaa_error(data)
+        for p in data.get("predictions", []):
+            if p["v"] != "":
+                times.append(p["t"])
+                heights.append(p["v"])
+    if not times:
+        raise ValueError(f"no {interval} predictions from NOAA for {station}")
+    t = np.array(times, dtype="datetime64[m]").astype(np.int64) * 60.0
+    v = np.array(heights, dtype=float)
+    keep = (t >= start) & (t < stop)
+    return t[keep], v[keep]
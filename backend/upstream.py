@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import observe_upstream
+
+logger = logging.getLogger("tide.upstream")
+
+# Pool / retry settings (override via .env)
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "50"))
+UPSTREAM_MAX_PER_HOST = int(os.getenv("UPSTREAM_MAX_PER_HOST", "10"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", "0.2"))
+# Requests/s across all hosts and callers (0 = unlimited); bursts up to UPSTREAM_RATE_BURST
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", "0"))
+UPSTREAM_RATE_BURST = float(os.getenv("UPSTREAM_RATE_BURST", "10"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_client = None
+_host_limits = {}
+
+
+class RateLimiter:
+    """Token bucket: ``rate`` acquisitions per second, up to ``burst`` at once."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+_rate_limit = RateLimiter(UPSTREAM_RATE_LIMIT, UPSTREAM_RATE_BURST)
+
+
+async def start(transport=None):
+    """Open the shared HTTP client. Called from the app lifespan."""
+    global _client, _rate_limit
+    if _client is not None:
+        await close()
+    _client = httpx.AsyncClient(
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+        ),
+        transport=transport,
+    )
+    _host_limits.clear()
+    _rate_limit = RateLimiter(UPSTREAM_RATE_LIMIT, UPSTREAM_RATE_BURST)
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _host_limits.clear()
+
+
+async def get_client():
+    # Lazily open the client when running without a lifespan (e.g. tests)
+    if _client is None:
+        await start()
+    return _client
+
+
+def _host_limit(url):
+    host = urlsplit(url).netloc
+    sem = _host_limits.get(host)
+    if sem is None:
+        sem = _host_limits[host] = asyncio.Semaphore(UPSTREAM_MAX_PER_HOST)
+    return sem
+
+
+async def get_json(url, params=None, retries=None):
+    """GET a JSON document, retrying transport errors and 429/5xx with backoff."""
+    client = await get_client()
+    retries = UPSTREAM_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        host = urlsplit(url).netloc
+        try:
+            await _rate_limit.acquire()
+            async with _host_limit(url):
+                start = time.perf_counter()
+                try:
+                    resp = await client.get(url, params=params)
+                except httpx.TransportError as exc:
+                    observe_upstream(host, type(exc).__name__, time.perf_counter() - start)
+                    raise
+                observe_upstream(host, resp.status_code, time.perf_counter() - start)
+            if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                resp.raise_for_status()
+                return resp.json()
+            logger.debug("upstream %s returned %s, retrying", url, resp.status_code)
+        except httpx.TransportError as exc:
+            if attempt >= retries:
+                raise
+            logger.debug("upstream %s failed (%r), retrying", url, exc)
+        delay = UPSTREAM_BACKOFF * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, delay))
+        attempt += 1